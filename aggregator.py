@@ -1,122 +1,403 @@
 import pandas as pd
 import glob
 import os
-import datetime
-import subprocess
-import time
 import argparse
 import traceback
 import sys
+import json
+import shutil
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
 
-def run_git_command(command, cwd, check_exit_code=True, input=None):
-    """Helper function to run git commands."""
+from columnar_store import COLUMNAR_DIRNAME, write_columnar_store
+from data_store import (
+    CSV_FILENAME,
+    DATA_DB_FILENAME,
+    ROW_ID_COLUMN,
+    ROW_VERSION_COLUMN,
+    SHEET_NAME_ATTR,
+    SYNC_STATE_FILENAME,
+    connect_store,
+    stored_batches,
+    update_data_store,
+)
+from dataset_types import CATEGORY_COLUMN_NAME, DATE_COLUMN_NAME, OPERATOR_COLUMN_NAME, apply_dtypes
+from excel_reader import ENGINES, read_report_sheets
+from file_utils import file_sha256
+from publisher import PUBLISH_STATE_FILENAME, DirectoryTarget, GitTarget, HttpTarget, PublishError, Publisher
+from rollup import ROLLUP_FILENAME, merge_rollups, rollup_frames
+from search_index import SEARCH_DB_FILENAME, indexed_batches, update_search_index
+
+MANIFEST_DIRNAME = ".aggregator_cache"
+MANIFEST_FILENAME = "manifest.json"
+# Lotti rimossi conservati nel manifest: i client con una versione precedente all'ultimo lotto dimenticato
+# ricevono l'intero dataset da `/api/data/changes` (vedi `min_version`)
+MAX_REMOVED_BATCHES = 1000
+
+
+def parse_workbook(file, engine=None):
+    """Legge i fogli "Operatore_Categoria" di un file Excel e restituisce la lista dei DataFrame."""
+    frames = []
+    # Logo e titolo (righe 1-2) vengono saltati dal lettore
+    for sheet_name, df_sheet in read_report_sheets(file, engine=engine):
+        # Extract Operatore and Categoria from sheet_name
+        parts = sheet_name.split('_')
+        if len(parts) >= 2:
+            operator_name = parts[0]
+            category = parts[1]
+            df_sheet[OPERATOR_COLUMN_NAME] = operator_name
+            df_sheet[CATEGORY_COLUMN_NAME] = category # Add Categoria column
+        else:
+            df_sheet[OPERATOR_COLUMN_NAME] = "Sconosciuto"
+            df_sheet[CATEGORY_COLUMN_NAME] = "Sconosciuto"
+        # Chiave (file, foglio) delle righe nell'archivio SQLite
+        df_sheet.attrs[SHEET_NAME_ATTR] = sheet_name
+
+        frames.append(df_sheet)
+
+    return frames
+
+
+def _load_manifest(cache_dir):
+    manifest_path = os.path.join(cache_dir, MANIFEST_FILENAME)
+    manifest = {}
     try:
-        result = subprocess.run(command, cwd=cwd, check=check_exit_code, capture_output=True, text=True, input=input)
-        print(f"Git command output: {result.stdout.strip()}")
-        return result.stdout, result.returncode
-    except subprocess.CalledProcessError as e:
-        print(f"Error running Git command: {e}")
-        print(f"Stdout: {e.stdout.strip()}")
-        print(f"Stderr: {e.stderr.strip()}")
-        return None, e.returncode
-
-def aggregate_data():
-    base_dir = os.path.dirname(os.path.abspath(__file__))
-    search_pattern = os.path.join(base_dir, "OpzioniEsportazione*.xlsx")
-    excel_files = glob.glob(search_pattern)
-    # Tieni traccia del file Excel più recente per l'email
-    latest_excel = None
-    if excel_files:
-        latest_excel = max(excel_files, key=os.path.getmtime)
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        pass
+    manifest.setdefault("files", {})
+    # Numero di sequenza dell'ultima ingestione e lotti rimossi ([seq, rimosso alla versione])
+    manifest.setdefault("sequence", 0)
+    manifest.setdefault("removed", [])
+    # Versione minima per la sincronizzazione incrementale: i lotti rimossi prima non sono più elencati
+    manifest.setdefault("min_version", 0)
+    return manifest
+
+
+def _save_manifest(cache_dir, manifest):
+    manifest_path = os.path.join(cache_dir, MANIFEST_FILENAME)
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+    # Rimuove le righe salvate di file cancellati o sostituiti
+    referenced = {entry["rows_file"] for entry in manifest["files"].values()}
+    for name in os.listdir(cache_dir):
+        if name.endswith(".pkl") and name not in referenced:
+            os.remove(os.path.join(cache_dir, name))
+
+
+def _with_row_versions(frames, seq):
+    """Aggiunge a ogni riga il numero di sequenza dell'ingestione (`_version`) e un id stabile (`_id`)."""
+    versioned = []
+    offset = 0
+    for df in frames:
+        df = df.copy()
+        df[ROW_VERSION_COLUMN] = seq
+        df[ROW_ID_COLUMN] = [f"{seq}-{i}" for i in range(offset, offset + len(df))]
+        offset += len(df)
+        versioned.append(df)
+    return versioned
 
-    all_dfs = []
 
+def _parse_one(file, engine=None):
+    # Eseguita nei processi worker: restituisce i fogli oppure l'eccezione, per segnalarla per file
+    try:
+        return parse_workbook(file, engine=engine)
+    except Exception as e:
+        return e
+
+
+def parse_workbooks(files, workers=1, engine=None):
+    """
+    Legge i file indicati e restituisce un dizionario file -> lista di DataFrame (o eccezione).
+    Con `workers` > 1 i file vengono distribuiti su un ProcessPoolExecutor.
+    """
+    if workers <= 1 or len(files) <= 1:
+        return {file: _parse_one(file, engine) for file in files}
+    with ProcessPoolExecutor(max_workers=min(workers, len(files))) as executor:
+        futures = {file: executor.submit(_parse_one, file, engine) for file in files}
+        results = {}
+        for file, future in futures.items():
+            try:
+                results[file] = future.result()
+            except Exception as e:
+                results[file] = e
+        return results
+
+
+def collect_sheet_frames(base_dir, excel_files, full_rebuild=False, workers=1, engine=None, skip_seqs=None):
+    """
+    Restituisce i DataFrame dei fogli di tutti i file Excel, nello stesso ordine di `excel_files`.
+    Usa il manifest in `.aggregator_cache` per rileggere solo i file nuovi o modificati;
+    le righe dei file cancellati o sostituiti vengono scartate. Le righe dei file non modificati
+    il cui numero di sequenza è in `skip_seqs` (già presenti nell'archivio) non vengono caricate.
+    I file da rileggere possono essere letti in parallelo su `workers` processi,
+    con il backend di lettura `engine` (vedi `excel_reader`).
+
+    Ogni file letto riceve un numero di sequenza crescente, riportato sulle sue righe
+    (`_version`, `_id`); i file rimossi o sostituiti vengono registrati in `removed`.
+    Restituisce anche il manifest aggiornato.
+    """
+    cache_dir = os.path.join(base_dir, MANIFEST_DIRNAME)
+    os.makedirs(cache_dir, exist_ok=True)
+    manifest = _load_manifest(cache_dir)
+    old_entries = manifest["files"]
+    sequence = manifest["sequence"]
+    new_entries = {}
+    all_frames = []
+
+    # 1. Per ogni file decidiamo se riusare le righe del manifest o rileggerlo
+    plans = []
     for file in excel_files:
+        name = os.path.relpath(file, base_dir)
+        plan = {"file": file, "name": name, "entry": None, "content_hash": None, "frames": None, "skipped": False}
         try:
-            # Read all sheets from the Excel file
-            xls = pd.ExcelFile(file)
-            
-            for sheet_name in xls.sheet_names:
-                # Skip sheets that are not the processed data (e.g., original "Foglio1" or "Sheet1")
-                # Assuming processed sheets have an underscore, like "Operatore_Categoria"
-                if "_" not in sheet_name:
-                    continue
-
-                df_sheet = pd.read_excel(xls, sheet_name=sheet_name, skiprows=2) # Skip logo and title rows
-                
-                # Extract Operatore and Categoria from sheet_name
-                parts = sheet_name.split('_')
-                if len(parts) >= 2:
-                    operator_name = parts[0]
-                    category = parts[1]
-                    df_sheet['Operatore'] = operator_name
-                    df_sheet['Categoria'] = category # Add Categoria column
+            stat = os.stat(file)
+            plan["stat"] = stat
+            previous = old_entries.get(name)
+            if previous and os.path.exists(os.path.join(cache_dir, previous["rows_file"])):
+                # Stessa dimensione e mtime: il file non è cambiato, evitiamo anche l'hash
+                if full_rebuild or previous["size"] != stat.st_size or previous["mtime_ns"] != stat.st_mtime_ns:
+                    plan["content_hash"] = file_sha256(file)
+                    if plan["content_hash"] == previous["sha256"]:
+                        plan["entry"] = previous
                 else:
-                    df_sheet['Operatore'] = "Sconosciuto"
-                    df_sheet['Categoria'] = "Sconosciuto"
+                    plan["entry"] = previous
+                if plan["entry"] and not full_rebuild:
+                    if skip_seqs is not None and previous.get("seq") in skip_seqs and "rollup" in previous:
+                        plan["frames"] = []
+                        plan["skipped"] = True
+                    else:
+                        plan["frames"] = pd.read_pickle(os.path.join(cache_dir, previous["rows_file"]))
+            if plan["frames"] is None:
+                plan["content_hash"] = plan["content_hash"] or file_sha256(file)
+        except Exception as e:
+            print(f"Errore durante l'elaborazione del file {file}: {e}")
+            continue
+        plans.append(plan)
+
+    # 2. Lettura (eventualmente parallela) dei soli file nuovi o modificati
+    parsed = parse_workbooks([plan["file"] for plan in plans if plan["frames"] is None], workers=workers, engine=engine)
 
-                all_dfs.append(df_sheet)
+    # 3. Unione dei risultati nell'ordine dei file, indipendente dall'ordine di completamento
+    for plan in plans:
+        file, name, stat = plan["file"], plan["name"], plan["stat"]
+        entry = plan["entry"]
+        frames = plan["frames"]
+
+        try:
+            if frames is None:
+                frames = parsed[file]
+                if isinstance(frames, Exception):
+                    raise frames
+                if entry is None:
+                    content_hash = plan["content_hash"]
+                    entry = {"sha256": content_hash, "rows_file": f"{content_hash}.pkl"}
+                pd.to_pickle(frames, os.path.join(cache_dir, entry["rows_file"]))
+                # Contributo del file al cubo giorno × operatore × categoria
+                entry["rollup"] = rollup_frames(frames)
+                print(f"Letto file {name}: {sum(len(df) for df in frames)} righe")
 
         except Exception as e:
             print(f"Errore durante l'elaborazione del file {file}: {e}")
+            continue
+
+        if "rollup" not in entry:
+            entry["rollup"] = rollup_frames(frames)
+        if "seq" not in entry:
+            sequence += 1
+            entry["seq"] = sequence
+        entry.update({
+            "path": name,
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "rows": entry["rows"] if plan["skipped"] else sum(len(df) for df in frames),
+        })
+        new_entries[name] = entry
+        all_frames.extend(_with_row_versions(frames, entry["seq"]))
+
+    # Le ingestioni non più presenti (file cancellati o sostituiti) diventano lotti rimossi
+    current_seqs = {entry["seq"] for entry in new_entries.values()}
+    for entry in old_entries.values():
+        if "seq" in entry and entry["seq"] not in current_seqs:
+            sequence += 1
+            manifest["removed"].append([entry["seq"], sequence])
+    if len(manifest["removed"]) > MAX_REMOVED_BATCHES:
+        pruned = manifest["removed"][:-MAX_REMOVED_BATCHES]
+        manifest["removed"] = manifest["removed"][-MAX_REMOVED_BATCHES:]
+        manifest["min_version"] = max(manifest["min_version"], max(removed_at for _, removed_at in pruned))
+
+    manifest["files"] = new_entries
+    manifest["sequence"] = sequence
+    _save_manifest(cache_dir, manifest)
+    return all_frames, manifest
+
 
-    output_csv_path = os.path.join(base_dir, "aggregated_data.csv")
-    output_csv_filename = "aggregated_data.csv"
+def write_sync_state(path, manifest):
+    """Scrive versione corrente del dataset e lotti rimossi, usati da `/api/data/changes`."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": manifest["sequence"], "removed": manifest["removed"], "min_version": manifest["min_version"]}, f)
+    os.replace(tmp_path, path)
 
+
+def _remove_exports(csv_path, columnar_path):
+    """Rimuove CSV e archivio Arrow di un'aggregazione precedente, che con l'export disattivato resterebbero vecchi."""
+    if os.path.exists(csv_path):
+        os.remove(csv_path)
+        print(f"Export disattivato: rimosso {csv_path}")
+    if os.path.isdir(columnar_path):
+        shutil.rmtree(columnar_path)
+        print(f"Export disattivato: rimosso {columnar_path}")
+
+
+def published_files():
+    """File pubblicati dopo l'aggregazione, relativi alla cartella del progetto.
+
+    Il file di versione è l'ultimo: chi lo legge trova già pubblicati dati almeno altrettanto recenti.
+    CSV e archivio Arrow sono nell'elenco anche con l'export disattivato (`--no-csv`), così la loro rimozione viene pubblicata.
+    """
+    return [CSV_FILENAME, COLUMNAR_DIRNAME, DATA_DB_FILENAME, ROLLUP_FILENAME, SEARCH_DB_FILENAME, SYNC_STATE_FILENAME]
+
+
+def default_publisher(publish_dir=None, base_dir=None, publish_url=None):
+    """
+    Publisher dei dati aggregati: commit e push su git, oppure copia in `publish_dir`, oppure invio
+    a `publish_url` (`/api/ingest` del server, con il token nella variabile d'ambiente INGEST_TOKEN).
+    """
+    base_dir = base_dir or os.path.dirname(os.path.abspath(__file__))
+    if publish_url:
+        token = os.environ.get("INGEST_TOKEN")
+        if not token:
+            raise PublishError("Variabile d'ambiente INGEST_TOKEN non impostata: necessaria per --publish-url")
+        target = HttpTarget(publish_url, token, base_dir, bundle_path=os.path.join(base_dir, MANIFEST_DIRNAME, "bundle.zip"))
+    elif publish_dir:
+        target = DirectoryTarget(publish_dir, base_dir)
+    else:
+        target = GitTarget(base_dir)
+    return Publisher(target, base_dir, state_path=os.path.join(base_dir, MANIFEST_DIRNAME, PUBLISH_STATE_FILENAME))
+
+
+def commit_data(publisher, export_csv=True, base_dir=None):
+    """
+    Registra i file aggregati con `publisher` se sono cambiati dall'ultima pubblicazione.
+    Restituisce True se c'è qualcosa da inviare con `publisher.push()`.
+    """
+    base_dir = base_dir or os.path.dirname(os.path.abspath(__file__))
+    output_filename = CSV_FILENAME if export_csv else DATA_DB_FILENAME
+    output_path = os.path.join(base_dir, output_filename)
+    if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+        print(f"Warning: {output_filename} does not exist or is empty. Skipping publish.")
+        return False
+    return publisher.commit(published_files())
+
+
+def aggregate_data(full_rebuild=False, workers=1, engine=None, export_csv=True, publish=True, publisher=None):
+    """
+    Aggrega i file Excel e, con `publish`, pubblica i dati se sono cambiati.
+    Se `publisher` è indicato il push resta in background (il chiamante attende con `publisher.flush()`),
+    altrimenti si usa `default_publisher()` e si attende la fine del push.
+    """
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    search_pattern = os.path.join(base_dir, "OpzioniEsportazione*.xlsx")
+    excel_files = sorted(glob.glob(search_pattern))
+    # Tieni traccia del file Excel più recente per l'email
+    latest_excel = None
+    if excel_files:
+        latest_excel = max(excel_files, key=os.path.getmtime)
+
+    output_csv_path = os.path.join(base_dir, CSV_FILENAME)
+    output_columnar_path = os.path.join(base_dir, COLUMNAR_DIRNAME)
+    output_store_path = os.path.join(base_dir, DATA_DB_FILENAME)
+    output_search_path = os.path.join(base_dir, SEARCH_DB_FILENAME)
+
+    skip_seqs = None
+    if not export_csv and not full_rebuild:
+        # Senza export servono solo le righe dei lotti che mancano nell'archivio o nell'indice di ricerca
+        with closing(connect_store(output_store_path)) as conn:
+            skip_seqs = stored_batches(conn)
+        with closing(sqlite3.connect(output_search_path)) as conn:
+            skip_seqs &= indexed_batches(conn)
+
+    all_dfs, manifest = collect_sheet_frames(base_dir, excel_files, full_rebuild=full_rebuild, workers=workers, engine=engine, skip_seqs=skip_seqs)
+
+    # Archivio SQLite servito da main.py: si scrivono solo i fogli dei lotti nuovi e si eliminano quelli rimossi
+    with closing(connect_store(output_store_path)) as conn:
+        sources = {entry["seq"]: entry["path"] for entry in manifest["files"].values()}
+        added_rows, removed_rows = update_data_store(conn, all_dfs, sources, manifest["sequence"], full_rebuild=full_rebuild)
+    print(f"Archivio {output_store_path} aggiornato ({added_rows} righe scritte, {removed_rows} eliminate)")
+
+    final_df = pd.DataFrame()
     if all_dfs:
         final_df = pd.concat(all_dfs, ignore_index=True)
         final_df.columns = final_df.columns.str.strip()
         final_df.dropna(how='all', inplace=True)
+        # Stessi tipi compatti dell'archivio (categorie, date, interi nullable)
+        final_df = apply_dtypes(final_df)
+        # Righe ordinate per data (ordinamento stabile, righe senza data in fondo), come nell'archivio
+        if DATE_COLUMN_NAME in final_df.columns:
+            final_df = final_df.sort_values(DATE_COLUMN_NAME, kind='stable', na_position='last')
+
+    if export_csv:
         final_df.to_csv(output_csv_path, index=False)
         print(f"Dati aggregati e salvati in {output_csv_path}")
         print(f"DEBUG: Size of saved CSV: {os.path.getsize(output_csv_path)} bytes")
 
-        time.sleep(1)
-
+        # Archivio colonnare tipizzato accanto al CSV, usato da /api/data/stream
         try:
-            if not os.path.exists(output_csv_path) or os.path.getsize(output_csv_path) == 0:
-                print(f"Warning: {output_csv_filename} does not exist or is empty. Skipping Git operations.")
-                return None
-
-            # Force remove from cache if it was previously tracked, then add again
-            print(f"Attempting to remove {output_csv_filename} from Git cache (if present).")
-            run_git_command(["git", "rm", "--cached", output_csv_filename], base_dir, check_exit_code=False)
-
-            # Add the file to staging area
-            print(f"DEBUG: Attempting to add {output_csv_filename} to Git staging area.")
-            run_git_command(["git", "add", output_csv_filename], base_dir)
-
-            # Check what Git has staged for this file
-            stdout_ls_files_staged, returncode_ls_files_staged = run_git_command(["git", "ls-files", "--stage", output_csv_filename], base_dir)
-            print(f"DEBUG: git ls-files --stage output: '{stdout_ls_files_staged.strip()}'")
-
-            # Check if aggregated_data.csv is modified (M) or added (A) in git status --porcelain
-            stdout_status, returncode_status = run_git_command(["git", "status", "--porcelain", output_csv_filename], base_dir)
-
-            # Strip any leading/trailing whitespace, including newlines
-            stdout_status = stdout_status.strip()
-
-            # Always attempt to commit and push if we reached this point
-            print(f"Attempting to commit and push changes for {output_csv_filename}...")
+            if final_df.empty:
+                # Nessuna riga: senza archivio colonnare /api/data/stream legge l'archivio SQLite
+                shutil.rmtree(output_columnar_path, ignore_errors=True)
+            else:
+                write_columnar_store(final_df, output_columnar_path)
+                print(f"Dati aggregati salvati anche in formato Arrow in {output_columnar_path}")
+        except Exception as e:
+            print(f"Errore durante la scrittura dell'archivio colonnare: {e}")
+    else:
+        _remove_exports(output_csv_path, output_columnar_path)
 
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            commit_message = f"Automated data aggregation update - {timestamp}"
-            run_git_command(["git", "commit", "--allow-empty", "-F", "-"], base_dir, input=commit_message)
+    # Cubo di riepilogo: somma dei contributi per file salvati nel manifest
+    output_rollup_path = os.path.join(base_dir, ROLLUP_FILENAME)
+    rollup_df = merge_rollups([entry["rollup"] for entry in manifest["files"].values()])
+    rollup_df.to_csv(output_rollup_path, index=False)
+    print(f"Riepilogo giornaliero salvato in {output_rollup_path}")
 
-            run_git_command(["git", "push", "origin", "main"], base_dir)
-            print("Git push completed.")
+    # Indice di ricerca testuale: si indicizzano solo i lotti nuovi e si cancellano quelli rimossi
+    try:
+        with closing(sqlite3.connect(output_search_path)) as conn:
+            added, removed = update_search_index(conn, final_df, [entry["seq"] for entry in manifest["files"].values()], full_rebuild=full_rebuild)
+        print(f"Indice di ricerca aggiornato in {output_search_path} ({added} lotti aggiunti, {removed} rimossi)")
+    except Exception as e:
+        print(f"Errore durante l'aggiornamento dell'indice di ricerca: {e}")
 
-            # Return both paths so callers can choose which allegare
-            return output_csv_path, latest_excel
+    # Versione per la sincronizzazione incrementale: va scritta dopo l'archivio,
+    # così chi la legge trova sempre righe almeno altrettanto recenti
+    write_sync_state(os.path.join(base_dir, SYNC_STATE_FILENAME), manifest)
 
+    output_path = output_csv_path if export_csv else output_store_path
+    if publish:
+        owns_publisher = publisher is None
+        publisher = publisher or default_publisher(base_dir=base_dir)
+        try:
+            if commit_data(publisher, export_csv=export_csv, base_dir=base_dir):
+                publisher.push()
+            if owns_publisher:
+                publisher.flush()
         except Exception as e:
-            print(f"Errore durante l'automazione Git: {e}")
+            print(f"Errore durante la pubblicazione: {e}")
 
-    else:
+    if not manifest["files"]:
+        # Archivio, riepilogo e indice sono stati comunque svuotati: i lotti dei file cancellati non restano serviti
         print("Nessun file Excel trovato o nessun dato da aggregare.")
-        pd.DataFrame().to_csv(output_csv_path, index=False)
         return None, None
 
+    # Return both paths so callers can choose which allegare
+    return output_path, latest_excel
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Aggrega i file Excel in aggregated_data.csv e opzionalmente prepara una bozza Outlook.")
@@ -124,9 +405,17 @@ if __name__ == "__main__":
     parser.add_argument("--email-to", dest="email_to", nargs="*", help="Lista di destinatari per la bozza Outlook")
     parser.add_argument("--email-subject", dest="email_subject", default="Report giornaliero", help="Oggetto per la bozza Outlook")
     parser.add_argument("--email-body", dest="email_body", default="In allegato il report.", help="Corpo del messaggio per la bozza Outlook")
+    parser.add_argument("--full-rebuild", dest="full_rebuild", action="store_true", help="Ignora il manifest e rilegge tutti i file Excel.")
+    parser.add_argument("--workers", dest="workers", type=int, default=1, help="Numero di processi per leggere i file Excel in parallelo (default: 1).")
+    parser.add_argument("--engine", dest="engine", choices=ENGINES, default=None, help="Backend di lettura Excel (default: calamine se installato, altrimenti openpyxl-stream).")
+    parser.add_argument("--no-csv", dest="export_csv", action="store_false", help="Non scrive aggregated_data.csv né l'archivio Arrow: aggiorna solo l'archivio SQLite, leggendo solo i file nuovi o modificati.")
+    parser.add_argument("--publish-dir", dest="publish_dir", default=None, help="Pubblica i dati copiandoli in questa cartella invece di commit e push su git.")
+    parser.add_argument("--publish-url", dest="publish_url", default=None, help="Invia i dati all'endpoint /api/ingest del server (es. https://.../api/ingest) invece di commit e push su git; il token è letto da INGEST_TOKEN.")
+    parser.add_argument("--no-publish", dest="publish", action="store_false", help="Aggiorna solo i file locali, senza pubblicare.")
     args = parser.parse_args()
 
-    csv_path, latest_excel = aggregate_data()
+    publisher = default_publisher(args.publish_dir, publish_url=args.publish_url) if args.publish else None
+    csv_path, latest_excel = aggregate_data(full_rebuild=args.full_rebuild, workers=args.workers, engine=args.engine, export_csv=args.export_csv, publish=args.publish, publisher=publisher)
 
     if args.email:
         # Preferisci il file Excel originale se esiste
@@ -150,4 +439,8 @@ if __name__ == "__main__":
                 traceback.print_exc()
                 sys.stdout.flush()
         else:
-            print("Nessun file valido da allegare (né Excel né CSV); non è stata creata la bozza Outlook.")
\ No newline at end of file
+            print("Nessun file valido da allegare (né Excel né CSV); non è stata creata la bozza Outlook.")
+
+    if publisher is not None:
+        # Il push gira in background mentre si prepara la bozza: lo attendiamo prima di uscire
+        publisher.flush()
@@ -2,15 +2,17 @@ import pyautogui
 import time
 import datetime
 import pandas as pd
-from openpyxl import load_workbook
-from openpyxl.styles import Border, Side, PatternFill, Font, Alignment
-from openpyxl.utils import get_column_letter
-from openpyxl.drawing.image import Image as OpenpyxlImage # Import per inserire immagini
 import os
 import traceback
 import argparse
+import re
 from PIL import Image
-from aggregator import aggregate_data
+from functools import partial
+from aggregator import aggregate_data, commit_data, default_publisher
+from export_watcher import EXPORT_PATTERN, ExportWatcher, file_signature
+from ingest_pipeline import DEBOUNCE_SECONDS, IngestPipeline
+from report_formatter import ReportWorkbookWriter
+from rules import classify_subjects, load_rules, map_operators
 
 # Percorsi delle immagini dei pulsanti OK dei popup
 OK_BUTTON_IMAGE_PATH_1 = r'C:\progetti_stefano\automations\attivita_giornaliere_project\ok_button.png'
@@ -36,14 +38,18 @@ COLUMNS_TO_DROP_BY_NAME = ['Cod. attività', 'Dt. ins', 'Dt. scad.', 'Classe att
 ANALYSIS_COLUMN_NAME = "Inseritore"
 SUBJECT_COLUMN_NAME = "Oggetto e descrizione"
 DATE_COLUMN_NAME = "Dt. ins."
-NOTE_INTERNE_COLUMN_NAME = "Note interne 1"
-
-def classify_soggetto(soggetto):
-    """Classifica il soggetto in base a parole chiave specifiche."""
-    soggetto_str = str(soggetto).lower()
-    if 'contatto cliente' in soggetto_str:
-        return 'Contatto Cliente'
-    return 'Azione Commerciale'
+# Tempo massimo di attesa del file salvato dall'ERP al termine dell'automazione
+EXPORT_TIMEOUT = 60
+EXPORT_FILENAME_RE = re.compile(r"OpzioniEsportazione_(\d{4}_\d{2}_\d{2})(?:_to_(\d{4}_\d{2}_\d{2}))?\.xlsx$", re.IGNORECASE)
+
+def dates_from_filename(path):
+    """Periodo analizzato dal nome del file (`OpzioniEsportazione_AAAA_MM_GG[_to_AAAA_MM_GG].xlsx`), oppure None."""
+    match = EXPORT_FILENAME_RE.search(os.path.basename(path))
+    if not match:
+        return None
+    start_date = datetime.datetime.strptime(match.group(1), "%Y_%m_%d").date()
+    end_date = datetime.datetime.strptime(match.group(2), "%Y_%m_%d").date() if match.group(2) else start_date
+    return start_date, end_date
 
 def process_excel_file(input_file_path, start_date, end_date):
     """
@@ -62,12 +68,10 @@ def process_excel_file(input_file_path, start_date, end_date):
 
         df_processed = df_filtered.drop(columns=COLUMNS_TO_DROP_BY_NAME, errors='ignore')
         
-        inseritore_replacements = {
-            'ab001': 'Alessandra', 'gmoro': 'Gabriella', 'martines': 'Martine',
-            'rpacini': 'Rachele', 'r.saber': 'Rachida', 'frosi': 'Federico'
-        }
+        # Nomi degli operatori e parole chiave delle categorie da rules.json
+        rules = load_rules()
         if ANALYSIS_COLUMN_NAME in df_processed.columns:
-            df_processed[ANALYSIS_COLUMN_NAME] = df_processed[ANALYSIS_COLUMN_NAME].str.lower().replace(inseritore_replacements)
+            df_processed[ANALYSIS_COLUMN_NAME] = map_operators(df_processed[ANALYSIS_COLUMN_NAME], rules)
         else:
             print(f"Errore: Colonna '{ANALYSIS_COLUMN_NAME}' non trovata.")
             return
@@ -76,89 +80,27 @@ def process_excel_file(input_file_path, start_date, end_date):
             print(f"Errore: Colonna '{SUBJECT_COLUMN_NAME}' non trovata, impossibile categorizzare.")
             return
 
-        df_processed['Categoria'] = df_processed[SUBJECT_COLUMN_NAME].apply(classify_soggetto)
-        unique_inseritori = df_processed[ANALYSIS_COLUMN_NAME].unique()
-
-        # Creazione di un nuovo ExcelWriter in modalità scrittura per sovrascrivere il file originale
-        with pd.ExcelWriter(input_file_path, engine='openpyxl', mode='w') as writer:
-            for inseritore in unique_inseritori:
-                df_inseritore = df_processed[df_processed[ANALYSIS_COLUMN_NAME] == inseritore]
-                unique_categories = df_inseritore['Categoria'].unique()
-
-                for categoria in unique_categories:
-                    df_categoria = df_inseritore[df_inseritore['Categoria'] == categoria]
-                    df_to_write = df_categoria.drop(columns=[ANALYSIS_COLUMN_NAME, SUBJECT_COLUMN_NAME, 'Categoria'], errors='ignore')
-                    
-                    safe_inseritore = "".join(c for c in str(inseritore) if c.isalnum() or c in (' ', '_')).rstrip()
-                    safe_categoria = "".join(c for c in str(categoria) if c.isalnum() or c in (' ', '_')).rstrip()
-                    sheet_name = f"{safe_inseritore}_{safe_categoria}"[:31]
-
-                    df_to_write.to_excel(writer, sheet_name=sheet_name, index=False)
-                    print(f"Creato foglio per: {inseritore} - {categoria}")
-
-                    worksheet = writer.sheets[sheet_name]
-                    worksheet.page_setup.paperSize = worksheet.PAPERSIZE_A4
-                    worksheet.page_setup.fitToPage = True
-                    worksheet.page_setup.fitToWidth = 1
-                    worksheet.page_setup.fitToHeight = 0
-                    worksheet.print_options.print_grid_lines = True
-                    worksheet.print_options.print_headings = True
-                    worksheet.page_setup.orientation = worksheet.ORIENTATION_PORTRAIT
-                    worksheet.page_setup.horizontalCentered = True
-                    worksheet.page_setup.verticalCentered = True
-
-                    thin_border = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-                    header_fill = PatternFill(start_color="D9D9D9", end_color="D9D9D9", fill_type="solid")
-                    header_font = Font(bold=True, size=13)
-                    default_font = Font(size=14)
-
-                    # Inserisce due righe per il logo e il titolo
-                    worksheet.insert_rows(1)
-                    worksheet.insert_rows(1)
-
-                    # Inserisce il logo in A1
-                    try:
-                        img = OpenpyxlImage(LOGO_PATH)
-                        # Puoi ridimensionare l'immagine se necessario, ad esempio:
-                        # img.width = 100
-                        # img.height = 100
-                        worksheet.add_image(img, 'A1')
-                    except Exception as e:
-                        print(f"Errore nell'inserimento del logo: {e}")
-
-                    # Il titolo ora va in A2
-                    title = f"{inseritore} - {categoria}"
-                    worksheet['A2'] = title
-                    worksheet['A2'].font = Font(bold=True, size=28)
-                    worksheet.merge_cells(start_row=2, start_column=1, end_row=2, end_column=df_to_write.shape[1])
-                    worksheet['A2'].alignment = Alignment(horizontal='center', vertical='center')
-
-                    MAX_COLUMN_WIDTH = 30
-                    for col_idx, col in enumerate(worksheet.columns, 1):
-                        max_length = 0
-                        column = get_column_letter(col_idx)
-                        for cell_idx, cell in enumerate(col, 1):
-                            # Le righe sono spostate in basso di 2 (logo in riga 1, titolo in riga 2)
-                            if cell_idx > 2: # Salta la riga del logo e del titolo grande
-                                cell.border = thin_border
-                                if cell_idx == 3: # Intestazioni (ora riga 3)
-                                    cell.font = header_font
-                                    cell.fill = header_fill
-                                    cell.alignment = Alignment(wrapText=True, horizontal='center', vertical='center')
-                                else: # Dati (ora riga 4 in poi)
-                                    cell.font = default_font
-                                    cell.alignment = Alignment(wrapText=True)
-                                
-                                if cell.value:
-                                    max_length = max(max_length, len(str(cell.value)))
-                        
-                        header_text = worksheet.cell(row=3, column=col_idx).value # Le intestazioni sono ora in riga 3
-                        if header_text == NOTE_INTERNE_COLUMN_NAME:
-                            adjusted_width = 80
-                        else:
-                            adjusted_width = min((max_length + 4), MAX_COLUMN_WIDTH)
-                        worksheet.column_dimensions[column].width = adjusted_width
-        
+        df_processed['Categoria'] = classify_subjects(df_processed[SUBJECT_COLUMN_NAME], rules)
+        # Un solo raggruppamento per (inseritore, categoria) invece di una maschera per ogni coppia.
+        # I fogli restano nello stesso ordine: inseritori per prima apparizione, poi le loro categorie.
+        groups = df_processed.groupby([ANALYSIS_COLUMN_NAME, 'Categoria'], sort=False).indices
+        inseritore_order = {inseritore: i for i, inseritore in enumerate(df_processed[ANALYSIS_COLUMN_NAME].unique())}
+        ordered_groups = sorted(groups.items(), key=lambda item: (inseritore_order[item[0][0]], item[1][0]))
+
+        # Nuovo workbook scritto in streaming che sovrascrive il file originale
+        with ReportWorkbookWriter(input_file_path, logo_path=LOGO_PATH) as writer:
+            for (inseritore, categoria), positions in ordered_groups:
+                df_categoria = df_processed.iloc[positions]
+                df_to_write = df_categoria.drop(columns=[ANALYSIS_COLUMN_NAME, SUBJECT_COLUMN_NAME, 'Categoria'], errors='ignore')
+                
+                safe_inseritore = "".join(c for c in str(inseritore) if c.isalnum() or c in (' ', '_')).rstrip()
+                safe_categoria = "".join(c for c in str(categoria) if c.isalnum() or c in (' ', '_')).rstrip()
+                sheet_name = f"{safe_inseritore}_{safe_categoria}"[:31]
+
+                # Logo, titolo, intestazioni e dati già formattati
+                writer.write_sheet(sheet_name, df_to_write, f"{inseritore} - {categoria}")
+                print(f"Creato foglio per: {inseritore} - {categoria}")
+    
         print("Elaborazione Excel completata con successo!")
 
     except FileNotFoundError:
@@ -167,6 +109,93 @@ def process_excel_file(input_file_path, start_date, end_date):
         print(f"Errore imprevisto durante l'elaborazione del file: {e}")
         traceback.print_exc()
 
+def create_email_draft(full_path, start_date, end_date, args):
+    """Prepara la bozza Outlook con il report appena generato."""
+    try:
+        from outlook_email import create_outlook_draft
+
+        # Usa il file Excel appena generato
+        if os.path.exists(full_path):
+            # Prepara oggetto email in base al periodo analizzato
+            subject = args.email_subject
+            if not subject:
+                if start_date == end_date:
+                    subject = f"Report attività del {start_date.strftime('%d/%m/%Y')}"
+                else:
+                    subject = f"Report attività dal {start_date.strftime('%d/%m/%Y')} al {end_date.strftime('%d/%m/%Y')}"
+
+            # Prepara corpo email
+            body = args.email_body
+            if not body:
+                if start_date == end_date:
+                    body = f"In allegato il report delle attività del {start_date.strftime('%d/%m/%Y')}."
+                else:
+                    body = f"In allegato il report delle attività dal {start_date.strftime('%d/%m/%Y')} al {end_date.strftime('%d/%m/%Y')}."
+
+            print("Preparo bozza email con il report...")
+            create_outlook_draft(full_path, subject=subject, body=body, to=args.email_to, display=True)
+            print("Bozza email creata con successo.")
+        else:
+            print("File Excel non trovato per la bozza email.")
+    except Exception as e:
+        print("Errore durante la creazione della bozza email:", e)
+        traceback.print_exc()
+
+def handle_export(full_path, start_date, end_date, args):
+    """Elabora il file esportato, aggiorna i dati aggregati e, se richiesto, prepara la bozza email."""
+    try:
+        process_excel_file(full_path, start_date, end_date)
+        print("Avvio aggregazione dati...")
+        publisher = default_publisher(args.publish_dir, publish_url=args.publish_url)
+        aggregate_data(export_csv=args.export_csv, publisher=publisher)
+        print("Script completato con successo.")
+
+        # Se richiesto, prepara la bozza email con il file appena generato (il push prosegue in background)
+        if args.email:
+            create_email_draft(full_path, start_date, end_date, args)
+        publisher.flush()
+    except Exception as e:
+        print(f"Errore inatteso durante l'elaborazione: {e}")
+        traceback.print_exc()
+
+def format_export(full_path):
+    """Stadio di formattazione della modalità --watch: il periodo è ricavato dal nome del file."""
+    process_excel_file(full_path, *dates_from_filename(full_path))
+
+def watch_exports(directory, args):
+    """Modalità demone: ogni nuovo file di esportazione viene formattato appena l'ERP ha finito di salvarlo;
+    aggregazione e pubblicazione girano in stadi separati, una volta per ogni raffica di file."""
+    publisher = default_publisher(args.publish_dir, publish_url=args.publish_url)
+    with ExportWatcher(directory) as watcher:
+        def on_formatted(full_path):
+            if args.email:
+                create_email_draft(full_path, *dates_from_filename(full_path), args)
+
+        pipeline = IngestPipeline(
+            format_export,
+            partial(aggregate_data, export_csv=args.export_csv, publish=False),
+            commit=partial(commit_data, publisher, export_csv=args.export_csv),
+            push=publisher.push,
+            format_workers=args.format_workers,
+            debounce_seconds=args.debounce,
+            on_formatted=on_formatted,
+            # Il file è stato riscritto da noi: non è un nuovo export
+            on_done=watcher.mark_handled,
+        )
+        print(f"In attesa di nuovi file {EXPORT_PATTERN} in {watcher.directory} ({watcher.mode}). Ctrl+C per uscire.")
+        with pipeline:
+            try:
+                for full_path in watcher.completed_files():
+                    if dates_from_filename(full_path) is None:
+                        print(f"Nome file non riconosciuto, ignorato: {full_path}")
+                        continue
+                    print(f"Nuovo file esportato: {full_path}")
+                    watcher.mark_busy(full_path)
+                    pipeline.submit(full_path)
+            except KeyboardInterrupt:
+                print("Interrotto: completo i lavori già accodati...")
+    publisher.flush()
+
 def run():
     # Aggiungi argomenti CLI per configurare l'email
     parser = argparse.ArgumentParser(description="Genera il report attività e opzionalmente prepara una bozza email.")
@@ -174,8 +203,19 @@ def run():
     parser.add_argument("--email-to", nargs="*", help="Lista di destinatari per la bozza Outlook")
     parser.add_argument("--email-subject", help="Oggetto per la bozza Outlook (default: Report [data])")
     parser.add_argument("--email-body", help="Corpo del messaggio per la bozza Outlook")
+    parser.add_argument("--watch", action="store_true", help="Resta in esecuzione ed elabora ogni nuovo file OpzioniEsportazione_*.xlsx appena viene salvato nella cartella.")
+    parser.add_argument("--watch-dir", default=os.getcwd(), help="Cartella da osservare con --watch (default: cartella corrente).")
+    parser.add_argument("--format-workers", type=int, default=1, help="Con --watch, numero di processi per formattare più file in parallelo (default: 1).")
+    parser.add_argument("--publish-dir", default=None, help="Pubblica i dati aggregati copiandoli in questa cartella invece di commit e push su git.")
+    parser.add_argument("--publish-url", default=None, help="Invia i dati aggregati all'endpoint /api/ingest del server invece di commit e push su git (token in INGEST_TOKEN).")
+    parser.add_argument("--no-csv", dest="export_csv", action="store_false", help="Non scrive aggregated_data.csv né l'archivio Arrow: l'aggregazione aggiorna solo l'archivio SQLite, leggendo solo i file nuovi o modificati.")
+    parser.add_argument("--debounce", type=float, default=DEBOUNCE_SECONDS, help=f"Con --watch, secondi senza nuovi file prima di aggregare e pubblicare (default: {DEBOUNCE_SECONDS}).")
     args = parser.parse_args()
 
+    if args.watch:
+        watch_exports(args.watch_dir, args)
+        return
+
     analysis_choice = input("Per quale data vuoi analizzare i dati? (digita 'oggi', 'settimana corrente' o una data specifica): ").lower()
 
     start_date = None
@@ -207,6 +247,11 @@ def run():
         print("Formato data non valido. Uscita.")
         return
 
+    # Il nome del file Excel ora riflette la data o l'intervallo di date di analisi
+    full_path = os.path.join(os.getcwd(), f"OpzioniEsportazione_{analysis_filename_date_str}.xlsx")
+    # Un file con lo stesso nome salvato in precedenza non va scambiato per il nuovo export
+    previous_export = file_signature(full_path)
+
     print("Avvio automazione per generare il report aggiornato...")
     # --- Blocco Automazione PyAutoGUI ---
     pyautogui.hotkey('win', 'r')
@@ -224,9 +269,6 @@ def run():
     pyautogui.click(x=765, y=525); time.sleep(3); handle_popup([OK_BUTTON_IMAGE_PATH_1])
     time.sleep(5)
     
-    # Il nome del file Excel ora riflette la data o l'intervallo di date di analisi
-    full_path = os.path.join(os.getcwd(), f"OpzioniEsportazione_{analysis_filename_date_str}.xlsx")
-    
     pyautogui.write(full_path); time.sleep(1); pyautogui.press('enter'); time.sleep(3)
     
     pyautogui.click(x=1045, y=568); time.sleep(3)
@@ -240,61 +282,14 @@ def run():
     print("Automazione completata.")
     # --- Fine Blocco Automazione ---
 
-    max_wait_time = 60
-    start_time_wait = time.time()
-    print(f"Tentativo di elaborazione del file Excel: {full_path}")
-    while time.time() - start_time_wait < max_wait_time:
-        if os.path.exists(full_path):
-            try:
-                process_excel_file(full_path, start_date, end_date)
-                print("Avvio aggregazione dati...")
-                aggregate_data()
-                print("Script completato con successo.")
-                
-                # Se richiesto, prepara la bozza email con il file appena generato
-                if args.email:
-                    try:
-                        from outlook_email import create_outlook_draft
-                        
-                        # Usa il file Excel appena generato
-                        if os.path.exists(full_path):
-                            # Prepara oggetto email in base al periodo analizzato
-                            subject = args.email_subject
-                            if not subject:
-                                if start_date == end_date:
-                                    subject = f"Report attività del {start_date.strftime('%d/%m/%Y')}"
-                                else:
-                                    subject = f"Report attività dal {start_date.strftime('%d/%m/%Y')} al {end_date.strftime('%d/%m/%Y')}"
-
-                            # Prepara corpo email
-                            body = args.email_body
-                            if not body:
-                                if start_date == end_date:
-                                    body = f"In allegato il report delle attività del {start_date.strftime('%d/%m/%Y')}."
-                                else:
-                                    body = f"In allegato il report delle attività dal {start_date.strftime('%d/%m/%Y')} al {end_date.strftime('%d/%m/%Y')}."
-                            
-                            print("Preparo bozza email con il report...")
-                            create_outlook_draft(full_path, subject=subject, body=body, to=args.email_to, display=True)
-                            print("Bozza email creata con successo.")
-                        else:
-                            print("File Excel non trovato per la bozza email.")
-                    except Exception as e:
-                        print("Errore durante la creazione della bozza email:", e)
-                        traceback.print_exc()
-
-                return
-            except (PermissionError, OSError) as e:
-                print(f"File temporaneamente bloccato: {e}. Riprovo...")
-                time.sleep(2)
-            except Exception as e:
-                print(f"Errore inatteso durante l'elaborazione: {e}")
-                traceback.print_exc()
-                break
-        else:
-            time.sleep(2)
-
-    print(f"Errore: Impossibile elaborare il file Excel dopo {max_wait_time} secondi: {full_path}")
+    # Il file viene elaborato appena l'ERP ha finito di scriverlo (dimensione stabile e xlsx completo)
+    print(f"In attesa del file esportato: {full_path}")
+    with ExportWatcher(os.path.dirname(full_path)) as watcher:
+        ready = watcher.wait_for(full_path, timeout=EXPORT_TIMEOUT, previous=previous_export)
+    if not ready:
+        print(f"Errore: Impossibile elaborare il file Excel dopo {EXPORT_TIMEOUT} secondi: {full_path}")
+        return
+    handle_export(full_path, start_date, end_date, args)
 
 if __name__ == "__main__":
     run()
\ No newline at end of file
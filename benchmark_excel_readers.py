@@ -0,0 +1,94 @@
+"""Confronta tempo e memoria dei backend di `excel_reader` sui file OpzioniEsportazione*.xlsx.
+
+Ogni backend viene eseguito in un processo separato, così il picco di memoria (RSS)
+misurato è solo il suo. Il picco Python è misurato con tracemalloc e non include la
+memoria allocata da librerie native (es. calamine).
+
+Esempio:
+    python benchmark_excel_readers.py --repeat 5
+"""
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+from excel_reader import available_engines, read_report_sheets
+
+
+def _max_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss è in KB su Linux, in byte su macOS
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def measure(engine, files, repeat):
+    """Tempo medio di lettura di tutti i file e picchi di memoria per un backend."""
+    rss_before = _max_rss_mb()
+    rows = 0
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = sum(len(df) for file in files for _, df in read_report_sheets(file, engine=engine))
+        times.append(time.perf_counter() - start)
+
+    # Una lettura separata per il picco Python, perché tracemalloc rallenta l'esecuzione
+    tracemalloc.start()
+    for file in files:
+        read_report_sheets(file, engine=engine)
+    _, python_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    rss_after = _max_rss_mb()
+    return {
+        "engine": engine,
+        "files": len(files),
+        "rows": rows,
+        "mean_s": sum(times) / len(times),
+        "best_s": min(times),
+        "python_peak_mb": python_peak / (1024 * 1024),
+        "rss_growth_mb": None if rss_before is None else rss_after - rss_before,
+    }
+
+
+def main():
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Benchmark dei backend di lettura Excel.")
+    parser.add_argument("--pattern", default=os.path.join(base_dir, "OpzioniEsportazione*.xlsx"), help="File da leggere (glob).")
+    parser.add_argument("--repeat", type=int, default=3, help="Numero di ripetizioni per backend.")
+    parser.add_argument("--engine", help=argparse.SUPPRESS)  # usato internamente dal processo figlio
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(args.pattern))
+    if not files:
+        print(f"Nessun file trovato con il pattern {args.pattern}")
+        return
+
+    if args.engine:
+        print(json.dumps(measure(args.engine, files, args.repeat)))
+        return
+
+    results = []
+    for engine in available_engines():
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--engine", engine, "--pattern", args.pattern, "--repeat", str(args.repeat)],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{len(files)} file, {results[0]['rows']} righe, {args.repeat} ripetizioni\n")
+    print(f"{'backend':<16} {'medio (s)':>10} {'migliore (s)':>13} {'picco Python (MB)':>18} {'RSS (MB)':>9}")
+    for r in results:
+        rss = "n/d" if r["rss_growth_mb"] is None else f"{r['rss_growth_mb']:.1f}"
+        print(f"{r['engine']:<16} {r['mean_s']:>10.3f} {r['best_s']:>13.3f} {r['python_peak_mb']:>18.1f} {rss:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""Archivio colonnare (Arrow IPC) dei dati aggregati.
+
+Affianca `aggregated_data.csv`: i dati sono salvati in file Arrow IPC non compressi,
+partizionati per mese (`mese=YYYY-MM`), con `Dt. ins.` come data vera e
+`Operatore`/`Categoria` codificati a dizionario. I file possono essere letti
+memory-mapped, caricando solo le colonne necessarie.
+
+Esempio di lettura:
+    from columnar_store import read_columnar_store
+    table = read_columnar_store("aggregated_data_arrow", columns=["Dt. ins.", "Operatore"])
+    df = table.to_pandas()
+"""
+from __future__ import annotations
+import os
+import shutil
+import datetime
+from typing import Iterator, List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from pyarrow import fs
+
+from dataset_types import CATEGORY_COLUMN_NAME, DATE_COLUMN_NAME, INTEGER_COLUMNS, OPERATOR_COLUMN_NAME, is_integer_column
+
+COLUMNAR_DIRNAME = "aggregated_data_arrow"
+DICTIONARY_COLUMNS = [OPERATOR_COLUMN_NAME, CATEGORY_COLUMN_NAME]
+PARTITION_COLUMN = "mese"
+
+
+def to_arrow_table(df: pd.DataFrame) -> pa.Table:
+    """Converte il DataFrame aggregato in una tabella Arrow tipizzata."""
+    arrays = []
+    names = []
+    for name in df.columns:
+        series = df[name]
+        if name == DATE_COLUMN_NAME:
+            dates = pd.to_datetime(series, errors="coerce")
+            array = pa.Array.from_pandas(dates).cast(pa.date32(), safe=False)
+        elif name in DICTIONARY_COLUMNS:
+            array = pa.array(series.astype("string"), type=pa.string()).dictionary_encode()
+        # "Soggetto" può contenere codici come "F0010200": in quel caso la colonna resta testuale
+        elif name in INTEGER_COLUMNS and is_integer_column(series):
+            array = pa.array(pd.to_numeric(series).astype("Int64"), type=pa.int64())
+        else:
+            # Colonne testuali (note, ragione sociale, contatto): NaN -> null
+            array = pa.array(series.astype("string"), type=pa.string())
+        arrays.append(array)
+        names.append(str(name))
+    return pa.Table.from_arrays(arrays, names=names)
+
+
+def write_columnar_store(df: pd.DataFrame, path: str) -> None:
+    """Scrive `df` in `path` come dataset Arrow IPC partizionato per mese.
+
+    Il dataset viene prima scritto in una cartella temporanea e poi sostituito
+    a quello esistente, così i lettori non vedono mai una scrittura a metà.
+    """
+    table = to_arrow_table(df)
+    if DATE_COLUMN_NAME in table.column_names:
+        months = pc.strftime(table[DATE_COLUMN_NAME], format="%Y-%m")
+    else:
+        months = pa.nulls(table.num_rows, type=pa.string())
+    table = table.append_column(PARTITION_COLUMN, months)
+
+    tmp_path = path + ".tmp"
+    old_path = path + ".old"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    ds.write_dataset(
+        table,
+        tmp_path,
+        format="ipc",
+        partitioning=ds.partitioning(pa.schema([(PARTITION_COLUMN, pa.string())]), flavor="hive"),
+        basename_template="part-{i}.arrow",
+    )
+
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def open_columnar_dataset(path: str, memory_map: bool = True) -> ds.Dataset:
+    """Apre il dataset colonnare; con `memory_map=True` i file vengono mappati in memoria."""
+    return ds.dataset(
+        path,
+        format="ipc",
+        partitioning=ds.partitioning(pa.schema([(PARTITION_COLUMN, pa.string())]), flavor="hive"),
+        filesystem=fs.LocalFileSystem(use_mmap=memory_map),
+    )
+
+
+def read_columnar_store(path: str, columns: List[str] | None = None, memory_map: bool = True) -> pa.Table:
+    """Legge il dataset colonnare, caricando solo le colonne richieste."""
+    return open_columnar_dataset(path, memory_map=memory_map).to_table(columns=columns)
+
+
+def data_columns(dataset: ds.Dataset) -> List[str]:
+    """Colonne dei dati, esclusa la colonna di partizione."""
+    return [name for name in dataset.schema.names if name != PARTITION_COLUMN]
+
+
+def build_filter(
+    operators: Optional[List[str]] = None,
+    categories: Optional[List[str]] = None,
+    start_date: Optional[datetime.date] = None,
+    end_date: Optional[datetime.date] = None,
+) -> Optional[ds.Expression]:
+    """Costruisce l'espressione di filtro Arrow equivalente ai filtri di `/api/data`."""
+    expression = None
+    conditions = []
+    if operators:
+        conditions.append(ds.field(OPERATOR_COLUMN_NAME).isin(operators))
+    if categories:
+        conditions.append(ds.field(CATEGORY_COLUMN_NAME).isin(categories))
+    if start_date:
+        conditions.append(ds.field(DATE_COLUMN_NAME) >= pa.scalar(start_date, pa.date32()))
+    if end_date:
+        conditions.append(ds.field(DATE_COLUMN_NAME) <= pa.scalar(end_date, pa.date32()))
+    for condition in conditions:
+        expression = condition if expression is None else expression & condition
+    return expression
+
+
+def iter_record_batches(
+    path: str,
+    columns: Optional[List[str]] = None,
+    filter: Optional[ds.Expression] = None,
+    batch_size: int = 1024,
+) -> Iterator[pa.RecordBatch]:
+    """Legge il dataset a blocchi di al più `batch_size` righe, senza caricarlo tutto in memoria."""
+    dataset = open_columnar_dataset(path)
+    if columns is None:
+        columns = data_columns(dataset)
+    return dataset.to_batches(columns=columns, filter=filter, batch_size=batch_size)
@@ -3,6 +3,8 @@ import pandas as pd
 import plotly.express as px
 import os
 import datetime
+from dataset_types import apply_dtypes
+from excel_reader import read_report_sheets
 
 # --- Configuration ---
 st.set_page_config(
@@ -21,24 +23,33 @@ uploaded_file = st.sidebar.file_uploader("Scegli un file Excel", type=["xlsx"])
 @st.cache_data
 def load_data(file):
     try:
-        # Read all sheets from the Excel file
-        xls = pd.ExcelFile(file)
-        all_sheets_df = pd.DataFrame()
-        
-        for sheet_name in xls.sheet_names:
-            # Skip the original sheet if it somehow persists or any other non-report sheets
-            if "Foglio1" in sheet_name or "Sheet1" in sheet_name: # Adjust if original sheet name is different
-                continue
-            
-            df_sheet = pd.read_excel(xls, sheet_name=sheet_name, skiprows=2) # Skip logo and title rows
+        # Read all report sheets from the Excel file (logo and title rows are skipped by the reader)
+        # Skip the original sheet if it somehow persists or any other non-report sheets
+        sheets = read_report_sheets(
+            file,
+            include=lambda sheet_name: not ("Foglio1" in sheet_name or "Sheet1" in sheet_name), # Adjust if original sheet name is different
+        )
+        all_sheets = []
+        for sheet_name, df_sheet in sheets:
             df_sheet['Report_Sheet'] = sheet_name # Add a column to identify the original sheet
-            all_sheets_df = pd.concat([all_sheets_df, df_sheet], ignore_index=True)
-            
-        return all_sheets_df
+            all_sheets.append(df_sheet)
+
+        if not all_sheets:
+            return pd.DataFrame()
+        return pd.concat(all_sheets, ignore_index=True)
     except Exception as e:
         st.error(f"Errore durante il caricamento del file Excel: {e}")
         return pd.DataFrame()
 
+@st.cache_data
+def build_activity_cube(df):
+    """Riepilogo giorno × inseritore × categoria, calcolato una sola volta per file caricato."""
+    return (
+        df.groupby([df['dt.ins.'].dt.date.rename('Giorno'), 'Inseritore', 'Categoria'], observed=True)
+        .size()
+        .reset_index(name='Numero Attività')
+    )
+
 df = pd.DataFrame() # Initialize df as empty DataFrame
 if uploaded_file is not None:
     df = load_data(uploaded_file)
@@ -59,6 +70,11 @@ if not df.empty:
     df['dt.ins.'] = pd.to_datetime(df['dt.ins.'], dayfirst=True, errors='coerce')
     df.dropna(subset=['dt.ins.'], inplace=True)
 
+    # Tipi compatti condivisi con main.py e aggregator.py: i filtri confrontano codici interi
+    df = apply_dtypes(df, category_columns=['Inseritore', 'Categoria', 'Report_Sheet', 'Ragione sociale'], date_columns=['dt.ins.'])
+    # Righe ordinate per data: l'intervallo scelto nei filtri si trova con una ricerca binaria
+    df = df.sort_values('dt.ins.', kind='stable', ignore_index=True)
+
     # --- Sidebar Filters with Apply Button ---
     with st.sidebar.form(key='filter_form'):
         st.header("Filtri")
@@ -84,15 +100,21 @@ if not df.empty:
 
     # --- Apply Filters ---
     # The filtering logic is now triggered only by the button press
-    df_filtered = df[
-        (df['Inseritore'].isin(selected_inseritori)) &
-        (df['dt.ins.'].dt.date >= start_date) &
-        (df['dt.ins.'].dt.date <= end_date)
+    first_row = df['dt.ins.'].searchsorted(pd.Timestamp(start_date), side='left')
+    last_row = df['dt.ins.'].searchsorted(pd.Timestamp(end_date) + pd.Timedelta(days=1), side='left')
+    df_in_range = df.iloc[first_row:last_row]
+    df_filtered = df_in_range[df_in_range['Inseritore'].isin(selected_inseritori)]
+    # I grafici usano il riepilogo precalcolato invece di ricontare tutte le righe
+    cube = build_activity_cube(df)
+    cube_filtered = cube[
+        (cube['Inseritore'].isin(selected_inseritori)) &
+        (cube['Giorno'] >= start_date) &
+        (cube['Giorno'] <= end_date)
     ]
 
     # --- Key Metrics ---
     st.header("Riepilogo Generale")
-    total_activities = len(df_filtered)
+    total_activities = int(cube_filtered['Numero Attività'].sum())
     st.metric("Numero Totale di Attività Filtrate", total_activities)
 
 
@@ -104,8 +126,7 @@ if not df.empty:
 
         # 1. Attività per Inseritore
         st.subheader("Attività per Inseritore")
-        activities_by_inseritore = df_filtered['Inseritore'].value_counts().reset_index()
-        activities_by_inseritore.columns = ['Inseritore', 'Numero Attività']
+        activities_by_inseritore = cube_filtered.groupby('Inseritore', as_index=False, observed=True)['Numero Attività'].sum()
         fig_inseritore = px.bar(
             activities_by_inseritore,
             x='Inseritore',
@@ -117,8 +138,7 @@ if not df.empty:
 
         # 2. Distribuzione Contatto Cliente vs Azione Commerciale
         st.subheader("Distribuzione Attività per Categoria")
-        activities_by_category = df_filtered['Categoria'].value_counts().reset_index()
-        activities_by_category.columns = ['Categoria', 'Numero Attività']
+        activities_by_category = cube_filtered.groupby('Categoria', as_index=False, observed=True)['Numero Attività'].sum()
         fig_category = px.pie(
             activities_by_category,
             names='Categoria',
@@ -129,7 +149,7 @@ if not df.empty:
 
         # 3. Attività per Inseritore e Categoria
         st.subheader("Attività per Inseritore e Categoria")
-        activities_by_inseritore_category = df_filtered.groupby(['Inseritore', 'Categoria']).size().reset_index(name='Numero Attività')
+        activities_by_inseritore_category = cube_filtered.groupby(['Inseritore', 'Categoria'], as_index=False, observed=True)['Numero Attività'].sum()
         fig_stacked_bar = px.bar(
             activities_by_inseritore_category,
             x='Inseritore',
@@ -0,0 +1,209 @@
+"""Cache in-process dei file letti da `main.py`.
+
+Ogni worker gunicorn tiene in memoria l'ultima versione letta di piccoli file JSON (`JsonFileCache`)
+e legge i CSV da una loro copia Arrow mappata in memoria e condivisa con gli altri worker
+(`MappedDatasetCache`, usata per `aggregated_rollup.csv`). Il file viene riletto solo quando cambia
+su disco (inode, dimensione o mtime diversi); le richieste che arrivano durante una rilettura
+attendono un'unica ricostruzione invece di rileggere tutte il file.
+"""
+from __future__ import annotations
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Iterator, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+
+try:
+    import fcntl
+except ImportError:  # Windows: senza lock tra processi una conversione può essere ripetuta da più worker
+    fcntl = None
+
+from dataset_types import DATE_COLUMN_NAME, format_dates, read_dataset
+from file_utils import file_sha256
+
+
+def serialize_records(df: pd.DataFrame) -> bytes:
+    """Serializza le righe di `df` come array JSON (NaN -> stringa vuota)."""
+    if df.empty:
+        return b"[]"
+    values = df.astype(object)
+    for name in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[name]):
+            values[name] = format_dates(df[name]).astype(object)
+    records = values.where(df.notna().to_numpy(), '').to_dict(orient="records")
+    # Stessi parametri di FastAPI JSONResponse
+    return json.dumps(records, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+@dataclass(frozen=True)
+class JsonSnapshot:
+    """Contenuto di un file JSON caricato in memoria."""
+    key: Optional[Tuple[int, int, int]]
+    data: Any
+    etag: str
+    last_modified: Optional[float]
+
+
+class FileCache:
+    """Mantiene l'ultima versione letta di un file e la ricarica quando il file cambia.
+
+    Le sottoclassi implementano `_load(key)`, che legge il file e restituisce uno snapshot con attributo `key`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def _file_key(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _load(self, key: Optional[Tuple[int, int, int]]):
+        raise NotImplementedError
+
+    def get(self):
+        """Restituisce lo snapshot corrente, ricaricandolo se il file è cambiato."""
+        key = self._file_key()
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.key == key:
+            return snapshot
+
+        with self._lock:
+            # Un'altra richiesta potrebbe aver già ricaricato il file mentre aspettavamo
+            snapshot = self._snapshot
+            key = self._file_key()
+            if snapshot is None or snapshot.key != key:
+                snapshot = self._load(key)
+                self._snapshot = snapshot
+            return snapshot
+
+
+class JsonFileCache(FileCache):
+    """Cache di un piccolo file JSON (es. `aggregated_version.json`)."""
+
+    def __init__(self, path: str, default: Any = None):
+        super().__init__(path)
+        self.default = default
+
+    def _load(self, key: Optional[Tuple[int, int, int]]) -> JsonSnapshot:
+        try:
+            with open(self.path, "rb") as f:
+                raw = f.read()
+            data = json.loads(raw)
+        except (FileNotFoundError, ValueError):
+            raw = b""
+            data = self.default
+        return JsonSnapshot(
+            key=key,
+            data=data,
+            etag=hashlib.sha256(raw).hexdigest()[:32],
+            last_modified=key[2] / 1e9 if key else None,
+        )
+
+
+@contextmanager
+def file_lock(path: str) -> Iterator[None]:
+    """Lock esclusivo tra processi sul file `path` (creato se manca); senza `fcntl` non blocca."""
+    with open(path, "a") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+@dataclass(frozen=True)
+class MappedDatasetSnapshot:
+    """Versione del dataset letta da un file Arrow mappato in memoria."""
+    key: Optional[Tuple[int, int, int]]
+    df: pd.DataFrame
+    dates: pd.Series
+    # Hash del contenuto del CSV: uguale in tutti i worker, usato come ETag e nel nome del file Arrow
+    etag: str
+    last_modified: Optional[float]
+
+
+class MappedDatasetCache(FileCache):
+    """Cache di un CSV letto da una sua copia Arrow IPC mappata in memoria, condivisa tra i processi.
+
+    Ogni versione del CSV viene convertita una sola volta in `.<nome del CSV>.<hash>.arrow`, nella
+    stessa cartella: il primo worker che la trova la scrive (file temporaneo e `os.replace`, sotto un
+    lock sul file `.<nome del CSV>.lock`), gli altri la trovano pronta. Il DataFrame punta alle pagine
+    del file (date e numeri senza copie), quindi la memoria occupata è quella della cache del sistema
+    operativo, una volta sola per tutti i worker. Il nome cambia con il contenuto: un file già mappato
+    non viene mai riscritto, e le versioni precedenti vengono cancellate dopo la conversione (chi le sta
+    ancora leggendo conserva la sua mappatura).
+    """
+
+    def _arrow_path(self, digest: str) -> str:
+        directory, name = os.path.split(self.path)
+        return os.path.join(directory, f".{name}.{digest[:16]}.arrow")
+
+    def _convert(self, arrow_path: str) -> None:
+        directory, name = os.path.split(self.path)
+        with file_lock(os.path.join(directory, f".{name}.lock")):
+            if os.path.exists(arrow_path):
+                return
+            try:
+                df = read_dataset(self.path)
+            except pd.errors.EmptyDataError:
+                df = pd.DataFrame()
+            if DATE_COLUMN_NAME in df.columns:
+                # Già a livello di giorno nel file: i worker non devono farne una copia normalizzata
+                df[DATE_COLUMN_NAME] = df[DATE_COLUMN_NAME].dt.normalize()
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            fd, tmp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=directory)
+            os.close(fd)
+            try:
+                with pa.OSFile(tmp_path, "wb") as f, pa.ipc.new_file(f, table.schema) as writer:
+                    writer.write_table(table)
+                os.replace(tmp_path, arrow_path)
+            except BaseException:
+                os.remove(tmp_path)
+                raise
+            for old_path in glob.glob(os.path.join(glob.escape(directory), glob.escape(f".{name}.") + "*.arrow")):
+                if old_path != arrow_path:
+                    try:
+                        os.remove(old_path)
+                    except OSError:
+                        pass
+
+    def _load(self, key: Optional[Tuple[int, int, int]]) -> MappedDatasetSnapshot:
+        try:
+            digest = file_sha256(self.path)
+        except FileNotFoundError:
+            digest = None
+        if digest is None:
+            df = pd.DataFrame()
+        else:
+            arrow_path = self._arrow_path(digest)
+            while True:
+                try:
+                    source = pa.memory_map(arrow_path)
+                    break
+                except FileNotFoundError:
+                    self._convert(arrow_path)
+            with source:
+                table = pa.ipc.open_file(source).read_all()
+            # split_blocks: una colonna per blocco, senza la copia che pandas farebbe per unirle
+            df = table.to_pandas(split_blocks=True)
+        if DATE_COLUMN_NAME in df.columns:
+            dates = df[DATE_COLUMN_NAME]
+        else:
+            dates = pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns]")
+        return MappedDatasetSnapshot(
+            key=key,
+            df=df,
+            dates=dates,
+            etag=(digest or hashlib.sha256(b"").hexdigest())[:32],
+            last_modified=key[2] / 1e9 if key else None,
+        )
@@ -0,0 +1,219 @@
+"""Aggiornamento a caldo dei dati serviti da `main.py`, senza redeploy.
+
+`/api/ingest` riceve un pacchetto zip con i file pubblicati da `aggregator.py` (archivio SQLite,
+riepilogo, indice di ricerca, versione ed export opzionali). Il pacchetto viene estratto in
+`ingested/<versione>/`, validato e reso corrente riscrivendo `ingested/current.json` con `os.replace`.
+
+Ogni worker gunicorn controlla `current.json` a ogni richiesta (una `stat`, vedi `CurrentDataFiles`)
+e passa alla nuova cartella alla richiesta successiva: i file di una versione cambiano tutti insieme
+e nessun worker legge una cartella incompleta. Senza `current.json` si servono i file nella cartella
+del progetto, come prima.
+"""
+from __future__ import annotations
+import datetime
+import json
+import os
+import posixpath
+import shutil
+import sqlite3
+import tempfile
+import zipfile
+from contextlib import closing
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+import pandas as pd
+
+from columnar_store import COLUMNAR_DIRNAME, open_columnar_dataset
+from data_cache import FileCache, JsonFileCache, MappedDatasetCache
+from data_store import CSV_FILENAME, DATA_DB_FILENAME, SYNC_STATE_FILENAME, DataStore, open_read_only
+from data_sync import EMPTY_SYNC_STATE
+from file_utils import file_sha256
+from rollup import ROLLUP_COLUMNS, ROLLUP_FILENAME
+from search_index import SEARCH_DB_FILENAME
+
+INGEST_DIRNAME = "ingested"
+CURRENT_FILENAME = "current.json"
+BUNDLE_FILES = (DATA_DB_FILENAME, ROLLUP_FILENAME, SEARCH_DB_FILENAME, SYNC_STATE_FILENAME, CSV_FILENAME)
+BUNDLE_DIRS = (COLUMNAR_DIRNAME,)
+# Versioni precedenti conservate: le richieste già in corso possono finire di leggerle
+KEEP_VERSIONS = 3
+MAX_BUNDLE_BYTES = 512 * 1024 * 1024
+
+
+class IngestError(Exception):
+    """Pacchetto di dati non valido."""
+
+
+def _bundle_members(zf: zipfile.ZipFile) -> list:
+    """Voci del pacchetto da estrarre, dopo aver controllato nomi e dimensione totale."""
+    members = []
+    total = 0
+    for info in zf.infolist():
+        if info.is_dir():
+            continue
+        name = posixpath.normpath(info.filename)
+        top = name.split("/", 1)[0]
+        if name.startswith(("/", "../")) or ".." in name.split("/") or not (
+            name in BUNDLE_FILES or (top in BUNDLE_DIRS and name != top)
+        ):
+            raise IngestError(f"File non previsto nel pacchetto: {info.filename}")
+        total += info.file_size
+        if total > MAX_BUNDLE_BYTES:
+            raise IngestError("Pacchetto troppo grande")
+        members.append(info)
+    return members
+
+
+def _check_sqlite(path: str) -> sqlite3.Connection:
+    conn = open_read_only(path)
+    try:
+        result = conn.execute("PRAGMA quick_check").fetchone()
+    except sqlite3.Error as e:
+        conn.close()
+        raise IngestError(f"{os.path.basename(path)} non è un database SQLite valido: {e}")
+    if result[0] != "ok":
+        conn.close()
+        raise IngestError(f"{os.path.basename(path)} è danneggiato: {result[0]}")
+    return conn
+
+
+def validate_dataset(directory: str) -> int:
+    """Controlla i file di una versione estratta e restituisce il numero di righe dell'archivio."""
+    store_path = os.path.join(directory, DATA_DB_FILENAME)
+    if not os.path.isfile(store_path):
+        raise IngestError(f"{DATA_DB_FILENAME} mancante nel pacchetto")
+    with closing(_check_sqlite(store_path)) as conn:
+        try:
+            meta = dict(conn.execute("SELECT key, value FROM meta"))
+            columns = json.loads(meta.get("columns", "[]"))
+            rows = conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+        except (sqlite3.Error, ValueError) as e:
+            raise IngestError(f"Archivio {DATA_DB_FILENAME} non valido: {e}")
+    if rows and not columns:
+        raise IngestError(f"Archivio {DATA_DB_FILENAME} senza elenco delle colonne")
+
+    search_path = os.path.join(directory, SEARCH_DB_FILENAME)
+    if os.path.exists(search_path):
+        _check_sqlite(search_path).close()
+
+    rollup_path = os.path.join(directory, ROLLUP_FILENAME)
+    if os.path.exists(rollup_path):
+        try:
+            header = pd.read_csv(rollup_path, nrows=0).columns
+        except (pd.errors.EmptyDataError, pd.errors.ParserError):
+            header = []
+        if len(header) and not set(ROLLUP_COLUMNS) <= set(header):
+            raise IngestError(f"{ROLLUP_FILENAME} non ha le colonne attese")
+
+    sync_path = os.path.join(directory, SYNC_STATE_FILENAME)
+    if os.path.exists(sync_path):
+        try:
+            with open(sync_path, "r", encoding="utf-8") as f:
+                int(json.load(f)["version"])
+        except (ValueError, KeyError, TypeError) as e:
+            raise IngestError(f"{SYNC_STATE_FILENAME} non valido: {e}")
+
+    columnar_path = os.path.join(directory, COLUMNAR_DIRNAME)
+    if os.path.isdir(columnar_path):
+        try:
+            open_columnar_dataset(columnar_path, memory_map=False).schema
+        except Exception as e:
+            raise IngestError(f"Archivio {COLUMNAR_DIRNAME} non valido: {e}")
+    return rows
+
+
+def read_current(base_dir: str) -> Optional[dict]:
+    """Contenuto di `ingested/current.json`, o None se non è stato ancora ricevuto alcun pacchetto."""
+    try:
+        with open(os.path.join(base_dir, INGEST_DIRNAME, CURRENT_FILENAME), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _prune_versions(ingest_dir: str, current: str, keep: int = KEEP_VERSIONS) -> None:
+    # I nomi delle versioni iniziano con data e ora: l'ordine alfabetico è quello cronologico
+    versions = sorted(
+        name for name in os.listdir(ingest_dir)
+        if not name.startswith(".") and name != current and os.path.isdir(os.path.join(ingest_dir, name))
+    )
+    for name in versions[:max(len(versions) - (keep - 1), 0)]:
+        shutil.rmtree(os.path.join(ingest_dir, name), ignore_errors=True)
+
+
+def ingest_bundle(bundle_path: str, base_dir: str) -> Tuple[str, bool]:
+    """
+    Estrae e valida il pacchetto zip `bundle_path` e lo rende la versione corrente.
+    Restituisce (versione, cambiata); un pacchetto identico a quello corrente non crea una nuova versione.
+    """
+    digest = file_sha256(bundle_path)
+    current = read_current(base_dir)
+    if current and current.get("sha256") == digest:
+        return current["version"], False
+
+    ingest_dir = os.path.join(base_dir, INGEST_DIRNAME)
+    os.makedirs(ingest_dir, exist_ok=True)
+    version = f"{datetime.datetime.now():%Y%m%dT%H%M%S}-{digest[:12]}"
+    tmp_dir = tempfile.mkdtemp(prefix=".tmp-", dir=ingest_dir)
+    try:
+        try:
+            with zipfile.ZipFile(bundle_path) as zf:
+                zf.extractall(tmp_dir, members=_bundle_members(zf))
+        except zipfile.BadZipFile as e:
+            raise IngestError(f"Pacchetto zip non valido: {e}")
+        rows = validate_dataset(tmp_dir)
+        os.replace(tmp_dir, os.path.join(ingest_dir, version))
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    tmp_path = os.path.join(ingest_dir, f".{CURRENT_FILENAME}.{os.getpid()}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": version, "sha256": digest, "rows": rows}, f)
+    os.replace(tmp_path, os.path.join(ingest_dir, CURRENT_FILENAME))
+    _prune_versions(ingest_dir, version)
+    print(f"Nuova versione dei dati: {version} ({rows} righe)")
+    return version, True
+
+
+@dataclass(frozen=True)
+class DataFiles:
+    """File della versione corrente dei dati, con le cache per-worker aperte su quella cartella."""
+    key: Optional[Tuple[int, int, int]]
+    version: str
+    directory: str
+    store: DataStore
+    rollup: MappedDatasetCache
+    sync_state: JsonFileCache
+    columnar_path: str
+    search_path: str
+
+
+class CurrentDataFiles(FileCache):
+    """Cartella dei dati indicata da `ingested/current.json` (o la cartella del progetto), ricaricata quando il file cambia."""
+
+    def __init__(self, base_dir: str):
+        super().__init__(os.path.join(base_dir, INGEST_DIRNAME, CURRENT_FILENAME))
+        self.base_dir = base_dir
+
+    def _load(self, key: Optional[Tuple[int, int, int]]) -> DataFiles:
+        version = ""
+        directory = self.base_dir
+        current = read_current(self.base_dir) if key is not None else None
+        if current and current.get("version") and os.path.isdir(os.path.join(self.base_dir, INGEST_DIRNAME, current["version"])):
+            version = current["version"]
+            directory = os.path.join(self.base_dir, INGEST_DIRNAME, version)
+        if self._snapshot is not None:
+            # Le connessioni alla versione precedente non servono più (quelle in uso si chiudono al rilascio)
+            self._snapshot.store.close()
+        return DataFiles(
+            key=key,
+            version=version,
+            directory=directory,
+            store=DataStore(os.path.join(directory, DATA_DB_FILENAME), csv_path=os.path.join(directory, CSV_FILENAME)),
+            rollup=MappedDatasetCache(os.path.join(directory, ROLLUP_FILENAME)),
+            sync_state=JsonFileCache(os.path.join(directory, SYNC_STATE_FILENAME), default=EMPTY_SYNC_STATE),
+            columnar_path=os.path.join(directory, COLUMNAR_DIRNAME),
+            search_path=os.path.join(directory, SEARCH_DB_FILENAME),
+        )
@@ -0,0 +1,137 @@
+"""Filtri, ordinamento, proiezione e paginazione lato server per `/api/data`, eseguiti sull'archivio SQLite.
+
+Gli indici dell'archivio (vedi `data_store`) fanno il lavoro dell'indice in memoria usato prima di SQLite:
+l'indice su `inserted_at` è la ricerca binaria sulle date ordinate, quelli su (operatore, data) e
+(categoria, data) sostituiscono le liste di righe per valore. Una query con filtri legge quindi solo le
+righe dell'intervallo selezionato, con un costo proporzionale al risultato e non allo storico.
+"""
+from __future__ import annotations
+import datetime
+import sqlite3
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from data_store import (
+    CATEGORY_COLUMN_NAME,
+    DEFAULT_ORDER,
+    OPERATOR_COLUMN_NAME,
+    RECORDS_TABLE,
+    TIMESTAMP_COLUMN,
+    count_records,
+    fetch_records,
+    iter_records,
+    quote_identifier,
+)
+
+
+class QueryError(ValueError):
+    """Parametri di query non validi (colonna inesistente, paginazione negativa, ...)."""
+
+
+def _check_columns(available: Sequence[str], columns: List[str]) -> None:
+    unknown = [c for c in columns if c not in available]
+    if unknown:
+        raise QueryError(f"Colonne sconosciute: {', '.join(unknown)}")
+
+
+def _filters(
+    operators: Optional[List[str]],
+    categories: Optional[List[str]],
+    start_date: Optional[datetime.date],
+    end_date: Optional[datetime.date],
+) -> Tuple[str, list]:
+    # Condizioni servite dagli indici su data, (operatore, data) e (categoria, data)
+    clauses, params = [], []
+    for column, values in ((OPERATOR_COLUMN_NAME, operators), (CATEGORY_COLUMN_NAME, categories)):
+        if values:
+            values = list(dict.fromkeys(values))
+            clauses.append(f"{quote_identifier(column)} IN ({', '.join('?' * len(values))})")
+            params.extend(values)
+    if start_date:
+        clauses.append(f"{TIMESTAMP_COLUMN} >= ?")
+        params.append(start_date.isoformat())
+    if end_date:
+        clauses.append(f"{TIMESTAMP_COLUMN} < ?")
+        params.append((end_date + datetime.timedelta(days=1)).isoformat())
+    return " AND ".join(clauses), params
+
+
+def query_dataset(
+    conn: Optional[sqlite3.Connection],
+    available: Sequence[str],
+    operators: Optional[List[str]] = None,
+    categories: Optional[List[str]] = None,
+    start_date: Optional[datetime.date] = None,
+    end_date: Optional[datetime.date] = None,
+    columns: Optional[List[str]] = None,
+    sort: Optional[List[str]] = None,
+    limit: Optional[int] = None,
+    offset: int = 0,
+    missing="",
+) -> Tuple[List[dict], int]:
+    """
+    Applica i filtri all'archivio e restituisce la pagina richiesta e il numero totale di righe filtrate.
+    `available` sono le colonne dei dati (`StoreState.columns`); `sort` è una lista di colonne,
+    con prefisso "-" per l'ordine decrescente.
+    """
+    if conn is None or not available:
+        return [], 0
+    if offset < 0 or (limit is not None and limit < 0):
+        raise QueryError("limit e offset devono essere non negativi")
+
+    where, params = _filters(operators, categories, start_date, end_date)
+    order_by = DEFAULT_ORDER
+    if sort:
+        sort_columns = [s.lstrip("-") for s in sort]
+        _check_columns(available, sort_columns)
+        # Valori mancanti in fondo in entrambe le direzioni; a parità vale l'ordine predefinito
+        terms = [
+            f"{quote_identifier(column)} IS NULL, {quote_identifier(column)}{' DESC' if s.startswith('-') else ''}"
+            for s, column in zip(sort, sort_columns)
+        ]
+        order_by = ", ".join(terms + [DEFAULT_ORDER])
+    if columns:
+        _check_columns(available, columns)
+
+    total = count_records(conn, where, params)
+    records = fetch_records(conn, columns or available, where, params, order_by, limit, offset, missing=missing)
+    return records, total
+
+
+def iter_dataset(
+    conn: Optional[sqlite3.Connection],
+    available: Sequence[str],
+    operators: Optional[List[str]] = None,
+    categories: Optional[List[str]] = None,
+    start_date: Optional[datetime.date] = None,
+    end_date: Optional[datetime.date] = None,
+    columns: Optional[List[str]] = None,
+    batch_size: int = 1000,
+    missing="",
+) -> Iterator[List[dict]]:
+    """Righe filtrate nell'ordine predefinito, a blocchi di `batch_size`: la memoria non cresce con il dataset."""
+    if conn is None or not available:
+        return
+    if columns:
+        _check_columns(available, columns)
+    where, params = _filters(operators, categories, start_date, end_date)
+    yield from iter_records(conn, columns or list(available), where, params, batch_size=batch_size, missing=missing)
+
+
+def filter_options(conn: Optional[sqlite3.Connection], available: Sequence[str]) -> dict:
+    """Valori disponibili per i filtri della dashboard (operatori, categorie, intervallo di date)."""
+    if conn is None or not available:
+        return {"operators": [], "categories": [], "min_date": None, "max_date": None}
+
+    def distinct(column):
+        name = quote_identifier(column)
+        return [value for (value,) in conn.execute(f"SELECT DISTINCT {name} FROM {RECORDS_TABLE} WHERE {name} IS NOT NULL ORDER BY {name}")]
+
+    min_date, max_date = conn.execute(
+        f"SELECT substr(min({TIMESTAMP_COLUMN}), 1, 10), substr(max({TIMESTAMP_COLUMN}), 1, 10) FROM {RECORDS_TABLE}"
+    ).fetchone()
+    return {
+        "operators": distinct(OPERATOR_COLUMN_NAME),
+        "categories": distinct(CATEGORY_COLUMN_NAME),
+        "min_date": min_date,
+        "max_date": max_date,
+    }
@@ -0,0 +1,477 @@
+"""Archivio SQLite del dataset aggregato (`aggregated_data.sqlite`), interrogato da `main.py`.
+
+`aggregator.py` aggiorna l'archivio in modo incrementale. Ogni foglio di ogni file Excel ha una riga
+nella tabella `sheets` con chiave (file, foglio) e il numero di sequenza dell'ingestione che ha prodotto
+le sue righe: quando un file cambia le righe dei suoi fogli vengono sostituite (upsert), quando viene
+cancellato vengono eliminate. I file non modificati non vengono né riletti né riscritti.
+
+Le righe sono nella tabella `records`, con indici su data di inserimento, operatore e categoria, così i
+filtri di `/api/data` leggono solo le righe selezionate. La chiave di ogni riga è `seq << 32 | posizione
+nel lotto` (la stessa dell'indice di ricerca). `main.py` legge l'archivio con `DataStore`: stato corrente
+(versione, colonne) ricaricato solo quando il file cambia e connessioni in sola lettura riutilizzate.
+
+Il dataset servito è condiviso tra i worker gunicorn tramite il file stesso: le connessioni lo mappano in
+memoria (`MMAP_SIZE`) e SQLite legge le pagine direttamente dalla mappatura, senza copiarle nella cache
+privata della connessione. Le pagine stanno quindi una sola volta nella cache del sistema operativo,
+qualunque sia il numero di worker. Una nuova versione (da `aggregator.py` o da `/api/ingest`) è un nuovo
+file o una transazione sul file esistente: le connessioni a un file sostituito vengono chiuse dal pool
+(vedi `DataStore.connection`) e quelle nuove mappano la versione corrente.
+"""
+from __future__ import annotations
+import hashlib
+import json
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import closing, contextmanager
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from data_cache import FileCache, file_lock
+from dataset_types import (
+    CATEGORY_COLUMN_NAME,
+    DATE_COLUMN_NAME,
+    INTEGER_COLUMNS,
+    OPERATOR_COLUMN_NAME,
+    ROW_ID_COLUMN,
+    ROW_VERSION_COLUMN,
+    apply_dtypes,
+    format_dates,
+)
+
+DATA_DB_FILENAME = "aggregated_data.sqlite"
+CSV_FILENAME = "aggregated_data.csv"
+SYNC_STATE_FILENAME = "aggregated_version.json"
+RECORDS_TABLE = "records"
+# Nome del foglio Excel di provenienza, impostato da `aggregator.parse_workbook` in `DataFrame.attrs`
+SHEET_NAME_ATTR = "sheet_name"
+POOL_SIZE = 4
+# Letture tramite mmap (fino a 1 GiB dell'archivio): le pagine restano nella cache del sistema operativo,
+# condivisa da tutti i worker, invece di essere copiate nella cache privata di ogni connessione
+MMAP_SIZE = 1024 * 1024 * 1024
+# Colonne interne di `records`, non restituite dalle API: chiave, file di provenienza e data di
+# inserimento in formato ISO ("YYYY-MM-DD HH:MM:SS"), confrontabile come testo
+KEY_COLUMN = "row_key"
+SOURCE_COLUMN = "source"
+TIMESTAMP_COLUMN = "inserted_at"
+# Stesso ordine del CSV aggregato: data (righe senza data in fondo), poi file e posizione nel file
+DEFAULT_ORDER = f"{TIMESTAMP_COLUMN} IS NULL, {TIMESTAMP_COLUMN}, {SOURCE_COLUMN}, {KEY_COLUMN}"
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS sheets (
+    source TEXT NOT NULL,
+    sheet TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    first_row INTEGER NOT NULL,
+    row_count INTEGER NOT NULL,
+    PRIMARY KEY (source, sheet)
+);
+CREATE TABLE IF NOT EXISTS {RECORDS_TABLE} (
+    {KEY_COLUMN} INTEGER PRIMARY KEY,
+    {SOURCE_COLUMN} TEXT NOT NULL,
+    {TIMESTAMP_COLUMN} TEXT,
+    "{OPERATOR_COLUMN_NAME}" TEXT,
+    "{CATEGORY_COLUMN_NAME}" TEXT
+);
+CREATE INDEX IF NOT EXISTS records_inserted_at ON {RECORDS_TABLE} ({TIMESTAMP_COLUMN});
+CREATE INDEX IF NOT EXISTS records_operator ON {RECORDS_TABLE} ("{OPERATOR_COLUMN_NAME}", {TIMESTAMP_COLUMN});
+CREATE INDEX IF NOT EXISTS records_category ON {RECORDS_TABLE} ("{CATEGORY_COLUMN_NAME}", {TIMESTAMP_COLUMN});
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def row_keys(df: pd.DataFrame) -> np.ndarray:
+    """Chiave di ogni riga: `_version << 32 | posizione`, con la posizione letta da `_id` ("seq-posizione")."""
+    positions = df[ROW_ID_COLUMN].astype(str).str.rsplit("-", n=1).str[1].astype("int64").to_numpy()
+    return (df[ROW_VERSION_COLUMN].to_numpy(dtype="int64") << 32) | positions
+
+
+def batch_key_range(seq: int, first_row: int = 0, row_count: int = 1 << 32) -> Tuple[int, int]:
+    """Intervallo (estremi inclusi) delle chiavi delle righe `first_row`... del lotto `seq`."""
+    return (seq << 32) | first_row, (seq << 32) | (first_row + row_count - 1)
+
+
+def open_read_only(path: str) -> sqlite3.Connection:
+    """Connessione in sola lettura, utilizzabile da più thread (uno alla volta)."""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False, timeout=30)
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    return conn
+
+
+# --- Scrittura (aggregator.py) ---
+
+def connect_store(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=30)
+    conn.executescript(_SCHEMA)
+    _migrate_integer_columns(conn)
+    return conn
+
+
+def _migrate_integer_columns(conn: sqlite3.Connection) -> None:
+    # Archivi creati quando solo `_version` era intero: le colonne di `INTEGER_COLUMNS` salvate come testo
+    # vengono ricreate come INTEGER (DROP COLUMN richiede SQLite 3.35)
+    for _, name, kind, *_ in list(conn.execute(f"PRAGMA table_info({RECORDS_TABLE})")):
+        if name in INTEGER_COLUMNS and kind.upper() != "INTEGER":
+            old = quote_identifier(f"{name}_text")
+            with conn:
+                conn.execute(f"ALTER TABLE {RECORDS_TABLE} RENAME COLUMN {quote_identifier(name)} TO {old}")
+                conn.execute(f"ALTER TABLE {RECORDS_TABLE} ADD COLUMN {quote_identifier(name)} INTEGER")
+                conn.execute(f"UPDATE {RECORDS_TABLE} SET {quote_identifier(name)} = {old}")
+                conn.execute(f"ALTER TABLE {RECORDS_TABLE} DROP COLUMN {old}")
+                _bump_revision(conn)
+
+
+def stored_batches(conn: sqlite3.Connection) -> set:
+    """Numeri di sequenza dei lotti presenti nell'archivio."""
+    return {seq for (seq,) in conn.execute("SELECT DISTINCT seq FROM sheets")}
+
+
+def _sheet_frames(frames: Iterable[pd.DataFrame]) -> Iterator[Tuple[int, str, pd.DataFrame]]:
+    # (seq, foglio, righe) per ogni foglio non vuoto; i fogli letti da un manifest precedente a
+    # `SHEET_NAME_ATTR` sono identificati dalla loro posizione nel file
+    positions: Dict[int, int] = {}
+    for frame in frames:
+        if frame.empty:
+            continue
+        seq = int(frame[ROW_VERSION_COLUMN].iloc[0])
+        position = positions[seq] = positions.get(seq, -1) + 1
+        sheet = frame.attrs.get(SHEET_NAME_ATTR) or f"#{position}"
+        frame = frame.rename(columns=lambda name: str(name).strip())
+        yield seq, sheet, frame
+
+
+def _column_values(frame: pd.DataFrame) -> Dict[str, list]:
+    """Valori delle colonne come oggetti Python (None per i valori mancanti), date nel formato del CSV."""
+    typed = apply_dtypes(frame)
+    values = {}
+    for name in typed.columns:
+        series = typed[name]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            series = format_dates(series)
+        values[name] = series.astype(object).where(series.notna(), None).tolist()
+    return values
+
+
+def _add_columns(conn: sqlite3.Connection, columns: List[str]) -> None:
+    existing = {name for _, name, *_ in conn.execute(f"PRAGMA table_info({RECORDS_TABLE})")}
+    for name in columns:
+        if name not in existing:
+            # Affinità INTEGER per `Soggetto` e `_version`: i numeri sono salvati come interi (ordinamento
+            # numerico), i codici come "F0010200" restano testo
+            kind = "INTEGER" if name in INTEGER_COLUMNS else "TEXT"
+            conn.execute(f"ALTER TABLE {RECORDS_TABLE} ADD COLUMN {quote_identifier(name)} {kind}")
+
+
+def _set_meta(conn: sqlite3.Connection, key: str, value: str) -> None:
+    conn.execute("INSERT INTO meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value", (key, value))
+
+
+def _bump_revision(conn: sqlite3.Connection) -> None:
+    # Revisione dell'archivio (nell'ETag): cresce a ogni scrittura, anche di sole cancellazioni, e non
+    # si ripete tra archivi diversi (es. uno ricreato dal CSV dopo un redeploy)
+    row = conn.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()
+    previous = int(row[0]) if row else 0
+    _set_meta(conn, "revision", str(max(previous + 1, time.time_ns())))
+
+
+def _insert_records(conn: sqlite3.Connection, columns: List[str], source: str, frame: pd.DataFrame, keys: np.ndarray) -> None:
+    """Scrive le righe di `frame` con le chiavi `keys`, aggiungendo a `columns` (e alla tabella) le colonne nuove."""
+    values = _column_values(frame)
+    new_columns = [name for name in values if name not in columns]
+    if new_columns:
+        _add_columns(conn, new_columns)
+        columns.extend(new_columns)
+    timestamps = pd.to_datetime(frame[DATE_COLUMN_NAME], errors="coerce") if DATE_COLUMN_NAME in frame.columns else pd.Series(pd.NaT, index=frame.index)
+    timestamps = timestamps.dt.strftime("%Y-%m-%d %H:%M:%S").astype(object).where(timestamps.notna(), None).tolist()
+    names = [KEY_COLUMN, SOURCE_COLUMN, TIMESTAMP_COLUMN] + list(values)
+    conn.executemany(
+        f"INSERT INTO {RECORDS_TABLE} ({', '.join(map(quote_identifier, names))}) VALUES ({', '.join('?' * len(names))})",
+        zip(keys.tolist(), [source] * len(frame), timestamps, *values.values()),
+    )
+
+
+def update_data_store(
+    conn: sqlite3.Connection,
+    frames: Iterable[pd.DataFrame],
+    sources: Dict[int, str],
+    version: int,
+    full_rebuild: bool = False,
+) -> Tuple[int, int]:
+    """Allinea l'archivio ai lotti di `sources` (seq -> file Excel) in un'unica transazione.
+
+    `frames` sono i fogli letti (con `_version` e `_id`): vengono scritti solo quelli dei lotti non ancora
+    presenti, sostituendo le righe dello stesso (file, foglio). I fogli dei lotti non più in `sources`
+    vengono eliminati. Con `full_rebuild` l'archivio viene svuotato e riscritto con tutti i fogli.
+    Ogni modifica incrementa la revisione in `meta`, da cui dipende l'ETag dei dati serviti.
+    Restituisce (righe scritte, righe eliminate).
+    """
+    added_rows = removed_rows = 0
+    with conn:
+        if full_rebuild:
+            removed_rows = conn.execute(f"DELETE FROM {RECORDS_TABLE}").rowcount
+            conn.execute("DELETE FROM sheets")
+            conn.execute("DELETE FROM meta WHERE key = 'columns'")
+        stored = {
+            (source, sheet): (seq, first_row, row_count)
+            for source, sheet, seq, first_row, row_count in conn.execute("SELECT source, sheet, seq, first_row, row_count FROM sheets")
+        }
+        stored_seqs = {seq for seq, _, _ in stored.values()}
+        meta = dict(conn.execute("SELECT key, value FROM meta"))
+        columns = json.loads(meta.get("columns", "[]"))
+
+        for seq, sheet, frame in _sheet_frames(frames):
+            if seq in stored_seqs or seq not in sources:
+                continue
+            source = sources[seq]
+            previous = stored.pop((source, sheet), None)
+            if previous is not None:
+                conn.execute(f"DELETE FROM {RECORDS_TABLE} WHERE {KEY_COLUMN} BETWEEN ? AND ?", batch_key_range(*previous))
+                removed_rows += previous[2]
+
+            keys = row_keys(frame)
+            _insert_records(conn, columns, source, frame, keys)
+            conn.execute(
+                "INSERT INTO sheets (source, sheet, seq, first_row, row_count) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(source, sheet) DO UPDATE SET seq = excluded.seq, first_row = excluded.first_row, row_count = excluded.row_count",
+                (source, sheet, seq, int(keys[0] & 0xFFFFFFFF), len(frame)),
+            )
+            added_rows += len(frame)
+
+        # Fogli di lotti rimossi (file cancellati o sostituiti, fogli non più presenti)
+        for (source, sheet), (seq, first_row, row_count) in stored.items():
+            if seq not in sources:
+                conn.execute(f"DELETE FROM {RECORDS_TABLE} WHERE {KEY_COLUMN} BETWEEN ? AND ?", batch_key_range(seq, first_row, row_count))
+                conn.execute("DELETE FROM sheets WHERE source = ? AND sheet = ?", (source, sheet))
+                removed_rows += row_count
+
+        _set_meta(conn, "columns", json.dumps(columns, ensure_ascii=False))
+        _set_meta(conn, "version", str(version))
+        if full_rebuild or added_rows or removed_rows:
+            _bump_revision(conn)
+    return added_rows, removed_rows
+
+
+def build_store_from_csv(csv_path: str, path: str) -> int:
+    """Crea l'archivio `path` dalle righe di `csv_path` (l'export nel repository), se non esiste ancora.
+
+    Serve a chi pubblica solo `aggregated_data.csv`: il server crea l'archivio alla prima richiesta.
+    Le chiavi vengono da `_version`/`_id` se il CSV li contiene, altrimenti dalla posizione della riga.
+    L'archivio viene scritto in un file temporaneo e rinominato, sotto un lock tra i worker.
+    Restituisce il numero di righe importate (0 se l'archivio esisteva già).
+    """
+    directory, name = os.path.split(path)
+    with file_lock(os.path.join(directory, f".{name}.lock")):
+        if os.path.exists(path):
+            return 0
+        try:
+            df = pd.read_csv(csv_path)
+        except pd.errors.EmptyDataError:
+            df = pd.DataFrame()
+        df = df.rename(columns=lambda column: str(column).strip())
+        if {ROW_VERSION_COLUMN, ROW_ID_COLUMN} <= set(df.columns) and df[[ROW_VERSION_COLUMN, ROW_ID_COLUMN]].notna().all().all():
+            keys = row_keys(df)
+        else:
+            keys = np.arange(len(df), dtype="int64")
+        source = os.path.basename(csv_path)
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=directory)
+        os.close(fd)
+        try:
+            with closing(connect_store(tmp_path)) as conn, conn:
+                columns: List[str] = []
+                if len(df):
+                    _insert_records(conn, columns, source, df, keys)
+                    # Un foglio fittizio per lotto, così `aggregator.py` sostituisce queste righe alla prima esecuzione
+                    for seq, batch_keys in pd.Series(keys).groupby(keys >> 32):
+                        positions = batch_keys & 0xFFFFFFFF
+                        conn.execute(
+                            "INSERT INTO sheets (source, sheet, seq, first_row, row_count) VALUES (?, ?, ?, ?, ?)",
+                            (source, f"#{seq}", int(seq), int(positions.min()), int(positions.max() - positions.min() + 1)),
+                        )
+                _set_meta(conn, "columns", json.dumps(columns, ensure_ascii=False))
+                _set_meta(conn, "version", str(int(keys.max() >> 32) if len(keys) else 0))
+                _bump_revision(conn)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+    print(f"Archivio {path} creato da {csv_path} ({len(df)} righe)")
+    return len(df)
+
+
+# --- Lettura (main.py) ---
+
+@dataclass(frozen=True)
+class StoreState:
+    """Versione dell'archivio e colonne dei dati, nell'ordine del CSV aggregato."""
+    key: Optional[Tuple[int, int, int]]
+    version: int
+    columns: Tuple[str, ...]
+    # Hash di versione, revisione (vedi `_bump_revision`) e colonne: usato come ETag e come X-Data-Version
+    etag: str
+    last_modified: Optional[float]
+
+
+class _StoreStateCache(FileCache):
+    def _load(self, key: Optional[Tuple[int, int, int]]) -> StoreState:
+        meta = {}
+        if key is not None:
+            try:
+                with closing(open_read_only(self.path)) as conn:
+                    meta = dict(conn.execute("SELECT key, value FROM meta"))
+            except sqlite3.Error:
+                meta = {}
+        version = int(meta.get("version", 0))
+        columns = tuple(json.loads(meta.get("columns", "[]")))
+        return StoreState(
+            key=key,
+            version=version,
+            columns=columns,
+            etag=hashlib.sha256(f"{version}\0{meta.get('revision', '')}\0{meta.get('columns', '')}".encode("utf-8")).hexdigest()[:32],
+            last_modified=key[2] / 1e9 if key else None,
+        )
+
+
+class DataStore:
+    """Accesso in sola lettura all'archivio: stato corrente e pool di connessioni condiviso tra i thread del worker."""
+
+    def __init__(self, path: str, pool_size: int = POOL_SIZE, csv_path: Optional[str] = None):
+        self.path = path
+        # Export da cui creare l'archivio se manca (vedi `build_store_from_csv`)
+        self.csv_path = csv_path
+        self._state = _StoreStateCache(path)
+        # (inode del file, connessione): se l'archivio viene sostituito le connessioni al vecchio file si chiudono
+        self._idle: queue.LifoQueue = queue.LifoQueue(maxsize=pool_size)
+        self._closed = False
+        # Intero dataset già serializzato in JSON per la versione corrente: (etag, corpo, numero di righe)
+        self._json_lock = threading.Lock()
+        self._json: Tuple[Optional[str], bytes, int] = (None, b"[]", 0)
+
+    def state(self) -> StoreState:
+        state = self._state.get()
+        if state.key is None and self.csv_path is not None and os.path.exists(self.csv_path):
+            try:
+                build_store_from_csv(self.csv_path, self.path)
+            except (OSError, sqlite3.Error) as e:
+                print(f"Impossibile creare {self.path} da {self.csv_path}: {e}")
+            state = self._state.get()
+        return state
+
+    def dataset_json(self, state: StoreState) -> Tuple[bytes, int]:
+        """Intero dataset (tutte le colonne, ordine predefinito) in JSON e numero di righe.
+
+        Il corpo viene serializzato una sola volta per versione dell'archivio (`state.etag`): le richieste
+        che arrivano durante la ricostruzione attendono la stessa invece di rileggere tutto l'archivio.
+        """
+        etag, body, total = self._json
+        if etag == state.etag:
+            return body, total
+        with self._json_lock:
+            etag, body, total = self._json
+            if etag != state.etag:
+                records = []
+                if state.columns:
+                    with self.connection() as conn:
+                        if conn is not None:
+                            records = fetch_records(conn, state.columns)
+                body, total = records_json(records), len(records)
+                self._json = (state.etag, body, total)
+            return body, total
+
+    def close(self) -> None:
+        """Chiude le connessioni inattive; quelle in uso vengono chiuse quando tornano al pool."""
+        self._closed = True
+        while True:
+            try:
+                _, conn = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            conn.close()
+
+    @contextmanager
+    def connection(self) -> Iterator[Optional[sqlite3.Connection]]:
+        """Connessione presa dal pool e restituita al termine; None se l'archivio non esiste ancora."""
+        key = self.state().key
+        if key is None:
+            yield None
+            return
+        inode = key[0]
+        conn = None
+        while conn is None:
+            try:
+                idle_inode, idle_conn = self._idle.get_nowait()
+            except queue.Empty:
+                idle_inode, idle_conn = inode, open_read_only(self.path)
+            if idle_inode == inode:
+                conn = idle_conn
+            else:
+                idle_conn.close()
+        try:
+            yield conn
+        finally:
+            if self._closed:
+                conn.close()
+            else:
+                try:
+                    self._idle.put_nowait((inode, conn))
+                except queue.Full:
+                    conn.close()
+
+
+def fetch_records(
+    conn: sqlite3.Connection,
+    columns: Sequence[str],
+    where: str = "",
+    params: Sequence = (),
+    order_by: str = DEFAULT_ORDER,
+    limit: Optional[int] = None,
+    offset: int = 0,
+    missing="",
+) -> List[dict]:
+    """Righe di `records` come dizionari con le colonne `columns`; i valori mancanti diventano `missing`."""
+    sql = f"SELECT {', '.join(map(quote_identifier, columns))} FROM {RECORDS_TABLE}"
+    if where:
+        sql += f" WHERE {where}"
+    sql += f" ORDER BY {order_by} LIMIT ? OFFSET ?"
+    rows = conn.execute(sql, (*params, -1 if limit is None else limit, offset))
+    return [dict(zip(columns, (missing if value is None else value for value in row))) for row in rows]
+
+
+def iter_records(
+    conn: sqlite3.Connection,
+    columns: Sequence[str],
+    where: str = "",
+    params: Sequence = (),
+    order_by: str = DEFAULT_ORDER,
+    batch_size: int = 1000,
+    missing="",
+) -> Iterator[List[dict]]:
+    """Come `fetch_records`, ma a blocchi di al più `batch_size` righe letti dal cursore man mano."""
+    sql = f"SELECT {', '.join(map(quote_identifier, columns))} FROM {RECORDS_TABLE}"
+    if where:
+        sql += f" WHERE {where}"
+    cursor = conn.execute(f"{sql} ORDER BY {order_by}", tuple(params))
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield [dict(zip(columns, (missing if value is None else value for value in row))) for row in rows]
+
+
+def count_records(conn: sqlite3.Connection, where: str = "", params: Sequence = ()) -> int:
+    sql = f"SELECT count(*) FROM {RECORDS_TABLE}" + (f" WHERE {where}" if where else "")
+    return conn.execute(sql, tuple(params)).fetchone()[0]
+
+
+def records_json(records: List[dict]) -> bytes:
+    """Serializza le righe come array JSON (stessi parametri di FastAPI JSONResponse)."""
+    return json.dumps(records, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
@@ -0,0 +1,53 @@
+"""Risposte in streaming per `/api/data/stream` (NDJSON o array JSON a blocchi).
+
+Le righe vengono lette a blocchi dall'archivio Arrow e serializzate man mano,
+così la memoria usata da una richiesta non cresce con la dimensione del dataset.
+"""
+from __future__ import annotations
+import datetime
+import json
+from typing import Iterable, Iterator
+
+import pyarrow as pa
+
+
+def _json_value(value):
+    # Stessa convenzione di /api/data: valori mancanti -> stringa vuota, date ISO
+    if value is None:
+        return ''
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    if isinstance(value, float) and value != value:
+        return ''
+    return value
+
+
+def _dumps(row: dict) -> str:
+    return json.dumps(
+        {key: _json_value(value) for key, value in row.items()},
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(",", ":"),
+    )
+
+
+def ndjson_chunks(batches: Iterable[pa.RecordBatch]) -> Iterator[bytes]:
+    """Una riga JSON per record, un blocco di byte per batch."""
+    for batch in batches:
+        lines = [_dumps(row) for row in batch.to_pylist()]
+        if lines:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def json_array_chunks(batches: Iterable[pa.RecordBatch]) -> Iterator[bytes]:
+    """Un array JSON valido emesso a blocchi, un blocco per batch."""
+    yield b"["
+    first = True
+    for batch in batches:
+        rows = [_dumps(row) for row in batch.to_pylist()]
+        if not rows:
+            continue
+        prefix = "" if first else ","
+        first = False
+        yield (prefix + ",".join(rows)).encode("utf-8")
+    yield b"]"
@@ -0,0 +1,43 @@
+"""Sincronizzazione incrementale della PWA (`/api/data/changes`).
+
+Ogni riga aggregata porta il numero di sequenza dell'ingestione che l'ha prodotta (`_version`)
+e un id stabile (`_id`). `aggregated_version.json` contiene la versione corrente del dataset
+e i lotti rimossi (`[seq, rimosso alla versione]`), scritti da `aggregator.py`. Sono elencati solo gli
+ultimi lotti rimossi: `min_version` è la versione più vecchia da cui un client può ancora aggiornarsi.
+"""
+from __future__ import annotations
+import json
+import sqlite3
+from typing import Optional, Sequence
+
+from data_store import KEY_COLUMN, ROW_VERSION_COLUMN, fetch_records
+
+EMPTY_SYNC_STATE = {"version": 0, "removed": [], "min_version": 0}
+
+
+def changes_since(conn: Optional[sqlite3.Connection], available: Sequence[str], sync_state: dict, since: int) -> bytes:
+    """
+    Righe aggiunte e lotti rimossi dopo la versione `since`, serializzati in JSON.
+    Se il client ha una versione sconosciuta al server (`since` maggiore della versione corrente) o
+    più vecchia di `min_version` riceve `reset: true` e l'intero dataset.
+    """
+    sync_state = sync_state or EMPTY_SYNC_STATE
+    version = sync_state.get("version", 0)
+    empty = conn is None or not available
+    # Versione anteriore ai lotti rimossi ancora elencati (vedi `aggregator.MAX_REMOVED_BATCHES`): serve l'intero dataset
+    too_old = 0 < since < sync_state.get("min_version", 0)
+    reset = since > version or too_old or (not empty and ROW_VERSION_COLUMN not in available)
+
+    if empty:
+        added = []
+    elif reset:
+        added = fetch_records(conn, available)
+    else:
+        # `_version > since` equivale a chiave >= (since + 1) << 32: una scansione della chiave primaria
+        added = fetch_records(conn, available, f"{KEY_COLUMN} >= ?", (max(since + 1, 0) << 32,))
+    removed = []
+    if not reset:
+        removed = sorted({seq for seq, removed_at in sync_state.get("removed", []) if removed_at > since and seq <= since})
+
+    payload = {"version": version, "reset": reset, "added": added, "removed": removed}
+    return json.dumps(payload, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
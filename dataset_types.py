@@ -0,0 +1,108 @@
+"""Tipi compatti per il dataset aggregato, condivisi da `main.py`, `dashboard.py` e `aggregator.py`.
+
+- `Operatore`, `Categoria`, `Ragione sociale`: `category` (codici interi + elenco dei valori),
+  così i filtri `isin` confrontano interi invece di stringhe;
+- `Dt. ins.`: `datetime64[ns]`;
+- `Soggetto`, `_version`: intero nullable (`Int64`). `Soggetto` può contenere codici come
+  "F0010200": in quel caso resta testo;
+- le altre colonne di testo (`Note interne 1`, `Contatto`, `_id`): stringhe Arrow (`string[pyarrow]`).
+
+Per vedere il risparmio di memoria colonna per colonna:
+    python dataset_types.py aggregated_data.csv
+"""
+from __future__ import annotations
+import argparse
+from typing import Iterable
+
+import pandas as pd
+
+# Nomi delle colonne del dataset aggregato, usati da tutti i moduli che lo leggono o lo scrivono
+DATE_COLUMN_NAME = "Dt. ins."
+OPERATOR_COLUMN_NAME = "Operatore"
+CATEGORY_COLUMN_NAME = "Categoria"
+COMPANY_COLUMN_NAME = "Ragione sociale"
+NOTE_COLUMN_NAME = "Note interne 1"
+SUBJECT_COLUMN_NAME = "Soggetto"
+# Numero di sequenza dell'ingestione e id stabile di ogni riga (vedi `aggregator.py`)
+ROW_VERSION_COLUMN = "_version"
+ROW_ID_COLUMN = "_id"
+CATEGORY_COLUMNS = [OPERATOR_COLUMN_NAME, CATEGORY_COLUMN_NAME, COMPANY_COLUMN_NAME]
+INTEGER_COLUMNS = [SUBJECT_COLUMN_NAME, ROW_VERSION_COLUMN]
+TEXT_DTYPE = "string[pyarrow]"
+
+
+def is_integer_column(series: pd.Series) -> bool:
+    """True se tutti i valori presenti sono numeri interi (anche se letti come testo o float)."""
+    values = series.dropna()
+    numbers = pd.to_numeric(values, errors="coerce")
+    return bool(numbers.notna().all() and (numbers == numbers.round()).all())
+
+
+def apply_dtypes(
+    df: pd.DataFrame,
+    category_columns: Iterable[str] = CATEGORY_COLUMNS,
+    date_columns: Iterable[str] = (DATE_COLUMN_NAME,),
+    integer_columns: Iterable[str] = INTEGER_COLUMNS,
+) -> pd.DataFrame:
+    """Restituisce una copia di `df` con i tipi compatti; le colonne assenti vengono ignorate."""
+    category_columns, date_columns, integer_columns = set(category_columns), set(date_columns), set(integer_columns)
+    columns = {}
+    for name in df.columns:
+        series = df[name]
+        if name in date_columns:
+            series = pd.to_datetime(series, errors="coerce").astype("datetime64[ns]")
+        elif name in category_columns:
+            series = series.astype("category")
+        elif name in integer_columns and is_integer_column(series):
+            series = pd.to_numeric(series).astype("Int64")
+        elif pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series):
+            series = series.astype(TEXT_DTYPE)
+        columns[name] = series
+    return pd.DataFrame(columns, index=df.index)
+
+
+def read_dataset(path: str) -> pd.DataFrame:
+    """Legge `aggregated_data.csv` con i tipi compatti."""
+    return apply_dtypes(pd.read_csv(path))
+
+
+def format_dates(dates: pd.Series) -> pd.Series:
+    """Date come testo nello stesso formato di `DataFrame.to_csv` (solo giorno se non ci sono orari)."""
+    present = dates.dropna()
+    fmt = "%Y-%m-%d" if (present == present.dt.normalize()).all() else "%Y-%m-%d %H:%M:%S"
+    return dates.dt.strftime(fmt)
+
+
+def memory_report(before: pd.DataFrame, after: pd.DataFrame) -> pd.DataFrame:
+    """Memoria per colonna (byte) prima e dopo la conversione dei tipi."""
+    before_bytes = before.memory_usage(deep=True, index=False)
+    after_bytes = after.memory_usage(deep=True, index=False)
+    report = pd.DataFrame({
+        "tipo prima": before.dtypes.astype(str),
+        "tipo dopo": after.dtypes.astype(str),
+        "byte prima": before_bytes,
+        "byte dopo": after_bytes,
+    })
+    report.loc["Totale"] = ["", "", before_bytes.sum(), after_bytes.sum()]
+    report["risparmio %"] = (100 * (1 - report["byte dopo"] / report["byte prima"])).round(1)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memoria del dataset aggregato con e senza tipi compatti.")
+    parser.add_argument("path", nargs="?", default="aggregated_data.csv", help="CSV aggregato da analizzare.")
+    args = parser.parse_args()
+
+    # Come pd.read_csv senza tipi, con il testo in oggetti Python
+    plain = pd.read_csv(args.path, dtype=object)
+    for name in plain.columns:
+        converted = pd.to_numeric(plain[name], errors="coerce")
+        if converted.notna().sum() == plain[name].notna().sum():
+            plain[name] = converted
+    typed = apply_dtypes(pd.read_csv(args.path))
+    print(f"{len(typed)} righe\n")
+    print(memory_report(plain, typed).to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Lettura dei fogli "Operatore_Categoria" dei report Excel con backend intercambiabili.
+
+Layout dei fogli generati da `attivita_giornaliere.process_excel_file`:
+    riga 1: logo, riga 2: titolo, riga 3: intestazioni, dalla riga 4: dati.
+
+Backend disponibili:
+    "openpyxl"        pandas.read_excel con openpyxl (comportamento storico)
+    "openpyxl-stream" openpyxl in sola lettura, iterando le righe a partire dalle intestazioni
+                      senza costruire le righe di logo e titolo
+    "calamine"        pandas.read_excel con python-calamine (molto più veloce), se installato
+
+Con `engine=None` si usa calamine se disponibile, altrimenti openpyxl-stream.
+"""
+from __future__ import annotations
+from typing import Callable, List, Optional, Tuple
+
+import pandas as pd
+from pandas.io.parsers import TextParser
+
+HEADER_ROW = 3  # Le righe 1 e 2 contengono logo e titolo
+ENGINES = ("openpyxl", "openpyxl-stream", "calamine")
+
+
+def is_report_sheet(sheet_name: str) -> bool:
+    """I fogli elaborati hanno nome "Operatore_Categoria"; il foglio originale ("Foglio1", "Sheet1") no."""
+    return "_" in sheet_name
+
+
+def available_engines() -> List[str]:
+    engines = ["openpyxl", "openpyxl-stream"]
+    try:
+        import python_calamine  # noqa: F401
+        engines.append("calamine")
+    except ImportError:
+        pass
+    return engines
+
+
+def default_engine() -> str:
+    return "calamine" if "calamine" in available_engines() else "openpyxl-stream"
+
+
+def _read_with_pandas(file, engine: str, include: Callable[[str], bool]) -> List[Tuple[str, pd.DataFrame]]:
+    sheets = []
+    with pd.ExcelFile(file, engine=engine) as xls:
+        for sheet_name in xls.sheet_names:
+            if not include(sheet_name):
+                continue
+            df_sheet = pd.read_excel(xls, sheet_name=sheet_name, skiprows=HEADER_ROW - 1) # Skip logo and title rows
+            sheets.append((sheet_name, df_sheet))
+    return sheets
+
+
+def _read_with_openpyxl_stream(file, include: Callable[[str], bool]) -> List[Tuple[str, pd.DataFrame]]:
+    from openpyxl import load_workbook
+
+    sheets = []
+    workbook = load_workbook(file, read_only=True, data_only=True, keep_links=False)
+    try:
+        for worksheet in workbook.worksheets:
+            if not include(worksheet.title):
+                continue
+            rows = [list(row) for row in worksheet.iter_rows(min_row=HEADER_ROW, values_only=True)]
+            # Come pandas: scarta le righe vuote finali
+            while rows and all(value is None for value in rows[-1]):
+                rows.pop()
+            if not rows:
+                sheets.append((worksheet.title, pd.DataFrame()))
+                continue
+            # Stessa conversione dei tipi usata da pandas.read_excel
+            df_sheet = TextParser(rows, header=0).read()
+            sheets.append((worksheet.title, df_sheet))
+    finally:
+        workbook.close()
+    return sheets
+
+
+def read_report_sheets(
+    file,
+    engine: Optional[str] = None,
+    include: Callable[[str], bool] = is_report_sheet,
+) -> List[Tuple[str, pd.DataFrame]]:
+    """Restituisce `(nome foglio, DataFrame)` per ogni foglio accettato da `include`, nell'ordine del file."""
+    engine = engine or default_engine()
+    if engine not in ENGINES:
+        raise ValueError(f"Backend di lettura sconosciuto: {engine} (disponibili: {', '.join(ENGINES)})")
+    if engine == "openpyxl-stream":
+        return _read_with_openpyxl_stream(file, include)
+    return _read_with_pandas(file, engine, include)
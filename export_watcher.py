@@ -0,0 +1,253 @@
+"""Rilevamento dei file `OpzioniEsportazione_*.xlsx` salvati dall'ERP, appena sono completi.
+
+Con il pacchetto `watchdog` la cartella è osservata tramite eventi del sistema operativo (inotify su
+Linux, ReadDirectoryChangesW su Windows); senza `watchdog` si confrontano dimensione e mtime dei file
+ogni `poll_interval` secondi.
+
+Un file è completo quando:
+- la dimensione e l'mtime non cambiano per `settle_seconds` (oppure, su Linux, l'ERP lo ha chiuso:
+  evento di chiusura dopo la scrittura);
+- è un archivio zip valido (un .xlsx scritto a metà non ha ancora la directory centrale in fondo)
+  e si può aprire in lettura (su Windows non lo è finché l'ERP lo tiene aperto in modo esclusivo).
+"""
+from __future__ import annotations
+import fnmatch
+import os
+import queue
+import threading
+import time
+import zipfile
+from typing import Dict, Iterable, Iterator, Optional, Set, Tuple
+
+try:
+    from watchdog.events import FileClosedEvent, FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # pragma: no cover - watchdog è opzionale
+    Observer = None
+
+EXPORT_PATTERN = "OpzioniEsportazione_*.xlsx"
+SETTLE_SECONDS = 1.0
+POLL_INTERVAL = 0.5
+
+Signature = Tuple[int, int]
+
+
+def file_signature(path: str) -> Optional[Signature]:
+    """(dimensione, mtime in ns) del file, oppure None se non esiste."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+
+def is_complete(path: str) -> bool:
+    """True se il file è un .xlsx completo (zip valido) e leggibile."""
+    try:
+        with open(path, "rb"):
+            pass
+    except OSError:
+        return False
+    return zipfile.is_zipfile(path)
+
+
+if Observer is not None:
+    class _QueueHandler(FileSystemEventHandler):
+        # Inoltra alla coda (percorso, chiuso dopo la scrittura) per ogni evento su un file
+        def __init__(self, events: queue.Queue):
+            self.events = events
+
+        def on_any_event(self, event):
+            # Le letture (es. aggregator.py che rilegge i file) non sono modifiche
+            if event.is_directory or event.event_type in ("opened", "closed_no_write"):
+                return
+            closed = isinstance(event, FileClosedEvent)
+            for path in (event.src_path, getattr(event, "dest_path", "")):
+                if path:
+                    self.events.put((os.fsdecode(path), closed))
+
+
+class ExportWatcher:
+    """Osserva `directory` e restituisce i file di esportazione appena sono completi.
+
+    Si usa come context manager:
+
+        with ExportWatcher(cartella) as watcher:
+            for path in watcher.completed_files():
+                ...
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        pattern: str = EXPORT_PATTERN,
+        settle_seconds: float = SETTLE_SECONDS,
+        poll_interval: float = POLL_INTERVAL,
+        use_events: bool = True,
+    ):
+        self.directory = os.path.abspath(directory)
+        self.pattern = pattern
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.use_events = use_events and Observer is not None
+        self._events: queue.Queue = queue.Queue()
+        self._observer = None
+        # Ultima firma vista per ogni file (modalità a polling)
+        self._scanned: Dict[str, Signature] = {}
+        # Firma dei file già restituiti o scritti da noi: non vanno segnalati di nuovo
+        self._handled: Dict[str, Signature] = {}
+        # File in elaborazione (es. riscritti da noi in questo momento): non vanno segnalati
+        self._busy: Set[str] = set()
+        # `mark_busy`/`mark_handled` sono chiamati dai thread della pipeline mentre `completed_files`
+        # gira nel thread del watcher: il lock protegge `_scanned`, `_handled` e `_busy`
+        self._lock = threading.Lock()
+
+    def __enter__(self) -> "ExportWatcher":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def start(self) -> None:
+        scanned = self._scan()
+        with self._lock:
+            self._scanned = scanned
+            # I file già presenti all'avvio vengono segnalati solo se cambiano
+            for path, signature in scanned.items():
+                self._handled.setdefault(path, signature)
+        if self.use_events and self._observer is None:
+            self._observer = Observer()
+            self._observer.schedule(_QueueHandler(self._events), self.directory, recursive=False)
+            self._observer.start()
+
+    def stop(self) -> None:
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+            self._observer = None
+
+    @property
+    def mode(self) -> str:
+        return "eventi" if self._observer is not None else f"polling ogni {self.poll_interval}s"
+
+    def _matches(self, path: str) -> bool:
+        return os.path.dirname(os.path.abspath(path)) == self.directory and fnmatch.fnmatch(os.path.basename(path), self.pattern)
+
+    def _scan(self) -> Dict[str, Signature]:
+        signatures = {}
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return signatures
+        for entry in entries:
+            if entry.is_file() and fnmatch.fnmatch(entry.name, self.pattern):
+                st = entry.stat()
+                signatures[os.path.abspath(entry.path)] = (st.st_size, st.st_mtime_ns)
+        return signatures
+
+    def _changes(self, timeout: float) -> Iterator[Tuple[str, bool]]:
+        """(percorso, chiuso) dei file modificati, attendendo al massimo `timeout` secondi."""
+        if self._observer is not None:
+            try:
+                item = self._events.get(timeout=max(timeout, 0))
+            except queue.Empty:
+                return
+            items = [item]
+            while True:
+                try:
+                    items.append(self._events.get_nowait())
+                except queue.Empty:
+                    break
+            for path, closed in items:
+                if self._matches(path):
+                    yield os.path.abspath(path), closed
+            return
+
+        time.sleep(max(timeout, 0))
+        scanned = self._scan()
+        with self._lock:
+            changed = [path for path, signature in scanned.items() if self._scanned.get(path) != signature]
+            self._scanned = scanned
+        for path in changed:
+            yield path, False
+
+    def mark_busy(self, path: str) -> None:
+        """Ignora il file finché non viene chiamata `mark_handled` (es. mentre lo riscriviamo noi)."""
+        with self._lock:
+            self._busy.add(os.path.abspath(path))
+
+    def mark_handled(self, path: str) -> None:
+        """Ignora il file finché non cambia di nuovo (es. dopo averlo riscritto noi)."""
+        path = os.path.abspath(path)
+        signature = file_signature(path)
+        with self._lock:
+            self._busy.discard(path)
+            if signature is not None:
+                self._handled[path] = signature
+                self._scanned[path] = signature
+
+    def completed_files(
+        self,
+        initial: Iterable[str] = (),
+        stop: Optional[threading.Event] = None,
+        timeout: Optional[float] = None,
+    ) -> Iterator[str]:
+        """Percorsi dei file nuovi o riscritti, restituiti appena sono completi.
+
+        `initial` sono file da controllare subito (già presenti all'avvio); l'iterazione termina quando
+        `stop` viene impostato o dopo `timeout` secondi.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        # percorso -> (firma, istante in cui è stata vista per la prima volta, chiuso dopo la scrittura)
+        pending: Dict[str, Tuple[Optional[Signature], float, bool]] = {}
+        for path in initial:
+            pending[os.path.abspath(path)] = (None, time.monotonic(), False)
+
+        while not (stop is not None and stop.is_set()):
+            now = time.monotonic()
+            if deadline is not None and now >= deadline:
+                return
+            ready: Set[str] = set()
+            for path, (previous, since, closed) in list(pending.items()):
+                signature = file_signature(path)
+                if signature is None:
+                    # Cancellato dopo essere stato visto (i file attesi in `initial` restano in attesa)
+                    if previous is not None:
+                        del pending[path]
+                    continue
+                if signature != previous:
+                    pending[path] = (signature, now, closed)
+                    if not closed:
+                        continue
+                if (closed or now - since >= self.settle_seconds) and is_complete(path):
+                    ready.add(path)
+            for path in sorted(ready):
+                del pending[path]
+                signature = file_signature(path)
+                with self._lock:
+                    if path in self._busy or self._handled.get(path) == signature:
+                        continue
+                    self._handled[path] = signature
+                yield path
+
+            wait = self.poll_interval
+            if deadline is not None:
+                wait = min(wait, deadline - time.monotonic())
+            for path, closed in self._changes(wait):
+                previous, since, was_closed = pending.get(path, (None, time.monotonic(), False))
+                pending[path] = (previous, since, closed or was_closed)
+
+    def wait_for(self, path: str, timeout: float, previous: Optional[Signature] = None) -> bool:
+        """Attende che `path` sia completo; `previous` è la firma di una versione precedente da ignorare."""
+        path = os.path.abspath(path)
+        # Solo la versione precedente va ignorata: il file può essere già stato scritto prima di `start()`
+        with self._lock:
+            if previous is None:
+                self._handled.pop(path, None)
+            else:
+                self._handled[path] = previous
+        for ready in self.completed_files(initial=[path], timeout=timeout):
+            if ready == path:
+                return True
+        return False
@@ -0,0 +1,16 @@
+"""Funzioni sui file condivise dai moduli di aggregazione, pubblicazione e server (solo libreria standard)."""
+from __future__ import annotations
+import hashlib
+
+
+def file_sha256(path: str, digest=None, chunk_size: int = 1024 * 1024) -> str:
+    """Hash SHA-256 del contenuto di un file, letto a blocchi.
+
+    Con `digest` il contenuto viene aggiunto a un hash già avviato (più file in un unico hash).
+    """
+    if digest is None:
+        digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
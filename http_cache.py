@@ -0,0 +1,218 @@
+"""Risposte condizionali (ETag / If-None-Match) e compressione gzip/brotli.
+
+- `cached_response` restituisce 304 senza corpo se il client ha già la versione corrente,
+  altrimenti il corpo compresso con la codifica migliore accettata dal client.
+  Le versioni compresse vengono calcolate una sola volta per ETag.
+- `CompressedStaticFiles` aggiunge brotli ai file statici testuali; gzip per il resto
+  è gestito da `GZipMiddleware` in `main.py`.
+
+Brotli è opzionale: se il pacchetto `brotli` non è installato si usa solo gzip.
+"""
+from __future__ import annotations
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Iterable, Optional
+
+import anyio.to_thread
+from fastapi import Request, Response
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli è opzionale
+    brotli = None
+
+MIN_COMPRESS_SIZE = 1000
+COMPRESSIBLE_TYPES = ("text/", "application/json", "application/javascript", "application/manifest+json", "image/svg+xml")
+
+
+def make_etag(*parts) -> str:
+    """ETag forte derivato dalle parti indicate (versione del dataset, parametri, ...)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()[:32]
+
+
+def http_date(timestamp: float) -> str:
+    return formatdate(timestamp, usegmt=True)
+
+
+def _accepted_encodings(accept_encoding: str) -> Dict[str, float]:
+    accepted = {}
+    for item in accept_encoding.split(","):
+        token, _, params = item.strip().partition(";")
+        if not token:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[token.strip().lower()] = quality
+    return accepted
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Sceglie brotli se disponibile e accettato, altrimenti gzip, altrimenti nessuna compressione."""
+    accepted = _accepted_encodings(accept_encoding or "")
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    return gzip.compress(body, compresslevel=6)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Confronta If-None-Match con l'ETag, ignorando il suffisso della codifica (-br, -gzip)."""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        candidate = candidate.strip('"')
+        for suffix in ("-br", "-gzip"):
+            if candidate.endswith(suffix):
+                candidate = candidate[:-len(suffix)]
+        if candidate == etag:
+            return True
+    return False
+
+
+def _not_modified_since(if_modified_since: Optional[str], last_modified: Optional[float]) -> bool:
+    if not if_modified_since or last_modified is None:
+        return False
+    try:
+        return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        return False
+
+
+class _EncodedBodyCache:
+    """Piccola cache LRU dei corpi compressi, indicizzata per (ETag, codifica)."""
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[tuple, bytes]" = OrderedDict()
+
+    def get(self, key: tuple, body: bytes, encoding: str) -> bytes:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        encoded = compress(body, encoding)
+        with self._lock:
+            self._entries[key] = encoded
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return encoded
+
+
+_encoded_bodies = _EncodedBodyCache()
+
+
+def not_modified(request: Request, etag: str, last_modified: Optional[float] = None) -> bool:
+    """True se il client ha già la versione `etag` (If-None-Match) o, in assenza, non è più vecchia (If-Modified-Since)."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        return etag_matches(if_none_match, etag)
+    return _not_modified_since(request.headers.get("if-modified-since"), last_modified)
+
+
+def _cache_headers(etag: str, last_modified: Optional[float]) -> Dict[str, str]:
+    headers = {
+        "ETag": f'"{etag}"',
+        # Il client può tenere la risposta ma deve sempre rivalidarla
+        "Cache-Control": "no-cache",
+        "Vary": "Accept-Encoding",
+    }
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def cached_response(
+    request: Request,
+    body: bytes,
+    etag: str,
+    media_type: str = "application/json",
+    last_modified: Optional[float] = None,
+    headers: Optional[Dict[str, str]] = None,
+) -> Response:
+    """Risposta con ETag, 304 se il client è aggiornato, corpo compresso secondo Accept-Encoding."""
+    response_headers = _cache_headers(etag, last_modified)
+    response_headers.update(headers or {})
+    if not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=response_headers)
+
+    encoding = None
+    if len(body) >= MIN_COMPRESS_SIZE:
+        encoding = choose_encoding(request.headers.get("accept-encoding", ""))
+    if encoding:
+        body = _encoded_bodies.get((etag, encoding), body, encoding)
+        response_headers["ETag"] = f'"{etag}-{encoding}"'
+        response_headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=media_type, headers=response_headers)
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _is_compressible(media_type: Optional[str]) -> bool:
+    return bool(media_type) and media_type.startswith(COMPRESSIBLE_TYPES)
+
+
+class CompressedStaticFiles(StaticFiles):
+    """StaticFiles che serve in brotli i file testuali quando il client lo accetta.
+
+    Con `public_files` vengono serviti solo i file elencati (percorsi relativi alla cartella) e la
+    pagina iniziale: il resto della cartella (dati, codice, cache) risponde 404.
+    """
+
+    def __init__(self, *args, public_files: Optional[Iterable[str]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.public_files = None if public_files is None else frozenset(public_files)
+
+    async def get_response(self, path: str, scope) -> Response:
+        if self.public_files is not None and path not in self.public_files and not (self.html and path in ("", ".")):
+            raise HTTPException(status_code=404)
+        response = await super().get_response(path, scope)
+        if brotli is None or not isinstance(response, FileResponse) or response.status_code != 200:
+            return response
+        if not _is_compressible(response.media_type) or response.stat_result is None:
+            return response
+        request_headers = Headers(scope=scope)
+        if choose_encoding(request_headers.get("accept-encoding", "")) != "br":
+            return response
+
+        stat = response.stat_result
+        etag = make_etag(response.path, stat.st_mtime_ns, stat.st_size)
+        headers = _cache_headers(etag, stat.st_mtime)
+        if etag_matches(request_headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        raw = await anyio.to_thread.run_sync(_read_file, response.path)
+        body = _encoded_bodies.get((etag, "br"), raw, "br")
+        headers["ETag"] = f'"{etag}-br"'
+        headers["Content-Encoding"] = "br"
+        return Response(content=body, media_type=response.media_type, headers=headers)
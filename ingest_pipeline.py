@@ -0,0 +1,184 @@
+"""Coda di lavori a stadi per la modalità demone di `attivita_giornaliere.py --watch`.
+
+Ogni nuovo export attraversa tre stadi, ognuno nel proprio thread:
+
+1. formattazione (`process_excel_file`), in parallelo su più processi con `format_workers` > 1;
+2. aggregazione: un'unica `aggregate_data()` per ogni raffica di file, avviata quando non ci sono
+   formattazioni in corso e non arrivano nuovi file da `debounce_seconds`;
+3. pubblicazione: commit dei dati aggregati e push; le aggregazioni completate durante un push
+   vengono unite nel commit successivo.
+
+Il push è fuori dal lock sui file: mentre git invia i dati, i file successivi (es. il recupero
+di una settimana di export) vengono già formattati e aggregati.
+"""
+from __future__ import annotations
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, List, Optional
+
+DEBOUNCE_SECONDS = 2.0
+
+
+class IngestPipeline:
+    """Formatta, aggrega e pubblica i file accodati con `submit()`.
+
+    `format_file(path)` viene eseguita in un processo separato se `format_workers` > 1 (deve essere
+    una funzione di modulo); `on_formatted(path)` è chiamata nel thread dello stadio dopo una
+    formattazione riuscita, `on_done(path)` sempre. Senza `commit` lo stadio di pubblicazione
+    non viene avviato.
+    """
+
+    def __init__(
+        self,
+        format_file: Callable[[str], object],
+        aggregate: Callable[[], object],
+        commit: Optional[Callable[[], bool]] = None,
+        push: Optional[Callable[[], object]] = None,
+        format_workers: int = 1,
+        debounce_seconds: float = DEBOUNCE_SECONDS,
+        on_formatted: Optional[Callable[[str], object]] = None,
+        on_done: Optional[Callable[[str], object]] = None,
+    ):
+        self.format_file = format_file
+        self.aggregate = aggregate
+        self.commit = commit
+        self.push = push
+        self.format_workers = max(format_workers, 1)
+        self.debounce_seconds = debounce_seconds
+        self.on_formatted = on_formatted
+        self.on_done = on_done
+        self._jobs: queue.Queue = queue.Queue()
+        self._cond = threading.Condition()
+        # File accodati o in formattazione
+        self._pending_formats = 0
+        self._formatting = 0
+        # Istante dell'ultima formattazione non ancora aggregata (None: niente da aggregare)
+        self._dirty_since: Optional[float] = None
+        self._aggregating = False
+        self._publish_pending = False
+        self._stopping = False
+        # Aggregazione e commit leggono/scrivono gli stessi file: mai insieme
+        self._data_lock = threading.Lock()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._threads: List[threading.Thread] = []
+
+    def __enter__(self) -> "IngestPipeline":
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def start(self) -> None:
+        if self.format_workers > 1:
+            self._executor = ProcessPoolExecutor(max_workers=self.format_workers)
+        targets = [self._format_loop] * self.format_workers + [self._aggregate_loop]
+        if self.commit is not None:
+            targets.append(self._publish_loop)
+        for target in targets:
+            thread = threading.Thread(target=target, name=f"ingest-{target.__name__.strip('_')}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self) -> None:
+        """Completa i lavori già accodati (formattazione, aggregazione e pubblicazione) e ferma i thread."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        for _ in range(self.format_workers):
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def submit(self, path: str) -> None:
+        """Accoda un file da formattare."""
+        with self._cond:
+            self._pending_formats += 1
+        self._jobs.put(path)
+
+    def _idle(self) -> bool:
+        return not self._pending_formats and self._dirty_since is None and not self._aggregating
+
+    def _format_loop(self) -> None:
+        while True:
+            path = self._jobs.get()
+            if path is None:
+                return
+            with self._cond:
+                # I file non vengono riscritti mentre l'aggregazione li sta leggendo
+                while self._aggregating:
+                    self._cond.wait()
+                self._formatting += 1
+            try:
+                if self._executor is not None:
+                    self._executor.submit(self.format_file, path).result()
+                else:
+                    self.format_file(path)
+                if self.on_formatted is not None:
+                    self.on_formatted(path)
+            except Exception as e:
+                print(f"Errore durante la formattazione di {path}: {e}")
+                traceback.print_exc()
+            finally:
+                if self.on_done is not None:
+                    self.on_done(path)
+                with self._cond:
+                    self._formatting -= 1
+                    self._pending_formats -= 1
+                    self._dirty_since = time.monotonic()
+                    self._cond.notify_all()
+
+    def _aggregate_loop(self) -> None:
+        while True:
+            with self._cond:
+                while True:
+                    if self._dirty_since is not None and not self._pending_formats:
+                        wait = self._dirty_since + self.debounce_seconds - time.monotonic()
+                        if wait <= 0 or self._stopping:
+                            break
+                        self._cond.wait(wait)
+                    elif self._stopping and not self._pending_formats:
+                        return
+                    else:
+                        self._cond.wait()
+                self._dirty_since = None
+                self._aggregating = True
+            success = False
+            try:
+                with self._data_lock:
+                    print("Avvio aggregazione dati...")
+                    self.aggregate()
+                success = True
+            except Exception as e:
+                print(f"Errore durante l'aggregazione: {e}")
+                traceback.print_exc()
+            finally:
+                with self._cond:
+                    self._aggregating = False
+                    self._publish_pending = self._publish_pending or success
+                    self._cond.notify_all()
+
+    def _publish_loop(self) -> None:
+        while True:
+            with self._cond:
+                # Si pubblica solo a coda ferma, così una raffica di file produce un unico commit
+                while not (self._publish_pending and self._idle()):
+                    if self._stopping and not self._publish_pending and self._idle():
+                        return
+                    self._cond.wait()
+                self._publish_pending = False
+            try:
+                with self._data_lock:
+                    committed = self.commit()
+                if committed and self.push is not None:
+                    self.push()
+            except Exception as e:
+                print(f"Errore durante la pubblicazione: {e}")
+                traceback.print_exc()
@@ -1,12 +1,37 @@
 
 import os
-import pandas as pd
-from fastapi import FastAPI, APIRouter
-from fastapi.staticfiles import StaticFiles
+import datetime
+import hmac
+import json
+import tempfile
+from contextlib import closing
+from typing import List, Optional
+import pyarrow as pa
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Request
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from columnar_store import (
+    build_filter,
+    data_columns,
+    iter_record_batches,
+    open_columnar_dataset,
+)
+from data_cache import serialize_records
+from data_ingest import INGEST_DIRNAME, MAX_BUNDLE_BYTES, CurrentDataFiles, IngestError, ingest_bundle
+from data_query import QueryError, filter_options, iter_dataset, query_dataset
+from data_store import open_read_only, records_json
+from data_stream import json_array_chunks, ndjson_chunks
+from data_sync import changes_since
+from http_cache import CompressedStaticFiles, cached_response, make_etag, not_modified
+from rollup import GRANULARITIES, period_totals
+from search_index import search
 # import aggregator # No longer needed if not calling aggregate_data()
 
 # --- App Principale ---
 app = FastAPI()
+# Compressione gzip per le risposte che non sono già compresse (es. stream, file statici)
+app.add_middleware(GZipMiddleware, minimum_size=1000)
 
 # --- Aggregazione Dati all'Avvio ---
 # Eseguiamo l'aggregazione dei dati all'avvio del server.
@@ -17,27 +42,245 @@ app = FastAPI()
 # Definiamo le rotte per i dati in un router separato per pulizia.
 api_router = APIRouter()
 
+# Dati interrogati dall'archivio SQLite con connessioni in sola lettura riutilizzate;
+# cache dei file piccoli, riletti solo quando cambiano su disco (il riepilogo è un file Arrow mappato, condiviso dai worker).
+# La cartella dei dati è quella della versione ricevuta da /api/ingest, se presente (vedi data_ingest.py).
+# I file vengono aperti alla prima richiesta, non all'import: con `gunicorn --preload` il modulo è importato prima del fork.
+base_dir = os.path.dirname(os.path.abspath(__file__))
+data_files = CurrentDataFiles(base_dir)
+STREAM_BATCH_SIZE = 1000
+# Unici file della cartella del progetto serviti come statici (pagina, PWA, immagini): dati, codice,
+# versioni ricevute da /api/ingest e cache dell'aggregatore non sono raggiungibili
+PUBLIC_FILES = ("index.html", "manifest.json", "service-worker.js", "logo.png", "operatrice.png")
+SEARCH_PAGE_SIZE = 50
+
+@app.middleware("http")
+async def add_data_version(request: Request, call_next):
+    # Versione del dataset su ogni risposta API: il service worker la usa per invalidare la sua cache
+    response = await call_next(request)
+    if request.url.path.startswith("/api/"):
+        response.headers["X-Data-Version"] = data_files.get().store.state().etag
+    return response
+
+def _query_etag(snapshot, request: Request, *extra) -> str:
+    # La risposta dipende solo dalla versione del dataset e dai parametri della query
+    return make_etag(snapshot.etag, sorted(request.query_params.multi_items()), *extra)
+
 @api_router.get("/data")
-def get_data():
+def get_data(
+    request: Request,
+    operator: Optional[List[str]] = Query(None),
+    category: Optional[List[str]] = Query(None),
+    start_date: Optional[datetime.date] = None,
+    end_date: Optional[datetime.date] = None,
+    columns: Optional[List[str]] = Query(None),
+    sort: Optional[List[str]] = Query(None),
+    limit: Optional[int] = None,
+    offset: int = 0,
+):
+    files = data_files.get()
+    state = files.store.state()
+    filters = (operator, category, start_date, end_date, columns, sort)
+    # Senza parametri la risposta è l'intero dataset: l'ETag è la versione dell'archivio
+    full = not any(filters) and limit is None and not offset
+    etag = state.etag if full else _query_etag(state, request)
+    if not_modified(request, etag, state.last_modified):
+        return cached_response(request, b"", etag, last_modified=state.last_modified)
+
+    if full:
+        # Corpo serializzato una volta per versione e condiviso dalle richieste del worker
+        body, total = files.store.dataset_json(state)
+        return cached_response(request, body, etag, last_modified=state.last_modified, headers={"X-Total-Count": str(total)})
+    try:
+        with files.store.connection() as conn:
+            page, total = query_dataset(
+                conn,
+                state.columns,
+                operators=operator,
+                categories=category,
+                start_date=start_date,
+                end_date=end_date,
+                columns=columns,
+                sort=sort,
+                limit=limit,
+                offset=offset,
+            )
+    except QueryError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return cached_response(
+        request,
+        records_json(page),
+        etag,
+        last_modified=state.last_modified,
+        headers={"X-Total-Count": str(total)},
+    )
+
+def _store_batches(store, available, operators, categories, start_date, end_date, columns):
+    # La connessione resta presa dal pool fino alla fine della risposta (o alla disconnessione del client)
+    with store.connection() as conn:
+        for rows in iter_dataset(
+            conn,
+            available,
+            operators=operators,
+            categories=categories,
+            start_date=start_date,
+            end_date=end_date,
+            columns=columns,
+            batch_size=STREAM_BATCH_SIZE,
+            missing=None,
+        ):
+            yield pa.RecordBatch.from_pylist(rows)
+
+@api_router.get("/data/stream")
+def stream_data(
+    format: str = "ndjson",
+    operator: Optional[List[str]] = Query(None),
+    category: Optional[List[str]] = Query(None),
+    start_date: Optional[datetime.date] = None,
+    end_date: Optional[datetime.date] = None,
+    columns: Optional[List[str]] = Query(None),
+):
+    """Restituisce le righe in streaming (NDJSON o array JSON) leggendo a blocchi l'archivio Arrow (o SQLite)."""
+    if format not in ("ndjson", "json"):
+        raise HTTPException(status_code=400, detail="format deve essere 'ndjson' o 'json'")
+
+    files = data_files.get()
+    use_columnar = os.path.isdir(files.columnar_path)
+    if use_columnar:
+        available = data_columns(open_columnar_dataset(files.columnar_path))
+    else:
+        available = files.store.state().columns
+    unknown = [c for c in columns or [] if c not in available]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Colonne sconosciute: {', '.join(unknown)}")
+    if use_columnar:
+        batches = iter_record_batches(
+            files.columnar_path,
+            columns=columns,
+            filter=build_filter(operator, category, start_date, end_date),
+            batch_size=STREAM_BATCH_SIZE,
+        )
+    else:
+        # Archivio colonnare non generato (export disattivato): leggiamo l'archivio SQLite a blocchi
+        batches = _store_batches(files.store, available, operator, category, start_date, end_date, columns)
+
+    if format == "ndjson":
+        return StreamingResponse(ndjson_chunks(batches), media_type="application/x-ndjson")
+    return StreamingResponse(json_array_chunks(batches), media_type="application/json")
+
+@api_router.get("/data/changes")
+def get_data_changes(request: Request, since: int = 0):
+    """Righe aggiunte e lotti rimossi dopo la versione `since` (sincronizzazione incrementale della PWA)."""
+    # Prima lo stato di versione, poi l'archivio: l'aggregatore aggiorna l'archivio per primo,
+    # quindi le righe lette non sono mai più vecchie della versione restituita.
+    files = data_files.get()
+    sync_state = files.sync_state.get()
+    state = files.store.state()
+    etag = _query_etag(state, request, sync_state.etag)
+    if not_modified(request, etag, state.last_modified):
+        return cached_response(request, b"", etag, last_modified=state.last_modified)
+    with files.store.connection() as conn:
+        body = changes_since(conn, state.columns, sync_state.data, since)
+    return cached_response(request, body, etag, last_modified=state.last_modified)
+
+@api_router.get("/data/filters")
+def get_data_filters(request: Request):
+    files = data_files.get()
+    state = files.store.state()
+    etag = _query_etag(state, request, "filters")
+    if not_modified(request, etag, state.last_modified):
+        return cached_response(request, b"", etag, last_modified=state.last_modified)
+    with files.store.connection() as conn:
+        body = json.dumps(filter_options(conn, state.columns), ensure_ascii=False).encode("utf-8")
+    return cached_response(request, body, etag, last_modified=state.last_modified)
+
+@api_router.get("/search")
+def search_notes(
+    request: Request,
+    q: str = "",
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=500),
+    offset: int = Query(0, ge=0),
+):
+    """Ricerca testuale in "Note interne 1" e "Ragione sociale" (indice FTS5 aggiornato da aggregator.py)."""
     try:
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-        csv_path = os.path.join(base_dir, "aggregated_data.csv")
-        
-        df = pd.read_csv(csv_path)
-        if df.empty:
-            return []
-        df = df.fillna('')
-        return df.to_dict(orient="records")
+        search_path = data_files.get().search_path
+        st = os.stat(search_path)
     except FileNotFoundError:
-        return []
+        raise HTTPException(status_code=503, detail="Indice di ricerca non ancora disponibile")
+    # L'indice cambia solo quando l'aggregatore lo riscrive
+    etag = make_etag(st.st_ino, st.st_size, st.st_mtime_ns, sorted(request.query_params.multi_items()))
+    if not_modified(request, etag, st.st_mtime):
+        return cached_response(request, b"", etag, last_modified=st.st_mtime)
+    with closing(open_read_only(search_path)) as conn:
+        results, total = search(conn, q, limit=limit, offset=offset)
+    body = json.dumps(results, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return cached_response(request, body, etag, last_modified=st.st_mtime, headers={"X-Total-Count": str(total)})
+
+@api_router.get("/stats/{granularity}")
+def get_stats(
+    request: Request,
+    granularity: str,
+    operator: Optional[List[str]] = Query(None),
+    category: Optional[List[str]] = Query(None),
+    start_date: Optional[datetime.date] = None,
+    end_date: Optional[datetime.date] = None,
+):
+    """Totali per giorno (daily), settimana (weekly) o mese (monthly), letti dal cubo precalcolato."""
+    if granularity not in GRANULARITIES:
+        raise HTTPException(status_code=404, detail=f"Granularità non valida: {granularity}")
+    snapshot = data_files.get().rollup.get()
+    etag = _query_etag(snapshot, request, granularity)
+    if not_modified(request, etag, snapshot.last_modified):
+        return cached_response(request, b"", etag, last_modified=snapshot.last_modified)
+    totals = period_totals(
+        snapshot.df,
+        snapshot.dates,
+        granularity,
+        operators=operator,
+        categories=category,
+        start_date=start_date,
+        end_date=end_date,
+    )
+    return cached_response(request, serialize_records(totals), etag, last_modified=snapshot.last_modified)
+
+@api_router.post("/ingest")
+async def ingest_data(request: Request):
+    """
+    Riceve un pacchetto zip dei dati aggregati (inviato da `aggregator.py --publish-url`) e lo rende
+    la versione servita da tutti i worker, senza redeploy. Richiede `Authorization: Bearer <INGEST_TOKEN>`.
+    """
+    token = os.environ.get("INGEST_TOKEN")
+    if not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    authorization = request.headers.get("authorization", "")
+    if not hmac.compare_digest(authorization.encode("utf-8"), f"Bearer {token}".encode("utf-8")):
+        raise HTTPException(status_code=401, detail="Token non valido", headers={"WWW-Authenticate": "Bearer"})
+
+    ingest_dir = os.path.join(base_dir, INGEST_DIRNAME)
+    os.makedirs(ingest_dir, exist_ok=True)
+    fd, bundle_path = tempfile.mkstemp(prefix=".upload-", suffix=".zip", dir=ingest_dir)
+    try:
+        size = 0
+        with os.fdopen(fd, "wb") as f:
+            async for chunk in request.stream():
+                size += len(chunk)
+                if size > MAX_BUNDLE_BYTES:
+                    raise HTTPException(status_code=413, detail="Pacchetto troppo grande")
+                f.write(chunk)
+        version, changed = await run_in_threadpool(ingest_bundle, bundle_path, base_dir)
+    except IngestError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        os.remove(bundle_path)
+    return {"version": version, "changed": changed}
 
 # Includiamo il router dell'API nell'app principale.
 app.include_router(api_router, prefix="/api")
 
 # --- Montaggio File Statici ---
-# Montiamo la directory corrente per servire i file statici (index.html, etc.).
+# Montiamo la directory corrente per servire i file statici (solo quelli di `PUBLIC_FILES`).
 # Questo deve essere l'ultimo montaggio per non interferire con le rotte API.
-app.mount("/", StaticFiles(directory=".", html=True), name="static")
+app.mount("/", CompressedStaticFiles(directory=".", html=True, public_files=PUBLIC_FILES), name="static")
 
 # --- Avvio Server (per sviluppo locale) ---
 if __name__ == "__main__":
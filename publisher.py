@@ -0,0 +1,315 @@
+"""Pubblicazione dei dati aggregati: commit e push su git (redeploy su Render), invio a `/api/ingest`
+del server (aggiornamento a caldo) oppure copia in una cartella.
+
+`Publisher.commit()` calcola l'hash dei file pubblicati e non fa nulla se coincide con quello
+dell'ultima pubblicazione. `Publisher.push()` restituisce subito: il push gira in un thread, con
+tentativi ripetuti e attesa crescente, e le richieste arrivate durante un push (più commit)
+vengono inviate insieme al push successivo.
+"""
+from __future__ import annotations
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import threading
+import urllib.error
+import urllib.request
+import zipfile
+from typing import Optional, Sequence
+
+from file_utils import file_sha256
+
+PUBLISH_STATE_FILENAME = "published.json"
+PUSH_RETRIES = 5
+PUSH_BACKOFF_SECONDS = 2.0
+MAX_BACKOFF_SECONDS = 60.0
+
+
+class PublishError(Exception):
+    """Errore di un comando di pubblicazione (commit o push)."""
+
+
+def run_git_command(command, cwd, check_exit_code=True, input=None):
+    """Helper function to run git commands."""
+    try:
+        result = subprocess.run(command, cwd=cwd, check=check_exit_code, capture_output=True, text=True, input=input)
+        print(f"Git command output: {result.stdout.strip()}")
+        return result.stdout, result.returncode
+    except subprocess.CalledProcessError as e:
+        print(f"Error running Git command: {e}")
+        print(f"Stdout: {e.stdout.strip()}")
+        print(f"Stderr: {e.stderr.strip()}")
+        return None, e.returncode
+
+
+def dataset_hash(base_dir: str, paths: Sequence[str], chunk_size: int = 1024 * 1024) -> str:
+    """Hash SHA-256 di nomi e contenuto dei file in `paths` (relativi a `base_dir`, cartelle comprese).
+
+    Anche un file mancante entra nell'hash: la rimozione di un export è una modifica da pubblicare.
+    """
+    digest = hashlib.sha256()
+    for rel_path in paths:
+        path = os.path.join(base_dir, rel_path)
+        if os.path.isdir(path):
+            files = sorted(
+                os.path.join(root, name)
+                for root, _, names in os.walk(path)
+                for name in names
+            )
+        elif os.path.exists(path):
+            files = [path]
+        else:
+            digest.update(f"missing:{rel_path}\0".encode("utf-8"))
+            continue
+        for file in files:
+            digest.update(f"file:{os.path.relpath(file, base_dir)}\0".encode("utf-8"))
+            file_sha256(file, digest, chunk_size)
+    return digest.hexdigest()
+
+
+class GitTarget:
+    """Commit nel repository di `base_dir` e push sul remoto (il push su main avvia il redeploy su Render)."""
+
+    def __init__(self, base_dir: str, remote: str = "origin", branch: str = "main"):
+        self.base_dir = base_dir
+        self.remote = remote
+        self.branch = branch
+
+    @property
+    def name(self) -> str:
+        return f"git:{self.remote}/{self.branch}"
+
+    def commit(self, paths: Sequence[str], message: str) -> bool:
+        """Registra in un commit i file indicati; False se git non trova differenze."""
+        present = [p for p in paths if os.path.exists(os.path.join(self.base_dir, p))]
+        missing = [p for p in paths if p not in present]
+        if present:
+            _, returncode = run_git_command(["git", "add", "-A", "--", *present], self.base_dir)
+            if returncode != 0:
+                raise PublishError(f"git add non riuscito (codice {returncode})")
+        if missing:
+            # Registra la rimozione dei file che non vengono più generati (es. il CSV con --no-csv)
+            _, returncode = run_git_command(["git", "rm", "-r", "-q", "--cached", "--ignore-unmatch", "--", *missing], self.base_dir, check_exit_code=False)
+            if returncode != 0:
+                raise PublishError(f"git rm non riuscito (codice {returncode})")
+        # --quiet: 0 senza differenze, 1 con differenze, altri codici in caso di errore
+        _, returncode = run_git_command(["git", "diff", "--cached", "--quiet", "--", *paths], self.base_dir, check_exit_code=False)
+        if returncode == 0:
+            return False
+        if returncode != 1:
+            raise PublishError(f"git diff non riuscito (codice {returncode})")
+        _, returncode = run_git_command(["git", "commit", "-F", "-"], self.base_dir, input=message)
+        if returncode != 0:
+            raise PublishError(f"git commit non riuscito (codice {returncode})")
+        return True
+
+    def push(self) -> None:
+        _, returncode = run_git_command(["git", "push", self.remote, self.branch], self.base_dir)
+        if returncode != 0:
+            raise PublishError(f"git push non riuscito (codice {returncode})")
+        print("Git push completed.")
+
+
+class DirectoryTarget:
+    """Copia i file pubblicati in `directory` (es. per provare la pubblicazione senza un remoto).
+
+    Ogni file o cartella viene scritto accanto alla destinazione e poi sostituito con `os.replace`,
+    quindi chi legge la cartella non vede mai un file copiato a metà.
+    """
+
+    def __init__(self, directory: str, base_dir: str):
+        self.directory = os.path.abspath(directory)
+        self.base_dir = base_dir
+
+    @property
+    def name(self) -> str:
+        return f"dir:{self.directory}"
+
+    def commit(self, paths: Sequence[str], message: str) -> bool:
+        os.makedirs(self.directory, exist_ok=True)
+        for rel_path in paths:
+            src = os.path.join(self.base_dir, rel_path)
+            dst = os.path.join(self.directory, rel_path)
+            if os.path.isdir(src):
+                tmp, old = dst + ".tmp", dst + ".old"
+                shutil.rmtree(tmp, ignore_errors=True)
+                shutil.copytree(src, tmp)
+                shutil.rmtree(old, ignore_errors=True)
+                if os.path.exists(dst):
+                    os.replace(dst, old)
+                os.replace(tmp, dst)
+                shutil.rmtree(old, ignore_errors=True)
+            elif os.path.exists(src):
+                tmp = dst + ".tmp"
+                shutil.copyfile(src, tmp)
+                os.replace(tmp, dst)
+            elif os.path.isdir(dst):
+                shutil.rmtree(dst)
+            elif os.path.exists(dst):
+                os.remove(dst)
+        print(f"Dati pubblicati in {self.directory}: {message}")
+        return True
+
+    def push(self) -> None:
+        pass
+
+
+class HttpTarget:
+    """Invia i file pubblicati come pacchetto zip a `/api/ingest` del server, che li rende subito
+    disponibili a tutti i worker senza redeploy (vedi `data_ingest.py`).
+
+    `commit()` prepara il pacchetto in `bundle_path`, `push()` lo invia con il token `INGEST_TOKEN`.
+    """
+
+    def __init__(self, url: str, token: str, base_dir: str, bundle_path: str, timeout: float = 120.0):
+        self.url = url
+        self.token = token
+        self.base_dir = base_dir
+        self.bundle_path = bundle_path
+        self.timeout = timeout
+
+    @property
+    def name(self) -> str:
+        return f"http:{self.url}"
+
+    def commit(self, paths: Sequence[str], message: str) -> bool:
+        os.makedirs(os.path.dirname(self.bundle_path), exist_ok=True)
+        tmp_path = self.bundle_path + ".tmp"
+        with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+            for rel_path in paths:
+                path = os.path.join(self.base_dir, rel_path)
+                if os.path.isdir(path):
+                    for root, _, names in os.walk(path):
+                        for name in sorted(names):
+                            file = os.path.join(root, name)
+                            zf.write(file, os.path.relpath(file, self.base_dir).replace(os.sep, "/"))
+                elif os.path.exists(path):
+                    zf.write(path, rel_path)
+        os.replace(tmp_path, self.bundle_path)
+        print(f"Pacchetto dati pronto per {self.url}: {message}")
+        return True
+
+    def push(self) -> None:
+        # Letto in memoria: `commit()` può sostituire il file mentre l'invio è in corso
+        with open(self.bundle_path, "rb") as f:
+            body = f.read()
+        request = urllib.request.Request(
+            self.url,
+            data=body,
+            method="POST",
+            headers={"Authorization": f"Bearer {self.token}", "Content-Type": "application/zip"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                result = json.load(response)
+        except urllib.error.HTTPError as e:
+            raise PublishError(f"Invio a {self.url} non riuscito: HTTP {e.code} {e.read().decode('utf-8', 'replace')}")
+        except (urllib.error.URLError, OSError) as e:
+            raise PublishError(f"Invio a {self.url} non riuscito: {e}")
+        print(f"Dati inviati a {self.url}: versione {result.get('version')}")
+
+
+class Publisher:
+    """Pubblica i file di `base_dir` su `target` (GitTarget, DirectoryTarget o HttpTarget).
+
+    L'hash dell'ultima pubblicazione e dell'ultimo push riuscito è salvato in `state_path`, così anche
+    un'esecuzione successiva dello script salta i dati invariati e ritenta i push non riusciti.
+    """
+
+    def __init__(
+        self,
+        target,
+        base_dir: str,
+        state_path: str,
+        retries: int = PUSH_RETRIES,
+        backoff_seconds: float = PUSH_BACKOFF_SECONDS,
+    ):
+        self.target = target
+        self.base_dir = base_dir
+        self.state_path = state_path
+        self.retries = retries
+        self.backoff_seconds = backoff_seconds
+        self._lock = threading.Lock()
+        self._push_requested = False
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _load_state(self) -> dict:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        return state.get(self.target.name, {})
+
+    def _save_state(self, **values) -> None:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            state = {}
+        state.setdefault(self.target.name, {}).update(values)
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def commit(self, paths: Sequence[str]) -> bool:
+        """Registra i file se sono cambiati dall'ultima pubblicazione; True se c'è qualcosa da inviare con `push()`."""
+        digest = dataset_hash(self.base_dir, paths)
+        with self._lock:
+            state = self._load_state()
+            if digest == state.get("hash"):
+                print("Dati invariati dall'ultima pubblicazione: nessun commit.")
+                return state.get("pushed") != digest
+            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            self.target.commit(paths, f"Automated data aggregation update - {timestamp}")
+            self._save_state(hash=digest, committed_at=timestamp)
+            return True
+
+    def push(self) -> None:
+        """Avvia il push in background e restituisce subito; le richieste ravvicinate producono un solo push."""
+        with self._lock:
+            self._push_requested = True
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._push_loop, name="publisher-push", daemon=True)
+                self._thread.start()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Attende la fine dei push richiesti; False se il tempo scade prima."""
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+            return not thread.is_alive()
+        return True
+
+    def close(self) -> None:
+        """Interrompe le attese tra un tentativo e l'altro e attende il thread di push."""
+        self._stop.set()
+        self.flush()
+
+    def _push_loop(self) -> None:
+        while True:
+            with self._lock:
+                if not self._push_requested:
+                    self._thread = None
+                    return
+                self._push_requested = False
+                digest = self._load_state().get("hash")
+            for attempt in range(self.retries + 1):
+                try:
+                    self.target.push()
+                except Exception as e:
+                    if attempt == self.retries or self._stop.is_set():
+                        print(f"Push non riuscito dopo {attempt + 1} tentativi: {e}. Verrà ritentato alla prossima pubblicazione.")
+                        break
+                    delay = min(self.backoff_seconds * 2 ** attempt, MAX_BACKOFF_SECONDS)
+                    print(f"Push non riuscito ({e}), nuovo tentativo tra {delay:g}s...")
+                    self._stop.wait(delay)
+                else:
+                    with self._lock:
+                        self._save_state(pushed=digest)
+                    break
@@ -0,0 +1,229 @@
+"""Formattazione dei fogli report generati da `attivita_giornaliere.process_excel_file`.
+
+Layout di ogni foglio:
+    riga 1: logo, riga 2: titolo (unito su tutte le colonne), riga 3: intestazioni, dalla riga 4: dati.
+
+I fogli sono scritti in streaming da `ReportWorkbookWriter` (workbook openpyxl in sola scrittura).
+Gli oggetti di stile sono creati una sola volta e condivisi da tutte le celle di tutti i fogli.
+Le larghezze delle colonne sono stimate dal DataFrame prima di scrivere le righe.
+"""
+from __future__ import annotations
+import datetime
+from io import BytesIO
+from typing import Iterator, List, Optional, Tuple
+from zipfile import ZIP_DEFLATED, ZipFile
+
+import pandas as pd
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.drawing.image import Image as OpenpyxlImage
+from openpyxl.styles import Alignment, Border, Font, PatternFill, Side
+from openpyxl.utils import get_column_letter
+from openpyxl.writer.excel import ExcelWriter
+from openpyxl.worksheet.worksheet import Worksheet
+from PIL import Image as PILImage
+
+LOGO_ROW = 1
+TITLE_ROW = 2
+HEADER_ROW = 3
+FIRST_DATA_ROW = 4
+
+NOTE_INTERNE_COLUMN_NAME = "Note interne 1"
+NOTE_INTERNE_WIDTH = 80
+MAX_COLUMN_WIDTH = 30
+LOGO_SIZE = (252, 49)  # Larghezza e altezza del logo nel foglio, in pixel
+
+# Formati di DataFrame.to_excel
+DATE_FORMAT = "YYYY-MM-DD"
+DATETIME_FORMAT = "YYYY-MM-DD HH:MM:SS"
+
+# --- Stili condivisi ---
+_THIN_SIDE = Side(style='thin')
+THIN_BORDER = Border(left=_THIN_SIDE, right=_THIN_SIDE, top=_THIN_SIDE, bottom=_THIN_SIDE)
+HEADER_FILL = PatternFill(start_color="D9D9D9", end_color="D9D9D9", fill_type="solid")
+HEADER_FONT = Font(bold=True, size=13)
+DEFAULT_FONT = Font(size=14)
+TITLE_FONT = Font(bold=True, size=28)
+HEADER_ALIGNMENT = Alignment(wrapText=True, horizontal='center', vertical='center')
+DATA_ALIGNMENT = Alignment(wrapText=True)
+TITLE_ALIGNMENT = Alignment(horizontal='center', vertical='center')
+
+
+def apply_page_setup(worksheet) -> None:
+    """A4 verticale, adattato alla larghezza della pagina."""
+    worksheet.page_setup.paperSize = Worksheet.PAPERSIZE_A4
+    worksheet.page_setup.fitToPage = True
+    worksheet.page_setup.fitToWidth = 1
+    worksheet.page_setup.fitToHeight = 0
+    worksheet.print_options.print_grid_lines = True
+    worksheet.print_options.print_headings = True
+    worksheet.page_setup.orientation = Worksheet.ORIENTATION_PORTRAIT
+    worksheet.page_setup.horizontalCentered = True
+    worksheet.page_setup.verticalCentered = True
+
+
+def _text_lengths(values: pd.Series) -> pd.Series:
+    """Lunghezza del testo mostrato in Excel per i valori non vuoti della colonna."""
+    values = values[values.notna()]
+    # Come `if cell.value:` — 0, stringhe vuote e False non contano
+    values = values[values.astype(bool)]
+    # astype(object) prima di astype(str) così date e orari hanno la stessa forma di str(cell.value)
+    return values.astype(object).astype(str).str.len()
+
+
+def column_widths(df: pd.DataFrame) -> List[float]:
+    """Larghezza di ogni colonna: testo più lungo tra intestazione e dati + 4, al massimo 30.
+
+    La colonna delle note interne ha sempre larghezza fissa.
+    """
+    widths = []
+    for position, name in enumerate(df.columns):
+        if name == NOTE_INTERNE_COLUMN_NAME:
+            widths.append(NOTE_INTERNE_WIDTH)
+            continue
+        max_length = len(str(name)) if name else 0
+        lengths = _text_lengths(df.iloc[:, position])
+        if not lengths.empty:
+            max_length = max(max_length, int(lengths.max()))
+        widths.append(min(max_length + 4, MAX_COLUMN_WIDTH))
+    return widths
+
+
+def _styled_cell(worksheet, value, font: Font, fill: Optional[PatternFill], alignment: Alignment, border: Optional[Border] = THIN_BORDER) -> WriteOnlyCell:
+    cell = WriteOnlyCell(worksheet, value=value)
+    if border is not None:
+        cell.border = border
+    cell.font = font
+    if fill is not None:
+        cell.fill = fill
+    cell.alignment = alignment
+    return cell
+
+
+def _number_format(value) -> Optional[str]:
+    """Stesso formato usato da `DataFrame.to_excel` per date e orari."""
+    if isinstance(value, datetime.datetime):
+        return DATETIME_FORMAT
+    if isinstance(value, datetime.date):
+        return DATE_FORMAT
+    return None
+
+
+def _data_rows(df: pd.DataFrame) -> Iterator[tuple]:
+    """Righe di `df` con valori Python e None al posto dei valori mancanti."""
+    values = df.astype(object)
+    values = values.where(df.notna().to_numpy(), None)
+    return values.itertuples(index=False, name=None)
+
+
+class SharedImage(OpenpyxlImage):
+    """Immagine già decodificata che può essere inserita in più fogli e viene salvata una sola volta.
+
+    openpyxl assegna un nuovo numero (e quindi un nuovo file `xl/media/imageN`) a ogni inserimento:
+    qui il numero resta quello assegnato al primo foglio, così tutti i disegni puntano alla stessa parte.
+    Usa attributi interni di openpyxl (`_id`, `ExcelWriter._write_images`): la versione è fissata in requirements.txt.
+    """
+
+    def __init__(self, data: bytes):
+        super().__init__(BytesIO(data))
+        self._bytes = data
+        self._shared_id = None
+
+    @property
+    def _id(self):
+        return self._shared_id
+
+    @_id.setter
+    def _id(self, value):
+        if self._shared_id is None:
+            self._shared_id = value
+
+    def _data(self) -> bytes:
+        return self._bytes
+
+
+class _SharedMediaExcelWriter(ExcelWriter):
+    """Scrive una sola volta i file multimediali usati da più fogli (vedi `SharedImage`)."""
+
+    def _write_images(self):
+        written = set()
+        for img in self._images:
+            if img.path not in written:
+                written.add(img.path)
+                self._archive.writestr(img.path[1:], img._data())
+
+
+def load_logo(logo_path: str, size: Tuple[int, int] = LOGO_SIZE) -> SharedImage:
+    """Legge il logo una sola volta e lo ridimensiona a `size` (pixel) se necessario."""
+    with open(logo_path, "rb") as f:
+        data = f.read()
+    with PILImage.open(BytesIO(data)) as image:
+        if image.size != tuple(size):
+            resized = BytesIO()
+            image.resize(size, PILImage.LANCZOS).save(resized, format="PNG")
+            data = resized.getvalue()
+    return SharedImage(data)
+
+
+class ReportWorkbookWriter:
+    """Scrive i fogli report in un workbook openpyxl in sola scrittura.
+
+    Ogni foglio è scritto riga per riga nell'ordine finale (logo, titolo, intestazioni, dati)
+    e le righe vengono scaricate su file temporanei man mano, quindi la memoria usata non cresce
+    con il numero di fogli. Il file viene salvato all'uscita dal blocco `with`, solo se non ci
+    sono stati errori.
+
+    Esempio:
+        with ReportWorkbookWriter(path, logo_path=LOGO_PATH) as writer:
+            writer.write_sheet("Rachele_Contatto Cliente", df, "Rachele - Contatto Cliente")
+    """
+
+    def __init__(self, path: str, logo_path: Optional[str] = None):
+        """Il logo viene letto e ridimensionato una sola volta e condiviso da tutti i fogli."""
+        self.path = path
+        self.workbook = Workbook(write_only=True)
+        self.logo = None
+        if logo_path:
+            try:
+                self.logo = load_logo(logo_path)
+            except Exception as e:
+                print(f"Errore nel caricamento del logo: {e}")
+
+    def write_sheet(self, sheet_name: str, df: pd.DataFrame, title: str) -> None:
+        worksheet = self.workbook.create_sheet(sheet_name)
+        apply_page_setup(worksheet)
+        # Le larghezze delle colonne vanno impostate prima di scrivere le righe
+        for col_idx, width in enumerate(column_widths(df), 1):
+            worksheet.column_dimensions[get_column_letter(col_idx)].width = width
+
+        if self.logo is not None:
+            worksheet.add_image(self.logo, f'A{LOGO_ROW}')
+        worksheet.merged_cells.add(f"A{TITLE_ROW}:{get_column_letter(max(df.shape[1], 1))}{TITLE_ROW}")
+
+        worksheet.append([])  # Riga del logo
+        worksheet.append([_styled_cell(worksheet, title, TITLE_FONT, None, TITLE_ALIGNMENT, border=None)])
+        worksheet.append([_styled_cell(worksheet, name, HEADER_FONT, HEADER_FILL, HEADER_ALIGNMENT) for name in df.columns])
+        for row in _data_rows(df):
+            cells = []
+            for value in row:
+                cell = _styled_cell(worksheet, value, DEFAULT_FONT, None, DATA_ALIGNMENT)
+                number_format = _number_format(value)
+                if number_format:
+                    cell.number_format = number_format
+                cells.append(cell)
+            worksheet.append(cells)
+
+    def save(self) -> None:
+        # Come Workbook.save, ma con il logo salvato una sola volta per tutti i fogli
+        if not self.workbook.worksheets:
+            self.workbook.create_sheet()
+        self.workbook.properties.modified = datetime.datetime.now(tz=datetime.timezone.utc).replace(tzinfo=None)
+        archive = ZipFile(self.path, 'w', ZIP_DEFLATED, allowZip64=True)
+        _SharedMediaExcelWriter(self.workbook, archive).save()
+
+    def __enter__(self) -> "ReportWorkbookWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.save()
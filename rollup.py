@@ -0,0 +1,96 @@
+"""Cubo di riepilogo: numero di attività per giorno × operatore × categoria.
+
+Il cubo viene calcolato da `aggregator.py` per ogni file Excel (e salvato nel manifest),
+quindi all'aggregazione successiva basta sommare i contributi dei file senza rileggere
+le righe. Il risultato è scritto in `aggregated_rollup.csv` e servito da `/api/stats`.
+"""
+from __future__ import annotations
+from typing import List, Optional
+
+import pandas as pd
+
+from dataset_types import CATEGORY_COLUMN_NAME, DATE_COLUMN_NAME, OPERATOR_COLUMN_NAME
+
+ROLLUP_FILENAME = "aggregated_rollup.csv"
+COUNT_COLUMN_NAME = "Numero Attività"
+PERIOD_COLUMN_NAME = "Periodo"
+ROLLUP_COLUMNS = [DATE_COLUMN_NAME, OPERATOR_COLUMN_NAME, CATEGORY_COLUMN_NAME, COUNT_COLUMN_NAME]
+
+GRANULARITIES = ("daily", "weekly", "monthly")
+
+
+def rollup_frames(frames: List[pd.DataFrame]) -> list:
+    """Conta le righe dei fogli per giorno, operatore e categoria.
+
+    Restituisce una lista di `[giorno ISO, operatore, categoria, conteggio]`, serializzabile in JSON.
+    """
+    if not frames:
+        return []
+    df = pd.concat(frames, ignore_index=True)
+    df.columns = df.columns.str.strip()
+    df = df.dropna(how='all')
+    if df.empty or DATE_COLUMN_NAME not in df.columns:
+        return []
+    days = pd.to_datetime(df[DATE_COLUMN_NAME], errors="coerce").dt.strftime("%Y-%m-%d").fillna("")
+    counts = (
+        pd.DataFrame({
+            DATE_COLUMN_NAME: days,
+            OPERATOR_COLUMN_NAME: df[OPERATOR_COLUMN_NAME].fillna(""),
+            CATEGORY_COLUMN_NAME: df[CATEGORY_COLUMN_NAME].fillna(""),
+        })
+        .groupby([DATE_COLUMN_NAME, OPERATOR_COLUMN_NAME, CATEGORY_COLUMN_NAME])
+        .size()
+    )
+    return [[day, operator, category, int(n)] for (day, operator, category), n in counts.items()]
+
+
+def merge_rollups(rollups: List[list]) -> pd.DataFrame:
+    """Somma i contributi di più file in un unico cubo ordinato per giorno."""
+    rows = [row for rollup in rollups for row in rollup]
+    if not rows:
+        return pd.DataFrame(columns=ROLLUP_COLUMNS)
+    df = pd.DataFrame(rows, columns=ROLLUP_COLUMNS)
+    df = df.groupby(ROLLUP_COLUMNS[:-1], as_index=False)[COUNT_COLUMN_NAME].sum()
+    return df.sort_values(ROLLUP_COLUMNS[:-1], kind="stable").reset_index(drop=True)
+
+
+def period_totals(
+    cube: pd.DataFrame,
+    dates: pd.Series,
+    granularity: str,
+    operators: Optional[List[str]] = None,
+    categories: Optional[List[str]] = None,
+    start_date=None,
+    end_date=None,
+) -> pd.DataFrame:
+    """Totali del cubo per giorno, settimana (lunedì di inizio) o mese, per operatore e categoria."""
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Granularità non valida: {granularity}")
+    if cube.empty:
+        return pd.DataFrame(columns=[PERIOD_COLUMN_NAME] + ROLLUP_COLUMNS[1:])
+
+    mask = dates.notna()
+    if operators:
+        mask &= cube[OPERATOR_COLUMN_NAME].isin(operators)
+    if categories:
+        mask &= cube[CATEGORY_COLUMN_NAME].isin(categories)
+    if start_date:
+        mask &= dates >= pd.Timestamp(start_date)
+    if end_date:
+        mask &= dates <= pd.Timestamp(end_date)
+    selected = cube[mask]
+    selected_dates = dates[mask]
+
+    if granularity == "daily":
+        periods = selected_dates.dt.strftime("%Y-%m-%d")
+    elif granularity == "weekly":
+        periods = (selected_dates - pd.to_timedelta(selected_dates.dt.weekday, unit="D")).dt.strftime("%Y-%m-%d")
+    else:
+        periods = selected_dates.dt.strftime("%Y-%m")
+
+    totals = (
+        selected.assign(**{PERIOD_COLUMN_NAME: periods})
+        .groupby([PERIOD_COLUMN_NAME, OPERATOR_COLUMN_NAME, CATEGORY_COLUMN_NAME], as_index=False, dropna=False, observed=True)[COUNT_COLUMN_NAME]
+        .sum()
+    )
+    return totals
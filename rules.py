@@ -0,0 +1,99 @@
+"""Regole di classificazione delle attività e nomi degli operatori, lette da `rules.json`.
+
+Formato di `rules.json`:
+    {
+        "default_category": "Azione Commerciale",
+        "categories": [
+            {"category": "Contatto Cliente", "keywords": ["contatto cliente"]}
+        ],
+        "operators": {"rpacini": "Rachele"}
+    }
+
+Una riga riceve la categoria della prima regola (nell'ordine del file) con almeno una parola chiave
+contenuta in "Oggetto e descrizione", senza distinguere maiuscole e minuscole; altrimenti
+`default_category`. Gli operatori sono mappati dal login (in minuscolo) al nome da mostrare;
+i login non presenti restano invariati.
+
+Per aggiungere una categoria o un operatore basta modificare `rules.json`.
+"""
+from __future__ import annotations
+import json
+import os
+import re
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+RULES_FILENAME = "rules.json"
+
+# Usate se rules.json non è presente
+DEFAULT_RULES = {
+    "default_category": "Azione Commerciale",
+    "categories": [{"category": "Contatto Cliente", "keywords": ["contatto cliente"]}],
+    "operators": {
+        "ab001": "Alessandra", "gmoro": "Gabriella", "martines": "Martine",
+        "rpacini": "Rachele", "r.saber": "Rachida", "frosi": "Federico",
+    },
+}
+
+
+@dataclass(frozen=True)
+class Rules:
+    # (categoria, espressione regolare con tutte le sue parole chiave in minuscolo)
+    category_patterns: Tuple[Tuple[str, str], ...]
+    default_category: str
+    # login in minuscolo -> nome da mostrare
+    operators: Dict[str, str]
+
+    @property
+    def categories(self) -> List[str]:
+        """Tutte le categorie possibili, nell'ordine delle regole e con quella predefinita per ultima."""
+        names = [category for category, _ in self.category_patterns] + [self.default_category]
+        return list(dict.fromkeys(names))
+
+
+def parse_rules(config: dict) -> Rules:
+    default_category = config.get("default_category")
+    if not default_category:
+        raise ValueError("Regole non valide: manca 'default_category'")
+    patterns = []
+    for rule in config.get("categories", []):
+        category = rule.get("category")
+        keywords = [str(keyword).lower() for keyword in rule.get("keywords", []) if keyword]
+        if not category or not keywords:
+            raise ValueError(f"Regola non valida (servono 'category' e almeno una parola chiave): {rule}")
+        patterns.append((category, "|".join(re.escape(keyword) for keyword in keywords)))
+    operators = {str(login).lower(): name for login, name in config.get("operators", {}).items()}
+    return Rules(tuple(patterns), default_category, operators)
+
+
+def load_rules(path: Optional[str] = None) -> Rules:
+    """Legge le regole da `path` (default: `rules.json` accanto a questo file)."""
+    if path is None:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), RULES_FILENAME)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        print(f"File delle regole '{path}' non trovato, uso le regole predefinite.")
+        config = DEFAULT_RULES
+    return parse_rules(config)
+
+
+def classify_subjects(subjects: pd.Series, rules: Rules) -> pd.Series:
+    """Categoria di ogni riga come Series `category`, con le categorie nell'ordine di `rules.categories`."""
+    categories = rules.categories
+    text = subjects.astype(str).str.lower()
+    codes = np.full(len(text), categories.index(rules.default_category), dtype=np.int8 if len(categories) < 128 else np.int32)
+    # In ordine inverso, così in caso di più regole vale la prima
+    for category, pattern in reversed(rules.category_patterns):
+        matches = text.str.contains(pattern, regex=True).to_numpy(dtype=bool, na_value=False)
+        codes[matches] = categories.index(category)
+    return pd.Series(pd.Categorical.from_codes(codes, categories=categories), index=subjects.index, name=subjects.name)
+
+
+def map_operators(logins: pd.Series, rules: Rules) -> pd.Series:
+    """Nome da mostrare per ogni login (confronto in minuscolo)."""
+    return logins.str.lower().replace(rules.operators)
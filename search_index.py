@@ -0,0 +1,153 @@
+"""Ricerca testuale su "Note interne 1" e "Ragione sociale" (SQLite FTS5).
+
+L'indice è il file `aggregated_search.sqlite`, aggiornato da `aggregator.py` a ogni aggregazione:
+vengono indicizzati solo i lotti di ingestione nuovi (`_version`) e cancellati quelli non più presenti,
+senza ricostruire tutto. Il rowid di ogni riga è `seq << 32 | posizione nel lotto` (la chiave di `data_store`),
+quindi un lotto si cancella con un solo intervallo di rowid.
+
+Normalizzazione per l'italiano: il tokenizer `unicode61` con `remove_diacritics 2` ignora maiuscole
+e accenti ("attività" trova anche "attivita"), gli apostrofi separano le parole ("dell'azienda" ->
+"dell", "azienda") e ogni parola cercata è un prefisso ("flacon" trova "flacone" e "flaconi").
+"""
+from __future__ import annotations
+import re
+import sqlite3
+from typing import Iterable, List, Optional, Tuple
+
+import pandas as pd
+
+from data_store import batch_key_range, row_keys
+from dataset_types import (
+    CATEGORY_COLUMN_NAME,
+    COMPANY_COLUMN_NAME,
+    DATE_COLUMN_NAME,
+    NOTE_COLUMN_NAME,
+    OPERATOR_COLUMN_NAME,
+    ROW_ID_COLUMN,
+    ROW_VERSION_COLUMN,
+    format_dates,
+)
+
+SEARCH_DB_FILENAME = "aggregated_search.sqlite"
+SEARCH_TABLE = "search"
+# Delimitatori delle parole trovate nello snippet: caratteri di controllo che non compaiono nelle note,
+# così il client può fare l'escape HTML del testo e poi evidenziarle
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_END = "\x03"
+
+_SCHEMA = f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5(
+    note, company,
+    row_id UNINDEXED, day UNINDEXED, operator UNINDEXED, category UNINDEXED,
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+CREATE TABLE IF NOT EXISTS indexed_batches (seq INTEGER PRIMARY KEY);
+"""
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+def ensure_schema(conn: sqlite3.Connection) -> None:
+    conn.executescript(_SCHEMA)
+
+
+def _text(series: pd.Series) -> List[str]:
+    return series.astype(object).where(series.notna(), "").astype(str).tolist()
+
+
+def _search_rows(df: pd.DataFrame) -> Iterable[tuple]:
+    rowids = row_keys(df)
+    if DATE_COLUMN_NAME in df.columns and pd.api.types.is_datetime64_any_dtype(df[DATE_COLUMN_NAME]):
+        days = format_dates(df[DATE_COLUMN_NAME])
+    else:
+        days = df.get(DATE_COLUMN_NAME, pd.Series("", index=df.index))
+    columns = [
+        df.get(NOTE_COLUMN_NAME, pd.Series("", index=df.index)),
+        df.get(COMPANY_COLUMN_NAME, pd.Series("", index=df.index)),
+        df[ROW_ID_COLUMN],
+        days,
+        df.get(OPERATOR_COLUMN_NAME, pd.Series("", index=df.index)),
+        df.get(CATEGORY_COLUMN_NAME, pd.Series("", index=df.index)),
+    ]
+    return zip(rowids.tolist(), *(_text(column) for column in columns))
+
+
+def indexed_batches(conn: sqlite3.Connection) -> set:
+    """Numeri di sequenza dei lotti già indicizzati."""
+    ensure_schema(conn)
+    return {seq for (seq,) in conn.execute("SELECT seq FROM indexed_batches")}
+
+
+def update_search_index(conn: sqlite3.Connection, df: pd.DataFrame, seqs: Iterable[int], full_rebuild: bool = False) -> Tuple[int, int]:
+    """Allinea l'indice ai lotti `seqs`: indicizza le righe dei lotti nuovi e cancella quelli rimossi.
+
+    `df` contiene le righe aggregate con le colonne `_version` e `_id`; vengono lette solo quelle
+    dei lotti non ancora indicizzati. Con `full_rebuild` tutti i lotti vengono cancellati e
+    reindicizzati. Restituisce (lotti aggiunti, lotti rimossi).
+    """
+    seqs = set(int(seq) for seq in seqs)
+    indexed = indexed_batches(conn)
+    if full_rebuild:
+        added = sorted(seqs)
+        removed = sorted(indexed)
+    else:
+        added = sorted(seqs - indexed)
+        removed = sorted(indexed - seqs)
+    with conn:
+        for seq in removed:
+            conn.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid BETWEEN ? AND ?", batch_key_range(seq))
+            conn.execute("DELETE FROM indexed_batches WHERE seq = ?", (seq,))
+        if added and ROW_VERSION_COLUMN in df.columns:
+            new_rows = df[df[ROW_VERSION_COLUMN].isin(added)]
+            conn.executemany(
+                f"INSERT INTO {SEARCH_TABLE} (rowid, note, company, row_id, day, operator, category) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                _search_rows(new_rows),
+            )
+            conn.executemany("INSERT INTO indexed_batches (seq) VALUES (?)", [(seq,) for seq in added])
+    return len(added), len(removed)
+
+
+def match_expression(query: str) -> Optional[str]:
+    """Espressione FTS5 per il testo cercato: tutte le parole, ognuna come prefisso.
+
+    Le parole sono racchiuse tra virgolette, quindi la sintassi di FTS5 (AND, OR, NEAR, ...) digitata
+    dall'utente viene cercata come testo normale.
+    """
+    words = _WORD.findall(query or "")
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+
+def search(conn: sqlite3.Connection, query: str, limit: int = 50, offset: int = 0) -> Tuple[list, int]:
+    """Righe più pertinenti per `query` (ordinate per bm25) e numero totale di righe trovate.
+
+    `snippet` è un estratto del testo con le parole trovate tra `HIGHLIGHT_START` e `HIGHLIGHT_END`.
+    """
+    expression = match_expression(query)
+    if expression is None:
+        return [], 0
+    (total,) = conn.execute(f"SELECT count(*) FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH ?", (expression,)).fetchone()
+    rows = conn.execute(
+        f"""
+        SELECT row_id, day, operator, category, company, note,
+               snippet({SEARCH_TABLE}, -1, ?, ?, '…', 16) AS snippet
+        FROM {SEARCH_TABLE}
+        WHERE {SEARCH_TABLE} MATCH ?
+        ORDER BY bm25({SEARCH_TABLE})
+        LIMIT ? OFFSET ?
+        """,
+        (HIGHLIGHT_START, HIGHLIGHT_END, expression, limit, offset),
+    ).fetchall()
+    results = [
+        {
+            ROW_ID_COLUMN: row_id,
+            DATE_COLUMN_NAME: day,
+            OPERATOR_COLUMN_NAME: operator,
+            CATEGORY_COLUMN_NAME: category,
+            COMPANY_COLUMN_NAME: company,
+            NOTE_COLUMN_NAME: note,
+            "snippet": snippet,
+        }
+        for row_id, day, operator, category, company, note, snippet in rows
+    ]
+    return results, total
@@ -1,8 +1,147 @@
+// Service worker della dashboard: precache dei file statici e cache dei dati API.
+//
+// - File statici (index.html, immagini, manifest): stale-while-revalidate dalla cache versionata.
+// - Librerie CDN (URL con versione): cache-first.
+// - /api/data, /api/data/filters, /api/stats: stale-while-revalidate; quando il server
+//   risponde con una versione dei dati (header X-Data-Version) diversa, le risposte
+//   della versione precedente vengono eliminate.
+// - /api/data/changes: network-first, con la cache solo come fallback offline.
+//
+// Aumentare CACHE_VERSION quando cambia l'elenco dei file precaricati.
+const CACHE_VERSION = 'v1';
+const STATIC_CACHE = `static-${CACHE_VERSION}`;
+const API_CACHE = `api-${CACHE_VERSION}`;
+const DATA_VERSION_KEY = '/__data-version__';
 
-self.addEventListener('fetch', function(event) {
-    event.respondWith(
-        fetch(event.request).catch(function() {
-            // Offline fallback
-        })
+const PRECACHE_URLS = [
+    '/',
+    '/index.html',
+    '/manifest.json',
+    '/logo.png',
+    '/operatrice.png',
+    'https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/css/bootstrap.min.css',
+    'https://cdn.jsdelivr.net/npm/bootstrap@5.3.3/dist/js/bootstrap.bundle.min.js',
+    'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.3/font/bootstrap-icons.min.css',
+];
+
+self.addEventListener('install', function(event) {
+    event.waitUntil(
+        caches.open(STATIC_CACHE)
+            .then(cache => cache.addAll(PRECACHE_URLS))
+            .then(() => self.skipWaiting())
     );
 });
+
+self.addEventListener('activate', function(event) {
+    // Rimuove le cache delle versioni precedenti del service worker
+    event.waitUntil(
+        caches.keys()
+            .then(keys => Promise.all(
+                keys.filter(key => key !== STATIC_CACHE && key !== API_CACHE).map(key => caches.delete(key))
+            ))
+            .then(() => self.clients.claim())
+    );
+});
+
+async function updateDataVersion(cache, response) {
+    const version = response.headers.get('X-Data-Version');
+    if (!version) {
+        return;
+    }
+    const stored = await cache.match(DATA_VERSION_KEY);
+    const storedVersion = stored ? await stored.text() : null;
+    if (storedVersion !== version) {
+        // Nuova versione dei dati: le risposte salvate non sono più valide
+        const requests = await cache.keys();
+        await Promise.all(requests.map(request => cache.delete(request)));
+        await cache.put(DATA_VERSION_KEY, new Response(version));
+    }
+}
+
+async function staleWhileRevalidate(request, cacheName, isApi) {
+    const cache = await caches.open(cacheName);
+    const cached = await cache.match(request);
+    const network = fetch(request)
+        .then(async response => {
+            if (response.ok) {
+                if (isApi) {
+                    await updateDataVersion(cache, response);
+                }
+                await cache.put(request, response.clone());
+            }
+            return response;
+        });
+
+    if (cached) {
+        // Risposta immediata dalla cache, aggiornamento in background
+        network.catch(() => {});
+        return cached;
+    }
+    try {
+        return await network;
+    } catch (error) {
+        if (request.mode === 'navigate') {
+            const fallback = await caches.match('/index.html', { cacheName: STATIC_CACHE });
+            if (fallback) {
+                return fallback;
+            }
+        }
+        throw error;
+    }
+}
+
+async function networkFirst(request, cacheName) {
+    const cache = await caches.open(cacheName);
+    try {
+        const response = await fetch(request);
+        if (response.ok) {
+            await updateDataVersion(cache, response);
+            await cache.put(request, response.clone());
+        }
+        return response;
+    } catch (error) {
+        const cached = await cache.match(request);
+        if (cached) {
+            return cached;
+        }
+        throw error;
+    }
+}
+
+async function cacheFirst(request, cacheName) {
+    const cached = await caches.match(request);
+    if (cached) {
+        return cached;
+    }
+    const response = await fetch(request);
+    if (response.ok) {
+        const cache = await caches.open(cacheName);
+        await cache.put(request, response.clone());
+    }
+    return response;
+}
+
+self.addEventListener('fetch', function(event) {
+    const request = event.request;
+    if (request.method !== 'GET') {
+        return;
+    }
+    const url = new URL(request.url);
+
+    if (url.origin !== self.location.origin) {
+        event.respondWith(cacheFirst(request, STATIC_CACHE));
+        return;
+    }
+    if (url.pathname === '/api/data/changes') {
+        event.respondWith(networkFirst(request, API_CACHE));
+        return;
+    }
+    if (url.pathname.startsWith('/api/data/stream')) {
+        return;
+    }
+    if (url.pathname.startsWith('/api/')) {
+        event.respondWith(staleWhileRevalidate(request, API_CACHE, true));
+        return;
+    }
+    event.respondWith(staleWhileRevalidate(request, STATIC_CACHE, false));
+});
@@ -0,0 +1,62 @@
+import json
+import os
+from contextlib import closing
+
+from openpyxl import Workbook
+
+from aggregator import collect_sheet_frames
+from data_store import connect_store, fetch_records, update_data_store
+from rollup import merge_rollups
+
+HEADERS = ["Dt. ins.", "Note interne 1", "Soggetto", "Ragione sociale"]
+
+
+def _write_report(path: str, sheets: dict) -> None:
+    # Stesso layout di `attivita_giornaliere`: logo, titolo, intestazioni, dati
+    workbook = Workbook()
+    workbook.remove(workbook.active)
+    for name, rows in sheets.items():
+        worksheet = workbook.create_sheet(name)
+        worksheet.append(["logo"])
+        worksheet.append(["titolo"])
+        worksheet.append(HEADERS)
+        for row in rows:
+            worksheet.append(row)
+    workbook.save(path)
+
+
+def _aggregate(base_dir: str, full_rebuild: bool = False):
+    excel_files = sorted(
+        os.path.join(base_dir, name) for name in os.listdir(base_dir) if name.startswith("OpzioniEsportazione")
+    )
+    frames, manifest = collect_sheet_frames(base_dir, excel_files, full_rebuild=full_rebuild, engine="openpyxl")
+    with closing(connect_store(os.path.join(base_dir, "aggregated_data.sqlite"))) as conn:
+        sources = {entry["seq"]: entry["path"] for entry in manifest["files"].values()}
+        update_data_store(conn, frames, sources, manifest["sequence"], full_rebuild=full_rebuild)
+        columns = json.loads(dict(conn.execute("SELECT key, value FROM meta"))["columns"])
+        records = fetch_records(conn, columns)
+    rollup = merge_rollups([entry["rollup"] for entry in manifest["files"].values()])
+    return records, rollup.to_dict(orient="records")
+
+
+def test_incremental_matches_full_rebuild(tmp_path):
+    base_dir = str(tmp_path)
+    paths = [os.path.join(base_dir, f"OpzioniEsportazione_2025_08_0{day}.xlsx") for day in (1, 2, 3)]
+    for day, path in enumerate(paths, start=1):
+        _write_report(path, {
+            "Rachele_Contatto Cliente": [[f"2025-08-0{day}", f"nota {day}", 100 + day, "ACME"]],
+            "Gabriella_Azione Commerciale": [[f"2025-08-0{day}", "altra nota", 200 + day, "BETA"]] * day,
+        })
+    _aggregate(base_dir)
+
+    # File cancellato, file solo toccato, file con il contenuto sostituito
+    os.remove(paths[0])
+    os.utime(paths[1], ns=(os.stat(paths[1]).st_atime_ns, os.stat(paths[1]).st_mtime_ns + 10**9))
+    _write_report(paths[2], {"Rachele_Contatto Cliente": [["2025-08-04", "nota sostituita", 99, "GAMMA"]]})
+    incremental = _aggregate(base_dir)
+
+    full = _aggregate(base_dir, full_rebuild=True)
+    assert incremental == full
+    records, rollup = full
+    assert sorted(row["Note interne 1"] for row in records) == ["altra nota", "altra nota", "nota 2", "nota sostituita"]
+    assert sum(row["Numero Attività"] for row in rollup) == 4
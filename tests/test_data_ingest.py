@@ -0,0 +1,86 @@
+import io
+import json
+import zipfile
+from contextlib import closing
+
+import pandas as pd
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from data_ingest import CurrentDataFiles, IngestError, ingest_bundle, read_current
+from data_store import SHEET_NAME_ATTR, connect_store, update_data_store
+
+
+def _bundle(tmp_path, extra=None) -> bytes:
+    # Pacchetto minimo: archivio SQLite con un foglio e stato di sincronizzazione
+    store_path = tmp_path / "aggregated_data.sqlite"
+    frame = pd.DataFrame({"Operatore": ["Rachele"], "Categoria": ["Contatto"], "Soggetto": [7], "_version": [1], "_id": ["1-0"]})
+    frame.attrs[SHEET_NAME_ATTR] = "Rachele_Contatto"
+    with closing(connect_store(str(store_path))) as conn:
+        update_data_store(conn, [frame], {1: "a.xlsx"}, version=1)
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        zf.write(store_path, "aggregated_data.sqlite")
+        zf.writestr("aggregated_version.json", json.dumps({"version": 1, "removed": []}))
+        for name, content in (extra or {}).items():
+            zf.writestr(name, content)
+    store_path.unlink()
+    return buffer.getvalue()
+
+
+def _ingest(tmp_path, content: bytes):
+    bundle_path = tmp_path / "bundle.zip"
+    bundle_path.write_bytes(content)
+    return ingest_bundle(str(bundle_path), str(tmp_path / "base"))
+
+
+def test_ingest_bundle(tmp_path):
+    content = _bundle(tmp_path)
+    version, changed = _ingest(tmp_path, content)
+    assert changed
+    current = read_current(str(tmp_path / "base"))
+    assert current["version"] == version and current["rows"] == 1
+    assert (tmp_path / "base" / "ingested" / version / "aggregated_data.sqlite").is_file()
+    # Stesso pacchetto: nessuna nuova versione
+    assert _ingest(tmp_path, content) == (version, False)
+
+
+@pytest.mark.parametrize("content", [
+    b"non uno zip",
+    {"../main.py": "print()"},
+    {"main.py": "print()"},
+    {"aggregated_version.json": "{}"},
+])
+def test_ingest_bundle_rejects_invalid(tmp_path, content):
+    if isinstance(content, dict):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as zf:
+            for name, data in content.items():
+                zf.writestr(name, data)
+        content = buffer.getvalue()
+    with pytest.raises(IngestError):
+        _ingest(tmp_path, content)
+    assert read_current(str(tmp_path / "base")) is None
+    assert not list((tmp_path / "base" / "ingested").iterdir())
+
+
+def test_ingest_endpoint_auth(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "base_dir", str(tmp_path))
+    monkeypatch.setattr(main, "data_files", CurrentDataFiles(str(tmp_path)))
+    client = TestClient(main.app)
+
+    monkeypatch.delenv("INGEST_TOKEN", raising=False)
+    assert client.post("/api/ingest", content=b"x", headers={"Authorization": "Bearer segreto"}).status_code == 404
+
+    monkeypatch.setenv("INGEST_TOKEN", "segreto")
+    for headers in ({}, {"Authorization": "Bearer sbagliato"}, {"Authorization": "segreto"}):
+        response = client.post("/api/ingest", content=b"x", headers=headers)
+        assert response.status_code == 401
+    # Le richieste rifiutate non scrivono nulla su disco
+    assert not (tmp_path / "ingested").exists()
+
+    headers = {"Authorization": "Bearer segreto"}
+    assert client.post("/api/ingest", content=b"non uno zip", headers=headers).status_code == 400
+    response = client.post("/api/ingest", content=_bundle(tmp_path), headers=headers)
+    assert response.status_code == 200 and response.json()["changed"] is True
@@ -0,0 +1,65 @@
+import json
+from contextlib import closing
+
+import pandas as pd
+
+from data_store import SHEET_NAME_ATTR, connect_store, fetch_records, update_data_store
+from data_sync import changes_since
+
+COLUMNS = ["Dt. ins.", "Operatore", "Categoria", "Soggetto", "_version", "_id"]
+
+
+def _sheet(seq: int, sheet: str, subjects: list, first_row: int = 0) -> pd.DataFrame:
+    # Foglio come lo produce `aggregator.parse_workbook`: `_version` = seq, `_id` = "seq-posizione"
+    operator, category = sheet.split("_", 1)
+    frame = pd.DataFrame({
+        "Dt. ins.": ["2025-08-01"] * len(subjects),
+        "Operatore": [operator] * len(subjects),
+        "Categoria": [category] * len(subjects),
+        "Soggetto": subjects,
+        "_version": [seq] * len(subjects),
+        "_id": [f"{seq}-{first_row + i}" for i in range(len(subjects))],
+    })
+    frame.attrs[SHEET_NAME_ATTR] = sheet
+    return frame
+
+
+def _subjects(conn) -> list:
+    return sorted(row["Soggetto"] for row in fetch_records(conn, COLUMNS))
+
+
+def test_update_replaces_and_deletes_batches(tmp_path):
+    with closing(connect_store(str(tmp_path / "aggregated_data.sqlite"))) as conn:
+        frames = [_sheet(1, "Rachele_Contatto", [1, 2]), _sheet(2, "Gabriella_Azione", [3], first_row=0)]
+        assert update_data_store(conn, frames, {1: "a.xlsx", 2: "b.xlsx"}, version=2) == (3, 0)
+        assert _subjects(conn) == [1, 2, 3]
+
+        # a.xlsx rielaborato come lotto 3: le righe dello stesso foglio vengono sostituite
+        assert update_data_store(conn, [_sheet(3, "Rachele_Contatto", [10])], {2: "b.xlsx", 3: "a.xlsx"}, version=3) == (1, 2)
+        assert _subjects(conn) == [3, 10]
+
+        # b.xlsx cancellato: il lotto 2 non è più tra le sorgenti
+        assert update_data_store(conn, [], {3: "a.xlsx"}, version=4) == (0, 1)
+        assert _subjects(conn) == [10]
+        assert conn.execute("SELECT typeof(\"Soggetto\") FROM records").fetchone()[0] == "integer"
+
+
+def test_changes_since(tmp_path):
+    with closing(connect_store(str(tmp_path / "aggregated_data.sqlite"))) as conn:
+        update_data_store(conn, [_sheet(1, "Rachele_Contatto", [1]), _sheet(2, "Gabriella_Azione", [2])], {1: "a.xlsx", 2: "b.xlsx"}, version=2)
+        update_data_store(conn, [_sheet(3, "Rachele_Contatto", [3])], {2: "b.xlsx", 3: "a.xlsx"}, version=3)
+        sync_state = {"version": 3, "removed": [[1, 3]], "min_version": 0}
+
+        changes = json.loads(changes_since(conn, COLUMNS, sync_state, since=2))
+        assert changes["reset"] is False
+        assert [row["Soggetto"] for row in changes["added"]] == [3]
+        assert changes["removed"] == [1]
+
+        assert json.loads(changes_since(conn, COLUMNS, sync_state, since=3))["added"] == []
+
+        # Versione sconosciuta al server o più vecchia di `min_version`: dataset completo
+        for since, state in ((5, sync_state), (1, dict(sync_state, min_version=2))):
+            changes = json.loads(changes_since(conn, COLUMNS, state, since=since))
+            assert changes["reset"] is True
+            assert sorted(row["Soggetto"] for row in changes["added"]) == [2, 3]
+            assert changes["removed"] == []
@@ -0,0 +1,40 @@
+import os
+import threading
+import zipfile
+
+from export_watcher import ExportWatcher, file_signature
+
+
+def _write_export(path: str, content: str = "dati") -> None:
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("xl/workbook.xml", content)
+
+
+def test_wait_for_file_written_before_start(tmp_path):
+    # L'automazione salva l'export prima che il watcher venga creato
+    path = os.path.join(tmp_path, "OpzioniEsportazione_2025_08_04.xlsx")
+    _write_export(path)
+    with ExportWatcher(str(tmp_path), settle_seconds=0.1, poll_interval=0.05, use_events=False) as watcher:
+        assert watcher.wait_for(path, timeout=2)
+
+
+def test_wait_for_ignores_previous_version(tmp_path):
+    path = os.path.join(tmp_path, "OpzioniEsportazione_2025_08_04.xlsx")
+    _write_export(path)
+    previous = file_signature(path)
+    with ExportWatcher(str(tmp_path), settle_seconds=0.1, poll_interval=0.05, use_events=False) as watcher:
+        assert not watcher.wait_for(path, timeout=0.5, previous=previous)
+
+
+def test_mark_handled_from_another_thread(tmp_path):
+    # La pipeline segna i file elaborati dai suoi thread mentre il watcher li osserva
+    path = os.path.join(tmp_path, "OpzioniEsportazione_2025_08_04.xlsx")
+    with ExportWatcher(str(tmp_path), settle_seconds=0.1, poll_interval=0.05, use_events=False) as watcher:
+        watcher.mark_busy(path)
+        _write_export(path)
+        worker = threading.Thread(target=watcher.mark_handled, args=(path,))
+        worker.start()
+        worker.join()
+        assert list(watcher.completed_files(timeout=0.5)) == []
+        _write_export(path, "dati aggiornati")
+        assert list(watcher.completed_files(timeout=2)) == [os.path.abspath(path)]
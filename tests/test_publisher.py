@@ -0,0 +1,53 @@
+import os
+
+from publisher import DirectoryTarget, Publisher
+
+
+def _write(path, content: str) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def _read(path) -> str:
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def test_directory_target_copies_and_removes(tmp_path):
+    base_dir, dest = tmp_path / "base", tmp_path / "pubblicati"
+    _write(base_dir / "aggregated_rollup.csv", "v1")
+    _write(base_dir / "aggregated_data_arrow" / "part-0.arrow", "colonne")
+    target = DirectoryTarget(str(dest), str(base_dir))
+    paths = ["aggregated_rollup.csv", "aggregated_data_arrow"]
+
+    assert target.commit(paths, "prima")
+    assert _read(dest / "aggregated_rollup.csv") == "v1"
+    assert _read(dest / "aggregated_data_arrow" / "part-0.arrow") == "colonne"
+
+    # File aggiornato, cartella rimossa dalla sorgente: la destinazione segue
+    _write(base_dir / "aggregated_rollup.csv", "v2")
+    (base_dir / "aggregated_data_arrow" / "part-0.arrow").unlink()
+    (base_dir / "aggregated_data_arrow").rmdir()
+    target.commit(paths, "seconda")
+    assert _read(dest / "aggregated_rollup.csv") == "v2"
+    assert not (dest / "aggregated_data_arrow").exists()
+    assert sorted(os.listdir(dest)) == ["aggregated_rollup.csv"]
+
+
+def test_publisher_skips_unchanged_data(tmp_path):
+    base_dir = tmp_path / "base"
+    _write(base_dir / "aggregated_rollup.csv", "v1")
+    publisher = Publisher(DirectoryTarget(str(tmp_path / "pubblicati"), str(base_dir)), str(base_dir), str(tmp_path / "stato" / "published.json"))
+    paths = ["aggregated_rollup.csv"]
+
+    assert publisher.commit(paths)
+    publisher.push()
+    assert publisher.flush(timeout=10)
+    # Stesso contenuto già pubblicato e inviato: niente da fare, anche con un nuovo Publisher
+    publisher = Publisher(publisher.target, str(base_dir), publisher.state_path)
+    assert not publisher.commit(paths)
+
+    _write(base_dir / "aggregated_rollup.csv", "v2")
+    assert publisher.commit(paths)
+    assert _read(tmp_path / "pubblicati" / "aggregated_rollup.csv") == "v2"
@@ -0,0 +1,43 @@
+import pandas as pd
+import pytest
+
+from rules import DEFAULT_RULES, classify_subjects, load_rules, map_operators, parse_rules
+
+
+def test_first_matching_rule_wins():
+    rules = parse_rules({
+        "default_category": "Azione Commerciale",
+        "categories": [
+            {"category": "Contatto Cliente", "keywords": ["contatto cliente"]},
+            {"category": "Preventivo", "keywords": ["preventivo", "offerta (bozza)"]},
+        ],
+    })
+    subjects = pd.Series([
+        "CONTATTO CLIENTE per preventivo",
+        "Invio Preventivo",
+        "offerta (bozza) inviata",
+        "visita in sede",
+        None,
+    ])
+    categories = classify_subjects(subjects, rules)
+    assert categories.tolist() == ["Contatto Cliente", "Preventivo", "Preventivo", "Azione Commerciale", "Azione Commerciale"]
+    assert list(categories.cat.categories) == ["Contatto Cliente", "Preventivo", "Azione Commerciale"]
+
+
+def test_rules_json():
+    rules = load_rules()
+    assert rules.default_category == DEFAULT_RULES["default_category"]
+    categories = classify_subjects(pd.Series(["Contatto cliente telefonico", "Altro"]), rules)
+    assert categories.tolist() == ["Contatto Cliente", "Azione Commerciale"]
+    assert map_operators(pd.Series(["RPacini", "gmoro"]), rules).tolist() == ["Rachele", "Gabriella"]
+
+
+def test_missing_rules_file_uses_defaults(tmp_path):
+    assert load_rules(str(tmp_path / "rules.json")) == parse_rules(DEFAULT_RULES)
+
+
+def test_invalid_rules():
+    with pytest.raises(ValueError):
+        parse_rules({"categories": []})
+    with pytest.raises(ValueError):
+        parse_rules({"default_category": "Azione Commerciale", "categories": [{"category": "Vuota", "keywords": []}]})